@@ -0,0 +1,436 @@
+"""Shared helpers and benchmark harness of the cuML notebooks.
+
+Every notebook used to carry its own `Timer`, `load_data` and
+`array_equal`, and timed each algorithm once with `%%time`. They now
+import those helpers from here, and the same module measures any
+workload the same way: warm-up runs, then repeated timed runs reported
+as median/p95/min, one extra run under `tracemalloc` for the peak host
+memory it allocates (NumPy buffers included; device memory is not
+seen), and sweeps over `nrows`/`ncols`. Each workload has the
+scikit-learn implementation as its baseline; other implementations
+(cuML when it is installed, CPU alternatives) register under the same
+workload, are checked against the baseline's result and reported with
+their speedup. Records can be written as JSON or CSV.
+
+Run `python benchmark.py WORKLOAD [--nrows N,...] [--ncols N,...]
+[--repeat N] [--json PATH] [--csv PATH]` to benchmark a workload, e.g.
+`python benchmark.py pca --nrows 65536,262144 --ncols 40`.
+"""
+import csv
+import gzip
+import json
+import os
+import time
+import tracemalloc
+from collections import OrderedDict
+from timeit import default_timer
+
+import numpy as np
+
+
+MORTGAGE_CACHE = 'data/mortgage.npy.gz'
+# written by `python matrix_store.py convert`; read in place of the archive when present
+MORTGAGE_STORE = 'data/mortgage.store'
+
+# column of the mortgage sample used as the regression label
+LABEL_COLUMN = 4
+
+
+class Timer(object):
+    """ Wall time of a `with` block, in `interval` seconds """
+
+    def __init__(self):
+        self._timer = default_timer
+        self.interval = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """Start the timer."""
+        self.begin = self._timer()
+
+    def stop(self):
+        """Stop the timer. Calculate the interval in seconds."""
+        self.end = self._timer()
+        self.interval = self.end - self.begin
+
+
+def load_matrix(nrows, ncols, cached=MORTGAGE_CACHE, source='mortgage', dtype=np.float64, seed=None, store=MORTGAGE_STORE):
+    """ `nrows` random rows of the first `ncols` columns of the mortgage sample
+
+    Reads only the sampled rows of the memory mapped store when it has
+    been converted, otherwise decompresses the whole archive. Falls back
+    to uniform random data when the sample is missing or `source` is not
+    'mortgage'.
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    rng = np.random.RandomState(seed)
+    if os.path.exists(store) and source == 'mortgage':
+        from matrix_store import MatrixStore
+        print('use mortgage data (store)')
+        X = MatrixStore(store)
+        return X.rows(rng.randint(0, X.shape[0] - 1, nrows), slice(0, ncols))
+    if os.path.exists(cached) and source == 'mortgage':
+        print('use mortgage data')
+        with gzip.open(cached) as f:
+            X = np.load(f)
+        return X[rng.randint(0, X.shape[0] - 1, nrows), :ncols]
+    print('use random data')
+    return rng.rand(nrows, ncols).astype(dtype)
+
+
+def to_frame(X):
+    import pandas as pd
+    return pd.DataFrame({'fea%d' % i: X[:, i] for i in range(X.shape[1])})
+
+
+def load_data(nrows, ncols, cached=MORTGAGE_CACHE, source='mortgage', dtype=np.float64, fillna=None):
+    """ `load_matrix` as a pandas DataFrame with columns fea0, fea1, ... """
+    df = to_frame(load_matrix(nrows, ncols, cached=cached, source=source, dtype=dtype))
+    return df if fillna is None else df.fillna(fillna)
+
+
+def load_regression_data(nrows, ncols, cached=MORTGAGE_CACHE, train_fraction=0.8, store=MORTGAGE_STORE):
+    """ Train/test split of a regression problem on the mortgage sample
+
+    The label is column 4 (adj_remaining_months_to_maturity) of the
+    sample once column 4 itself is removed from the features, as the
+    regression notebooks always did; random data gets integer labels.
+
+    Returns
+    -------
+    (X_train, X_test, y_train, y_test) pandas DataFrames
+    """
+    if os.path.exists(store):
+        from matrix_store import MatrixStore
+        print('use mortgage data (store)')
+        matrix = MatrixStore(store)
+        features = [i for i in range(matrix.shape[1]) if i != LABEL_COLUMN]
+        rindices = np.random.randint(0, matrix.shape[0] - 1, nrows)
+        sampled = matrix.rows(rindices, features[:ncols] + [features[LABEL_COLUMN]])
+        X, y = sampled[:, :-1], sampled[:, -1:]
+    elif os.path.exists(cached):
+        print('use mortgage data')
+        with gzip.open(cached) as f:
+            X = np.load(f)
+        X = X[:, [i for i in range(X.shape[1]) if i != LABEL_COLUMN]]
+        y = X[:, LABEL_COLUMN:LABEL_COLUMN + 1]
+        rindices = np.random.randint(0, X.shape[0] - 1, nrows)
+        X = X[rindices, :ncols]
+        y = y[rindices]
+    else:
+        print('use random data')
+        X = np.random.rand(nrows, ncols)
+        y = np.random.randint(0, 10, size=(nrows, 1))
+    train_rows = int(nrows * train_fraction)
+    return to_frame(X[:train_rows]), to_frame(X[train_rows:]), to_frame(y[:train_rows]), to_frame(y[train_rows:])
+
+
+def to_nparray(x):
+    """ NumPy array of a NumPy, pandas or cudf result """
+    if isinstance(x, np.ndarray):
+        return x
+    if isinstance(x, (np.floating, float, int)):
+        return np.array([x])
+    if hasattr(x, 'to_pandas'):
+        # cudf DataFrame/Series
+        return np.asarray(x.to_pandas().values)
+    return np.asarray(x)
+
+
+def array_equal(a, b, threshold=2e-3, with_sign=True, metric='mse'):
+    """ Whether two results agree within `threshold`
+
+    Parameters
+    ----------
+    with_sign : bool
+        False compares absolute values, for results only defined up to
+        sign (components, singular vectors)
+    metric : str
+        'mse' compares the mean squared error, 'mismatch' the share of
+        differing elements
+    """
+    a = to_nparray(a).ravel()
+    b = to_nparray(b).ravel()
+    if not with_sign:
+        a, b = np.abs(a), np.abs(b)
+    if metric == 'mse':
+        error = np.mean((a.astype(np.float64) - b) ** 2)
+    else:
+        error = np.mean(a != b)
+    return error < threshold
+
+
+def accuracy(a, b, threshold=1e-3):
+    """ Whether the share of elements differing by more than 1 is below `threshold` """
+    c = to_nparray(a) - to_nparray(b)
+    return np.mean(c > 1) < threshold
+
+
+def peak_memory(func, *args):
+    """ Peak host memory allocated while `func(*args)` runs, in bytes """
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.clear_traces()
+    before = tracemalloc.get_traced_memory()[0]
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    try:
+        func(*args)
+        return max(0, tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+
+def measure(func, *args, **kwargs):
+    """ Times `func(*args)` after warm-up runs
+
+    Parameters
+    ----------
+    warmup : int
+        untimed runs first (JIT compilation, caches, lazy initialization)
+    repeat : int
+        timed runs
+    memory : bool
+        one more run under tracemalloc for the peak allocation; it is
+        kept out of the timings because tracing slows allocations down
+
+    Returns
+    -------
+    dict with the last result under "result", the run times under
+    "times" and their "median", "p95", "min" and "mean", and "peak_bytes"
+    """
+    warmup = kwargs.pop('warmup', 1)
+    repeat = kwargs.pop('repeat', 5)
+    memory = kwargs.pop('memory', True)
+    if kwargs:
+        raise TypeError("unexpected arguments: %s" % ", ".join(kwargs))
+    result = None
+    for _ in range(warmup):
+        result = func(*args)
+    times = []
+    for _ in range(repeat):
+        with Timer() as timer:
+            result = func(*args)
+        times.append(timer.interval)
+    return {
+        'result': result,
+        'times': times,
+        'median': float(np.median(times)),
+        'p95': float(np.percentile(times, 95)),
+        'min': float(np.min(times)),
+        'mean': float(np.mean(times)),
+        'peak_bytes': peak_memory(func, *args) if memory else None,
+    }
+
+
+class Implementation(object):
+    """ One way of running a workload
+
+    Parameters
+    ----------
+    run : callable
+        `run(data)` returns the result compared against the baseline
+    prepare : callable
+        `prepare(X)` turns the input matrix into `data` (e.g. a cudf
+        DataFrame) outside the timed runs; defaults to the matrix itself
+    check : callable
+        `check(baseline_result, result)` returns whether they agree, or a
+        score such as recall for approximate implementations
+    """
+
+    def __init__(self, name, run, prepare=None, check=None):
+        self.name = name
+        self.run = run
+        self.prepare = prepare
+        self.check = check
+
+
+WORKLOADS = OrderedDict()
+
+
+def register(workload, name, run, prepare=None, check=None, baseline=False):
+    """ Adds an implementation to a workload; the baseline goes first """
+    implementations = WORKLOADS.setdefault(workload, OrderedDict())
+    implementations[name] = Implementation(name, run, prepare=prepare, check=check)
+    if baseline:
+        implementations.move_to_end(name, last=False)
+    return implementations[name]
+
+
+def compare(workload, X, implementations=None, warmup=1, repeat=5, memory=True):
+    """ Runs the implementations of a workload on the same input
+
+    The first implementation is the baseline: every other one is checked
+    against its result and reported with its speedup over it.
+
+    Returns
+    -------
+    list of dict records
+    """
+    available = WORKLOADS[workload]
+    names = implementations or list(available)
+    records = []
+    baseline = None
+    for name in names:
+        implementation = available[name]
+        data = implementation.prepare(X) if implementation.prepare else X
+        stats = measure(implementation.run, data, warmup=warmup, repeat=repeat, memory=memory)
+        record = OrderedDict([
+            ('workload', workload), ('implementation', name), ('nrows', X.shape[0]), ('ncols', X.shape[1]),
+            ('repeat', repeat), ('median', stats['median']), ('p95', stats['p95']), ('min', stats['min']),
+            ('mean', stats['mean']), ('peak_bytes', stats['peak_bytes']), ('speedup', 1.0), ('matches', True),
+        ])
+        if baseline is None:
+            baseline = stats
+        else:
+            record['speedup'] = baseline['median'] / stats['median'] if stats['median'] else float('inf')
+            if implementation.check is not None:
+                matches = implementation.check(baseline['result'], stats['result'])
+                record['matches'] = matches if isinstance(matches, float) else bool(matches)
+            else:
+                record['matches'] = None
+        records.append(record)
+    return records
+
+
+def sweep(workload, nrows=(2 ** 14,), ncols=(40,), implementations=None, load=load_matrix, **kwargs):
+    """ `compare` over every (nrows, ncols) combination
+
+    Returns
+    -------
+    list of dict records
+    """
+    records = []
+    for rows in nrows:
+        for cols in ncols:
+            X = load(rows, cols)
+            records += compare(workload, X, implementations=implementations, **kwargs)
+    return records
+
+
+def write_json(records, path):
+    with open(path, 'w') as f:
+        json.dump({'created': time.time(), 'records': records}, f, indent=1)
+
+
+def write_csv(records, path):
+    with open(path, 'w') as f:
+        writer = csv.DictWriter(f, fieldnames=list(records[0]))
+        writer.writeheader()
+        writer.writerows(records)
+
+
+def report(records):
+    """ The records as an aligned text table """
+    lines = ["%-10s %-20s %9s %6s %10s %10s %10s %9s %8s" % (
+        'workload', 'implementation', 'nrows', 'ncols', 'median s', 'p95 s', 'peak MB', 'speedup', 'matches')]
+    for r in records:
+        peak = '%10.1f' % (r['peak_bytes'] / 1e6) if r['peak_bytes'] is not None else '%10s' % '-'
+        lines.append("%-10s %-20s %9d %6d %10.4f %10.4f %s %8.2fx %8s" % (
+            r['workload'], r['implementation'], r['nrows'], r['ncols'], r['median'], r['p95'], peak,
+            r['speedup'], _matches_text(r['matches'])))
+    return "\n".join(lines)
+
+
+def _matches_text(matches):
+    if isinstance(matches, float):
+        return '%.3f' % matches
+    return {True: 'yes', False: 'NO', None: '-'}[matches]
+
+
+def _to_cudf(X):
+    import cudf
+    return cudf.DataFrame.from_pandas(to_frame(X))
+
+
+def _register_workloads():
+    """ scikit-learn baselines of the notebooks, and cuML where it is installed """
+    from sklearn.cluster import DBSCAN as skDBSCAN
+    from sklearn.decomposition import PCA as skPCA, TruncatedSVD as skTSVD
+    from sklearn.neighbors import NearestNeighbors as skKNN
+
+    def same_abs(threshold):
+        return lambda a, b: array_equal(a, b, threshold=threshold, with_sign=False)
+
+    register('pca', 'sklearn', lambda X: skPCA(n_components=10, svd_solver='full', random_state=42).fit_transform(X),
+             baseline=True)
+    register('tsvd', 'sklearn', lambda X: skTSVD(n_components=10, algorithm='arpack', random_state=42).fit_transform(X),
+             baseline=True)
+    register('knn', 'sklearn', lambda X: skKNN(metric='sqeuclidean').fit(X).kneighbors(X, 10), baseline=True)
+    register('dbscan', 'sklearn', lambda X: skDBSCAN(eps=3, min_samples=2).fit(X).labels_, baseline=True)
+
+    from ann_index import IVFIndex, recall_at_k, true_distances
+
+    def ivf_knn(pq_m):
+        def run(X):
+            indices = IVFIndex(pq_m=pq_m).fit(X).search(X, 10)[1]
+            return true_distances(X, X, indices), indices, X
+        return run
+
+    def recall(a, b):
+        # the baseline's k-th distances recomputed like the returned ones, in float64
+        return recall_at_k(true_distances(b[2], b[2], a[1]), b[0])
+
+    register('knn', 'ivf', ivf_knn(None), check=recall)
+    register('knn', 'ivfpq', ivf_knn(8), check=recall)
+
+    from grid_dbscan import GridDBSCAN
+    register('dbscan', 'grid', lambda X: GridDBSCAN(eps=3, min_samples=2).fit(X).labels_,
+             check=lambda a, b: array_equal(a, b, threshold=1e-12, metric='mismatch'))
+    try:
+        import cuml
+    except ImportError:
+        return
+    register('pca', 'cuml', lambda X: cuml.PCA(n_components=10, svd_solver='full', random_state=42).fit_transform(X),
+             prepare=_to_cudf, check=same_abs(2e-3))
+    register('tsvd', 'cuml', lambda X: cuml.TruncatedSVD(n_components=10, algorithm='full', random_state=42).fit_transform(X),
+             prepare=_to_cudf, check=same_abs(0.1))
+    from cuml.neighbors.nearest_neighbors import NearestNeighbors as cumlKNN
+    register('knn', 'cuml', lambda X: cumlKNN().fit(X).kneighbors(X, 10), prepare=_to_cudf,
+             check=lambda a, b: array_equal(a[0], b[0], threshold=1e-12))
+    register('dbscan', 'cuml', lambda X: cuml.DBSCAN(eps=3, min_samples=2).fit(X).labels_, prepare=_to_cudf,
+             check=lambda a, b: array_equal(a, b, threshold=5e-3))
+
+
+def _sizes(text):
+    """ "2**14,50000" -> [16384, 50000] """
+    sizes = []
+    for size in text.split(','):
+        base, _, exponent = size.partition('**')
+        sizes.append(int(base) ** int(exponent) if exponent else int(base))
+    return sizes
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="benchmark a cuML notebook workload against its scikit-learn baseline")
+    parser.add_argument('workload')
+    parser.add_argument('--nrows', type=_sizes, default=[2 ** 14], help="comma separated, e.g. 2**14,2**16")
+    parser.add_argument('--ncols', type=_sizes, default=[40])
+    parser.add_argument('--implementations', help="comma separated, the first one is the baseline")
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json')
+    parser.add_argument('--csv')
+    args = parser.parse_args()
+
+    _register_workloads()
+    records = sweep(args.workload, nrows=args.nrows, ncols=args.ncols, warmup=args.warmup, repeat=args.repeat,
+                    implementations=args.implementations.split(',') if args.implementations else None)
+    print(report(records))
+    if args.json:
+        write_json(records, args.json)
+    if args.csv:
+        write_csv(records, args.csv)
@@ -0,0 +1,270 @@
+"""DBSCAN on CPU for many low-dimensional points, with a spatial index.
+
+`dbscan_demo` compares against scikit-learn on 5000 x 128 samples, but
+our clustering workloads are millions of points in a few dimensions,
+where the eps-neighborhood search dominates. `GridDBSCAN` hashes the
+points into a uniform grid of cells of side eps / resolution: every
+neighbor of a point lies in the stencil of cells around its own, so only
+those pairs of cells (half of them, by symmetry) are compared, in
+vectorized chunks on `n_jobs` threads. Above `max_grid_dims` dimensions the grid
+stencil grows too large and the pairs come from a KD-tree
+(`scipy.spatial.cKDTree`), or from blocked brute force without SciPy.
+
+Two passes over the pairs within eps: the first counts neighbors to find
+the core points, the second merges core points with a vectorized
+union-find and collects the core neighbors of the other points. Clusters
+are numbered by their smallest core point, and a border point joins the
+lowest numbered cluster it touches, which is the order scikit-learn's
+expansion assigns them in, so the labels are directly comparable.
+
+Run `python grid_dbscan.py [ROWS,...] [DIMS,...]` for a scaling
+benchmark against scikit-learn.
+"""
+import itertools
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+
+MAX_CHUNK_PAIRS = 1 << 21
+MAX_KEPT_PAIRS = 1 << 26
+
+
+def _stencil(d, resolution):
+    """ Offsets to the cells that may hold a point within eps of a cell of side eps / resolution
+
+    Only one of each pair of opposite offsets is kept: the pair of cells
+    is compared once, from its first cell.
+    """
+    offsets = []
+    for offset in itertools.product(range(-resolution, resolution + 1), repeat=d):
+        nonzero = [step for step in offset if step]
+        if nonzero and nonzero[0] < 0:
+            continue
+        # closest points of the two cells, in cell sides
+        gap = sum(max(abs(step) - 1, 0) ** 2 for step in offset)
+        if gap < resolution ** 2:
+            offsets.append(offset)
+    return np.array(offsets, dtype=np.int64).reshape(-1, d)
+
+
+def _grid_pairs(X, eps, n_jobs, resolution=1, max_chunk_pairs=MAX_CHUNK_PAIRS):
+    """ Yields (i, j) index arrays of the pairs i != j within eps, each unordered pair once """
+    n, d = X.shape
+    cells = np.floor((X - X.min(axis=0)) * (resolution / eps)).astype(np.int64) + resolution
+    # empty cells of padding on each side, so that neighbor keys never wrap
+    shape = cells.max(axis=0) + 1 + resolution
+    keys = np.ravel_multi_index(cells.T, shape)
+    order = np.argsort(keys, kind='stable')
+    columns = [np.ascontiguousarray(X[order, k]) for k in range(d)]
+    occupied, starts, sizes = np.unique(keys[order], return_index=True, return_counts=True)
+    strides = np.cumprod(np.concatenate([shape[1:], [1]])[::-1])[::-1]
+    cell_a, cell_b = [], []
+    for step in _stencil(d, resolution).dot(strides):
+        neighbor = np.minimum(np.searchsorted(occupied, occupied + step), len(occupied) - 1)
+        found = np.flatnonzero(occupied[neighbor] == occupied + step)
+        cell_a.append(found)
+        cell_b.append(neighbor[found])
+    cell_a = np.concatenate(cell_a)
+    cell_b = np.concatenate(cell_b)
+    pair_sizes = sizes[cell_a] * sizes[cell_b]
+    bounds = np.searchsorted(np.cumsum(pair_sizes), np.arange(max_chunk_pairs, pair_sizes.sum(), max_chunk_pairs))
+    eps2 = eps * eps
+
+    def chunk(selection):
+        a, b = cell_a[selection], cell_b[selection]
+        size_b = sizes[b]
+        counts = sizes[a] * size_b
+        which = np.repeat(np.arange(len(a)), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        pa = starts[a][which] + k // size_b[which]
+        pb = starts[b][which] + k % size_b[which]
+        # within a cell keep each unordered pair once
+        keep = (a[which] != b[which]) | (pa < pb)
+        pa, pb = pa[keep], pb[keep]
+        distance = np.zeros(len(pa))
+        for column in columns:
+            difference = column[pa] - column[pb]
+            distance += difference * difference
+        within = distance <= eps2
+        return order[pa[within]], order[pb[within]]
+
+    selections = np.split(np.arange(len(cell_a)), np.unique(np.minimum(bounds + 1, len(cell_a))))
+    selections = [selection for selection in selections if len(selection)]
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        for pairs in pool.map(chunk, selections):
+            yield pairs
+
+
+def _brute_pairs(X, eps, n_jobs, batch_size=1024):
+    """ Same pairs as `_grid_pairs`, comparing blocks of rows with all the others """
+    eps2 = eps * eps
+    norms = np.einsum('ij,ij->i', X, X)
+
+    def block(begin):
+        d = norms[begin:begin + batch_size, None] - 2 * X[begin:begin + batch_size].dot(X.T) + norms[None, :]
+        i, j = np.nonzero(d <= eps2)
+        i += begin
+        keep = i < j
+        return i[keep], j[keep]
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        for pairs in pool.map(block, range(0, len(X), batch_size)):
+            yield pairs
+
+
+def _find(parent, x):
+    roots = parent[x]
+    while True:
+        up = parent[roots]
+        if np.array_equal(up, roots):
+            # path compression: later finds from x take one step
+            parent[x] = roots
+            return roots
+        roots = up
+
+
+def _union(parent, u, v):
+    """ Merges the sets of every (u, v) edge, hooking the larger root under the smaller """
+    while len(u):
+        ru, rv = _find(parent, u), _find(parent, v)
+        keep = ru != rv
+        if not keep.any():
+            return
+        u, v = u[keep], v[keep]
+        low, high = np.minimum(ru[keep], rv[keep]), np.maximum(ru[keep], rv[keep])
+        np.minimum.at(parent, high, low)
+
+
+class GridDBSCAN(object):
+    """ scikit-learn compatible DBSCAN with euclidean distance
+
+    Parameters
+    ----------
+    eps : float
+        neighborhood radius (distance <= eps)
+    min_samples : int
+        neighbors, the point itself included, that make a core point
+    n_jobs : int
+        threads computing the neighborhoods
+    max_grid_dims : int
+        highest dimension searched with the grid
+    resolution : int
+        grid cells per eps; finer cells compare fewer pairs of points but
+        more pairs of cells (default 2 up to 3 dimensions, else 1)
+    max_kept_pairs : int
+        pairs within eps kept in memory between the two passes (8 bytes
+        each); above it the second pass searches them again
+    """
+
+    def __init__(self, eps=0.5, min_samples=5, n_jobs=None, max_grid_dims=4, resolution=None,
+                 max_kept_pairs=MAX_KEPT_PAIRS):
+        self.eps = eps
+        self.min_samples = min_samples
+        self.n_jobs = n_jobs or os.cpu_count()
+        self.max_grid_dims = max_grid_dims
+        self.resolution = resolution
+        self.max_kept_pairs = max_kept_pairs
+
+    def _pairs(self, X):
+        """ A callable yielding the pair chunks again on every call """
+        resolution = self.resolution or (2 if X.shape[1] <= 3 else 1)
+        cells = np.floor((X.max(axis=0) - X.min(axis=0)) * (resolution / self.eps)) + 1 + 2 * resolution
+        if X.shape[1] <= self.max_grid_dims and np.prod(cells) < 2 ** 62:
+            return lambda: _grid_pairs(X, self.eps, self.n_jobs, resolution)
+        if cKDTree is not None:
+            pairs = cKDTree(X).query_pairs(self.eps, output_type='ndarray')
+            return lambda: iter([(pairs[:, 0], pairs[:, 1])])
+        return lambda: _brute_pairs(X, self.eps, self.n_jobs)
+
+    def fit(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        n = len(X)
+        pairs = self._pairs(X)
+        counts = np.ones(n, dtype=np.int64)
+        kept, total = [], 0
+        for i, j in pairs():
+            counts += np.bincount(i, minlength=n) + np.bincount(j, minlength=n)
+            total += len(i)
+            if total <= self.max_kept_pairs:
+                kept.append((i.astype(np.int32), j.astype(np.int32)) if n < 2 ** 31 else (i, j))
+        core = counts >= self.min_samples
+        if total <= self.max_kept_pairs:
+            pairs = lambda: iter(kept)
+
+        parent = np.arange(n)
+        border, border_core = [], []
+        for i, j in pairs():
+            both = core[i] & core[j]
+            _union(parent, i[both], j[both])
+            border += [j[core[i] & ~core[j]], i[core[j] & ~core[i]]]
+            border_core += [i[core[i] & ~core[j]], j[core[j] & ~core[i]]]
+        roots = _find(parent, np.arange(n))
+
+        # roots are the smallest index of their set, so this numbers clusters by their first core point
+        labels = np.full(n, -1, dtype=np.int64)
+        cluster_roots = np.unique(roots[core])
+        labels[core] = np.searchsorted(cluster_roots, roots[core])
+        if border:
+            border = np.concatenate(border)
+            cluster = labels[np.concatenate(border_core)]
+            first = np.full(n, n, dtype=np.int64)
+            np.minimum.at(first, border, cluster)
+            touched = first < n
+            labels[touched] = first[touched]
+        self.labels_ = labels
+        self.core_sample_indices_ = np.flatnonzero(core)
+        return self
+
+    def fit_predict(self, X):
+        return self.fit(X).labels_
+
+
+def blobs(nrows, ncols, rows_per_blob=5000, seed=0):
+    """ Unit gaussian blobs plus 5% uniform noise, in a box growing with nrows so that the density stays the same """
+    rng = np.random.RandomState(seed)
+    centers = max(nrows // rows_per_blob, 1)
+    side = 10.0 * centers ** (1.0 / ncols)
+    means = rng.uniform(0, side, size=(centers, ncols))
+    X = means[rng.randint(0, centers, nrows)] + rng.standard_normal((nrows, ncols))
+    noise = rng.uniform(size=nrows) < 0.05
+    X[noise] = rng.uniform(0, side, size=(int(noise.sum()), ncols))
+    return X
+
+def blob_eps(ncols, neighbors=30, rows_per_blob=5000):
+    """ eps giving about `neighbors` neighbors at the center of a `blobs` blob """
+    density = rows_per_blob / (2 * math.pi) ** (ncols / 2.0)
+    ball = math.pi ** (ncols / 2.0) / math.gamma(ncols / 2.0 + 1)
+    return (neighbors / (density * ball)) ** (1.0 / ncols)
+
+
+if __name__ == '__main__':
+    import sys
+    from sklearn.cluster import DBSCAN as skDBSCAN
+
+    rows = [int(size) for size in sys.argv[1].split(',')] if len(sys.argv) > 1 else [10000, 100000, 1000000]
+    dims = [int(size) for size in sys.argv[2].split(',')] if len(sys.argv) > 2 else [2, 3, 4, 8]
+    min_samples = 5
+    for ncols in dims:
+        eps = blob_eps(ncols)
+        for nrows in rows:
+            X = blobs(nrows, ncols)
+            start = time.time()
+            labels = GridDBSCAN(eps=eps, min_samples=min_samples).fit_predict(X)
+            grid_seconds = time.time() - start
+            line = "%8d x %d, eps %.2f: %d clusters, grid %.2fs" % (nrows, ncols, eps, labels.max() + 1, grid_seconds)
+            if nrows <= 200000:
+                start = time.time()
+                expected = skDBSCAN(eps=eps, min_samples=min_samples).fit(X).labels_
+                sk_seconds = time.time() - start
+                line += ", sklearn %.2fs (%.1fx), labels equal: %s" % (
+                    sk_seconds, sk_seconds / grid_seconds, np.array_equal(labels, expected))
+            print(line)
@@ -0,0 +1,202 @@
+"""Memory-mapped, chunked on-disk copy of the notebooks' mortgage sample.
+
+`load_data` used to gunzip and `np.load` the whole `data/mortgage.npy.gz`
+on every call, then fancy-index a random sample of rows and the first
+`ncols` columns out of it: a full decompression and a full copy in RAM
+just to sample, which hurts at the 2**22-row TSVD and 1.5 * 2**20-row
+PCA settings. `convert` streams the archive once into an uncompressed
+store of row groups. Within a group every column is contiguous (like the
+column chunks of a Parquet row group), and `meta.json` records each
+group's row range, byte offset and per-column min/max. `MatrixStore`
+memory maps the groups and reads random or contiguous rows and column
+subsets by touching only the groups and column chunks involved.
+
+Run `python matrix_store.py convert [SOURCE] [DIRECTORY]` once, and
+`python matrix_store.py bench [DIRECTORY] [NROWS] [NCOLS]` to compare a
+sample against the gunzip-and-index load.
+"""
+import gzip
+import json
+import os
+import time
+
+import numpy as np
+
+
+MORTGAGE_SOURCE = 'data/mortgage.npy.gz'
+MORTGAGE_STORE = 'data/mortgage.store'
+DATA_FILE = 'data.bin'
+META_FILE = 'meta.json'
+ROWS_PER_GROUP = 1 << 16
+
+
+def _read_npy_header(f):
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        return np.lib.format.read_array_header_1_0(f)
+    return np.lib.format.read_array_header_2_0(f)
+
+
+def _row_blocks(source, rows_per_group):
+    """ Yields the rows of a (possibly gzipped) .npy file one group at a time, and its shape and dtype first """
+    opener = gzip.open if source.endswith('.gz') else open
+    with opener(source, 'rb') as f:
+        shape, fortran_order, dtype = _read_npy_header(f)
+        yield shape, dtype
+        if fortran_order or len(shape) != 2:
+            # columns are contiguous on disk: no way around reading it whole
+            f.seek(0)
+            X = np.load(f).reshape(shape[0], -1)
+            for begin in range(0, X.shape[0], rows_per_group):
+                yield X[begin:begin + rows_per_group]
+            return
+        row_bytes = shape[1] * dtype.itemsize
+        for begin in range(0, shape[0], rows_per_group):
+            rows = min(rows_per_group, shape[0] - begin)
+            yield np.frombuffer(f.read(rows * row_bytes), dtype=dtype).reshape(rows, shape[1])
+
+
+def convert(source=MORTGAGE_SOURCE, directory=MORTGAGE_STORE, rows_per_group=ROWS_PER_GROUP):
+    """ Streams a .npy(.gz) matrix into a store, holding one row group in memory at a time
+
+    Returns
+    -------
+    MatrixStore
+    """
+    os.makedirs(directory, exist_ok=True)
+    blocks = _row_blocks(source, rows_per_group)
+    shape, dtype = next(blocks)
+    groups = []
+    offset = 0
+    with open(os.path.join(directory, DATA_FILE + '.tmp'), 'wb') as f:
+        row = 0
+        for block in blocks:
+            columns = np.ascontiguousarray(block.T)
+            f.write(columns.tobytes())
+            groups.append({
+                'rows': [row, row + len(block)],
+                'offset': offset,
+                'min': np.nanmin(block, axis=0).tolist() if len(block) else [],
+                'max': np.nanmax(block, axis=0).tolist() if len(block) else [],
+            })
+            row += len(block)
+            offset += columns.nbytes
+    os.rename(os.path.join(directory, DATA_FILE + '.tmp'), os.path.join(directory, DATA_FILE))
+    meta = {
+        'shape': [int(shape[0]), int(np.prod(shape[1:]))],
+        'dtype': np.dtype(dtype).str,
+        'rows_per_group': rows_per_group,
+        'source': os.path.abspath(source),
+        'groups': groups,
+    }
+    with open(os.path.join(directory, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=1)
+    return MatrixStore(directory)
+
+
+class MatrixStore(object):
+    """ Read-only access to a converted matrix
+
+    Parameters
+    ----------
+    directory : str
+        written by `convert`
+    """
+
+    def __init__(self, directory=MORTGAGE_STORE):
+        with open(os.path.join(directory, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.shape = tuple(self.meta['shape'])
+        self.dtype = np.dtype(self.meta['dtype'])
+        self.rows_per_group = self.meta['rows_per_group']
+        data = np.memmap(os.path.join(directory, DATA_FILE), dtype=self.dtype, mode='r')
+        # group g as a (ncols, rows) view: row i of it is one contiguous column chunk
+        self._groups = []
+        for group in self.meta['groups']:
+            begin, end = group['rows']
+            start = group['offset'] // self.dtype.itemsize
+            self._groups.append(data[start:start + self.shape[1] * (end - begin)].reshape(self.shape[1], end - begin))
+
+    def _columns(self, columns):
+        if columns is None:
+            return np.arange(self.shape[1])
+        if isinstance(columns, slice):
+            return np.arange(self.shape[1])[columns]
+        return np.asarray(columns, dtype=np.int64)
+
+    def rows(self, indices, columns=None):
+        """ The given rows (any order, repeats allowed) of some columns
+
+        Rows are read group by group, and within a group only the chunks
+        of the requested columns are touched.
+
+        Returns
+        -------
+        numpy.ndarray of shape (len(indices), len(columns))
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        columns = self._columns(columns)
+        result = np.empty((len(indices), len(columns)), dtype=self.dtype)
+        order = np.argsort(indices, kind='stable')
+        sorted_indices = indices[order]
+        group_of = sorted_indices // self.rows_per_group
+        bounds = np.flatnonzero(np.diff(group_of)) + 1
+        for part, positions in zip(np.split(sorted_indices, bounds), np.split(order, bounds)):
+            if not len(part):
+                continue
+            g = int(part[0] // self.rows_per_group)
+            local = part - g * self.rows_per_group
+            chunk = self._groups[g]
+            for j, column in enumerate(columns):
+                result[positions, j] = chunk[column][local]
+        return result
+
+    def contiguous(self, start, stop, columns=None):
+        """ Rows start:stop of some columns """
+        columns = self._columns(columns)
+        parts = []
+        first, last = start // self.rows_per_group, (stop - 1) // self.rows_per_group
+        for g in range(first, last + 1):
+            begin = max(start - g * self.rows_per_group, 0)
+            end = min(stop - g * self.rows_per_group, self._groups[g].shape[1])
+            parts.append(self._groups[g][columns, begin:end].T)
+        if not parts:
+            return np.empty((0, len(columns)), dtype=self.dtype)
+        return np.concatenate(parts)
+
+    def sample(self, nrows, columns=None, seed=None):
+        """ `nrows` rows drawn uniformly with replacement, like the notebooks' `np.random.randint` sample """
+        rng = np.random.RandomState(seed)
+        return self.rows(rng.randint(0, self.shape[0] - 1, nrows), columns)
+
+
+def _gzip_sample(source, nrows, ncols, seed=0):
+    with gzip.open(source) as f:
+        X = np.load(f)
+    return X[np.random.RandomState(seed).randint(0, X.shape[0] - 1, nrows), :ncols]
+
+
+if __name__ == '__main__':
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'bench'
+    if command == 'convert':
+        source = sys.argv[2] if len(sys.argv) > 2 else MORTGAGE_SOURCE
+        directory = sys.argv[3] if len(sys.argv) > 3 else MORTGAGE_STORE
+        start = time.time()
+        store = convert(source, directory)
+        print("%s -> %s: %d x %d %s in %d row groups, %.1fs"
+              % (source, directory, store.shape[0], store.shape[1], store.dtype, len(store._groups), time.time() - start))
+    else:
+        directory = sys.argv[2] if len(sys.argv) > 2 else MORTGAGE_STORE
+        nrows = int(sys.argv[3]) if len(sys.argv) > 3 else int(2 ** 20 * 1.5)
+        ncols = int(sys.argv[4]) if len(sys.argv) > 4 else 40
+        store = MatrixStore(directory)
+        start = time.time()
+        sampled = store.sample(nrows, slice(0, ncols), seed=0)
+        store_seconds = time.time() - start
+        start = time.time()
+        expected = _gzip_sample(store.meta['source'], nrows, ncols, seed=0)
+        gzip_seconds = time.time() - start
+        print("%d x %d sample: store %.2fs, gunzip + index %.2fs (%.1fx), identical: %s"
+              % (nrows, ncols, store_seconds, gzip_seconds, gzip_seconds / store_seconds, np.array_equal(sampled, expected)))
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from ann_index import IVFIndex, exact_search, recall_at_k, true_distances
+
+
+@pytest.fixture
+def data():
+    rng = np.random.RandomState(0)
+    centers = rng.uniform(-50, 50, size=(20, 8))
+    X = (centers[rng.randint(0, 20, 3000)] + rng.standard_normal((3000, 8))).astype(np.float32)
+    # duplicate rows, as in the mortgage features
+    X[1000:1100] = X[:100]
+    return X
+
+
+def test_exact_distances_are_the_true_distances(data):
+    distances, indices = exact_search(data, data[:200], k=10)
+    np.testing.assert_array_equal(distances, true_distances(data, data[:200], indices))
+
+
+def test_exhaustive_probing_finds_the_exact_neighbors(data):
+    exact_d, _ = exact_search(data, data, k=10)
+    index = IVFIndex(nlist=16, dtype=np.float64).fit(data)
+    _, indices = index.search(data, 10, nprobe=index.nlist)
+    assert recall_at_k(exact_d, true_distances(data, data, indices)) == 1.0
+
+
+@pytest.mark.parametrize("pq_m, floor", [(None, 0.99), (4, 0.5)])
+def test_recall_grows_with_nprobe(data, pq_m, floor):
+    exact_d, _ = exact_search(data, data, k=10)
+    index = IVFIndex(nlist=32, pq_m=pq_m).fit(data)
+    recalls = [recall_at_k(exact_d, true_distances(data, data, index.search(data, 10, nprobe=nprobe)[1]))
+               for nprobe in (1, 4, 32)]
+    # float32 distances, or quantized ones, only miss near ties when every list is probed
+    assert recalls == sorted(recalls) and recalls[-1] > floor
+
+
+@pytest.mark.parametrize("name", ["index", "index.npz"])
+def test_save_and_load_take_the_same_path(tmp_path, data, name):
+    index = IVFIndex(nlist=16, pq_m=4).fit(data)
+    path = str(tmp_path / name)
+    assert index.save(path).endswith(".npz")
+    loaded = IVFIndex.load(path)
+    for expected, got in zip(index.search(data[:50], 5), loaded.search(data[:50], 5)):
+        np.testing.assert_array_equal(expected, got)
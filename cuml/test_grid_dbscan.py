@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from sklearn.cluster import DBSCAN
+
+import grid_dbscan
+from grid_dbscan import GridDBSCAN, blob_eps, blobs
+
+
+def check_same_as_sklearn(X, eps, min_samples=5, **kwargs):
+    expected = DBSCAN(eps=eps, min_samples=min_samples).fit(X)
+    model = GridDBSCAN(eps=eps, min_samples=min_samples, **kwargs).fit(X)
+    np.testing.assert_array_equal(model.core_sample_indices_, expected.core_sample_indices_)
+    np.testing.assert_array_equal(model.labels_, expected.labels_)
+    return model
+
+
+@pytest.mark.parametrize("ncols", [1, 2, 3, 4])
+def test_grid_labels(ncols):
+    X = blobs(4000, ncols, rows_per_blob=500, seed=ncols)
+    model = check_same_as_sklearn(X, blob_eps(ncols, rows_per_blob=500))
+    assert model.labels_.max() > 0 and (model.labels_ == -1).any()
+
+
+@pytest.mark.parametrize("resolution", [1, 2, 3])
+def test_resolutions(resolution):
+    X = blobs(3000, 2, rows_per_blob=500)
+    check_same_as_sklearn(X, blob_eps(2, rows_per_blob=500), resolution=resolution)
+
+
+def test_kd_tree_above_the_grid_dimensions():
+    X = blobs(2000, 6, rows_per_blob=500)
+    check_same_as_sklearn(X, blob_eps(6, rows_per_blob=500))
+
+
+def test_brute_force_without_scipy(monkeypatch):
+    monkeypatch.setattr(grid_dbscan, "cKDTree", None)
+    X = blobs(2000, 6, rows_per_blob=500, seed=1)
+    check_same_as_sklearn(X, blob_eps(6, rows_per_blob=500))
+
+
+def test_pairs_searched_again_above_the_memory_bound():
+    X = blobs(3000, 2, rows_per_blob=500, seed=2)
+    check_same_as_sklearn(X, blob_eps(2, rows_per_blob=500), max_kept_pairs=1000)
+
+
+def test_border_points_join_the_lowest_cluster():
+    # 1.0 is within eps of a core point of both clusters but is not a core point itself
+    X = np.array([[0.0], [0.02], [0.04], [0.06], [1.0], [1.94], [1.96], [1.98], [2.0], [5.0]])
+    model = check_same_as_sklearn(X, eps=0.95, min_samples=4)
+    assert 4 not in model.core_sample_indices_ and model.labels_[4] == 0
+    model = check_same_as_sklearn(X[::-1].copy(), eps=0.95, min_samples=4)
+    assert model.labels_[5] == 0
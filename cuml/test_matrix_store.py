@@ -0,0 +1,54 @@
+import gzip
+
+import numpy as np
+import pytest
+
+from matrix_store import _gzip_sample, convert
+
+
+@pytest.fixture
+def source(tmp_path):
+    rng = np.random.RandomState(0)
+    X = rng.standard_normal((1000, 12)).astype(np.float32)
+    X[rng.uniform(size=X.shape) < 0.05] = np.nan
+    path = str(tmp_path / "mortgage.npy.gz")
+    with gzip.open(path, "wb") as f:
+        np.save(f, X)
+    return path, X
+
+
+@pytest.fixture
+def store(tmp_path, source):
+    return convert(source[0], str(tmp_path / "store"), rows_per_group=64)
+
+
+def test_sample_matches_the_gzip_sample(source, store):
+    sampled = store.sample(500, slice(0, 7), seed=3)
+    np.testing.assert_array_equal(sampled, _gzip_sample(source[0], 500, 7, seed=3))
+
+
+def test_rows_in_any_order_with_repeats(source, store):
+    X = source[1]
+    indices = np.array([999, 0, 64, 63, 0, 500, 128])
+    np.testing.assert_array_equal(store.rows(indices, [11, 2, 2]), X[indices][:, [11, 2, 2]])
+
+
+@pytest.mark.parametrize("start, stop", [(0, 1000), (60, 70), (128, 192), (5, 6)])
+def test_contiguous_rows_across_groups(source, store, start, stop):
+    np.testing.assert_array_equal(store.contiguous(start, stop, slice(3, 9)), source[1][start:stop, 3:9])
+
+
+def test_group_statistics(source, store):
+    X = source[1]
+    assert store.shape == X.shape and store.dtype == X.dtype
+    group = store.meta["groups"][2]
+    assert group["rows"] == [128, 192]
+    np.testing.assert_allclose(group["min"], np.nanmin(X[128:192], axis=0))
+    np.testing.assert_allclose(group["max"], np.nanmax(X[128:192], axis=0))
+
+
+def test_fortran_order_source(tmp_path, source):
+    path = str(tmp_path / "fortran.npy")
+    np.save(path, np.asfortranarray(source[1]))
+    store = convert(path, str(tmp_path / "fortran-store"), rows_per_group=100)
+    np.testing.assert_array_equal(store.contiguous(0, 1000), source[1])
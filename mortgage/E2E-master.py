@@ -55,6 +55,7 @@ from collections import OrderedDict
 import gc
 from glob import glob
 import os
+import sys
 
 import time
 import argparse
@@ -73,6 +74,10 @@ if __name__ == '__main__':
         output, error = process.communicate()
         IPADDR = str(output.decode()).split()[0]
         '''
+        if os.getenv('DASK_WORKERS_NUM') is None:
+            sys.exit("DASK_WORKERS_NUM must be set to the number of local GPU workers (run-master.sh sets it)")
+        local_workers = int(os.getenv('DASK_WORKERS_NUM'))
+
         parser = argparse.ArgumentParser(description="Mortgage")
         parser.add_argument('--ip',  dest='ip',  type=str, default="localhost", help='IP address of Dask Scheduler)')
         parser.add_argument('--port', dest='port', type=int, default=5555, help='scheduler_port')            
@@ -82,12 +87,23 @@ if __name__ == '__main__':
         parser.add_argument('--start_year', dest='start_year', type=int, default=2000, help='start_year')        
         parser.add_argument('--end_year', dest='end_year', type=int, default=2003, help='end_year')            
         parser.add_argument('--part_count', dest='part_count', type=int, default=1, help='part_count') 
+        parser.add_argument('--wait_workers', dest='wait_workers', type=int, default=local_workers, help='workers (local and remote) to wait for before starting')
+        parser.add_argument('--wait_timeout', dest='wait_timeout', type=float, default=600, help='seconds to wait for them before giving up')
 
         args = parser.parse_args()
 
-        cluster = LocalCUDACluster(n_workers=int(os.getenv('DASK_WORKERS_NUM')), ip=args.ip, scheduler_port=args.port)
+        # local workers warm up (imports, RMM pool, CSV parser) as they start; run-worker.sh does the same for remote ones
+        worker_preload = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker_preload.py")]
+        cluster = LocalCUDACluster(n_workers=local_workers, ip=args.ip, scheduler_port=args.port, preload=worker_preload)
         client = Client(cluster)
-        time.sleep(5)
+        ready_start = time.time()
+        while len(client.scheduler_info()['workers']) < args.wait_workers:
+            if time.time() - ready_start > args.wait_timeout:
+                ready = len(client.scheduler_info()['workers'])
+                raise TimeoutError("%d of %d workers registered after %ds, %d missing"
+                                   % (ready, args.wait_workers, args.wait_timeout, args.wait_workers - ready))
+            time.sleep(0.1)
+        print("****%d workers ready in %.1fs" % (len(client.scheduler_info()['workers']), time.time() - ready_start))
         print(client)
 
         # #### Define the paths to data and set the size of the dataset
@@ -125,7 +141,18 @@ if __name__ == '__main__':
         # In[ ]:
 
 
-        client.run(initialize_rmm_pool)
+        def preload_timings():
+            import sys
+            module = sys.modules.get('worker_preload')
+            return module.startup_report() if module is not None else None
+
+        startup = client.run(preload_timings)
+        for worker, timings in sorted(startup.items()):
+            if timings:
+                print("startup", worker, ", ".join("%s %.2fs" % step for step in timings.items()))
+        cold_workers = [worker for worker, timings in startup.items() if not timings]
+        if cold_workers:
+            client.run(initialize_rmm_pool, workers=cold_workers)
 
 
         # #### Define functions to encapsulate the workflow into a single call
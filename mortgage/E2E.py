@@ -42,22 +42,44 @@
 
 
 import numpy as np
+import pandas as pd
 import dask_xgboost as dxgb_gpu
 import dask
 import dask_cudf
 from dask_cuda import LocalCUDACluster
 from dask.delayed import delayed
-from dask.distributed import Client, wait
+from dask.distributed import Client, as_completed, wait
 import xgboost as xgb
 import cudf
 from cudf.dataframe import DataFrame
 from collections import OrderedDict
 import gc
+import inspect
+import operator
 from glob import glob
 import os
+import re
+import sys
 
 import time
 
+from categories import CategoryRegistry
+from compression import open_text, read_input, resolve_input
+from prefetch import get_prefetcher, schedule_files, prefetch_stats
+from result_cache import ResultCache, cached_call, cached_entries, load_cached, stored_call, unpin_entries
+from planner import estimate_cost, lpt_assignment, submission_order
+from speculation import SpeculativeExecutor
+from autotune import grid_search, worker_counts, write_config
+from metrics import MetricsServer, stage, partition_done
+from external_memory import worker_dmatrix
+from feature_usage import feature_usage, result_feature_names, save_profile, load_profile, pruned_columns, pruning_report
+from worker_preload import startup_report
+from etl_plan import CudfEngine, execute, explain, mortgage_plan, optimize
+from validation import LOAN_HASH_MODULUS, LOAN_HASH_MULTIPLIER, EarlyStopping, rmse, train_with_early_stopping
+from sampling import SAMPLE_BUCKETS, sample_threshold
+from catalog import PartitionCatalog, catalog_path
+from filters import apply_filters, file_matches, filter_columns, pushdown_report, pushdown_stats, record_pushdown, split_filters
+
 # In[ ]:
 
 
@@ -70,9 +92,16 @@ if __name__ == '__main__':
         output, error = process.communicate()
         IPADDR = str(output.decode()).split()[0]
 
-        cluster = LocalCUDACluster(ip=IPADDR)
+        # import cudf/xgboost, start the RMM pool and warm the CSV parser as each worker starts, outside the timed ETL
+        preload_workers = True
+        worker_preload = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker_preload.py")] if preload_workers else None
+
+        cluster = LocalCUDACluster(ip=IPADDR, preload=worker_preload)
         client = Client(cluster)
         print(client)
+        if preload_workers:
+            for worker, timings in sorted(client.run(startup_report).items()):
+                print("startup", worker, ", ".join("%s %.2fs" % step for step in timings.items()))
 
 
         # #### Define the paths to data and set the size of the dataset
@@ -87,6 +116,45 @@ if __name__ == '__main__':
         start_year = 2001
         end_year = 2002  # end_year is inclusive
         part_count = 1 # the number of data files to train against
+        sample_percent = 100 # share of loans kept as the files are read (whole histories, the same loans every run), 100 keeps all
+        filters = [] # (column, op, value) predicates on year/quarter and acquisition columns, e.g. [('property_state', 'in', ['CA', 'NY'])]
+        use_partition_catalog = True # skip the splits whose loan_id range rules out the loan_id filters, once `python catalog.py PERF_DIR` built the catalog
+        categories_path = "/home/yli/nvme_ssd/songjue/mortgage/categories.json" # global category dictionaries, built on first run
+        etl_output = "arrow" # "arrow" for an Arrow table per partition, "matrix" for a float32 (features, labels, names) triple
+        prefetch_depth = 2 # split files each worker reads ahead while computing, 0 disables read-ahead
+        prefetch_bytes = 4 << 30 # read-ahead byte budget per worker
+        cache_path = "/home/yli/nvme_ssd/songjue/mortgage/etl_cache" # per-partition ETL results, None disables caching
+        cache_bytes = 200 << 30 # the least recently used results are evicted above this size
+        speculation_slowdown = 2.0 # re-run a partition on an idle worker once it ran this many times longer than expected, None disables
+        autotune = False # calibrate workers/threads/split size on a sample, write them to dask.conf and exit
+        autotune_sample = 4 # consecutive split files of start_year Q1 used for calibration
+        autotune_grid = {'workers': None, 'threads': (1, 2), 'split_sizes': (None, 256 << 20, 512 << 20)} # workers None: powers of two up to the GPU count
+        metrics_port = 19100 # Prometheus text endpoint at http://localhost:19100/metrics, None disables it
+        metrics_snapshot_path = "mortgage-metrics.jsonl" # periodic JSON snapshots, None disables them
+        validation_percent = 0 # share of loans held out to stop training early (e.g. 5), 0 trains the full nround rounds
+        early_stopping_rounds = 10 # stop once the validation RMSE has not improved for this many rounds
+        eval_every = 5 # rounds trained between validation checks
+        training_input = "memory" # "memory" concatenates part_count partitions per worker, "external" streams every partition from the ETL cache
+        external_cache_path = "/tmp/mortgage-xgb-external" # local scratch for XGBoost's external memory pages
+        external_batch_rows = 1 << 20 # rows per batch handed to XGBoost when streaming
+        etl_engine = "functions" # "plan" runs the features and joins as the optimized declarative plan of etl_plan.py
+        feature_profile_path = "mortgage-feature-usage.json" # split counts/gain per feature, written after unpruned training
+        prune_features = False # skip parsing the input columns the profile shows the model does not use
+        prune_min_gain_share = 0.001 # features below this share of the total gain count as unused
+        dask_conf_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils", "dask.conf")
+        pruned_inputs = set(pruned_columns(load_profile(feature_profile_path), prune_min_gain_share)) if prune_features else set()
+        pruned_inputs -= filter_columns(filters)
+        file_filters, row_filters = split_filters(filters)
+
+
+        # #### Ship the helper modules to the workers
+
+        # In[ ]:
+
+
+        helper_modules = ["compression.py", "categories.py", "prefetch.py", "result_cache.py", "planner.py", "speculation.py", "autotune.py", "metrics.py", "validation.py", "external_memory.py", "feature_usage.py", "etl_plan.py", "sampling.py", "filters.py"]
+        for module in helper_modules:
+            client.upload_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), module))
 
 
         # In[ ]:
@@ -108,10 +176,35 @@ if __name__ == '__main__':
             return cudf._gdf.rmm_initialize()
 
 
+        def estimate_source_rows(path, catalog=None, sample_bytes=1 << 20):
+            # a catalogued split knows its rows, otherwise the file size over the line length of its head
+            # (for a compressed file, an underestimate by its compression ratio)
+            entry = catalog.entry(path) if catalog is not None else None
+            if entry is not None:
+                return entry['rows']
+            with open_text(path) as f:
+                head = f.read(sample_bytes)
+            return os.path.getsize(path) * max(head.count("\n"), 1) / max(len(head), 1)
+
+        def optimized_plan(perf_files, catalog=None):
+            # joins are ordered by the rows of an average partition's performance split and acquisition file
+            quarters = sorted(set(re.search(r"Performance_(\d{4})Q(\d)", file).groups() for file in perf_files))
+            acq_files = [resolve_input(acq_data_path + "/Acquisition_" + year + "Q" + quarter + ".txt") for year, quarter in quarters]
+            acq_rows = [estimate_source_rows(file) for file in acq_files if os.path.exists(file)]
+            source_rows = {'perf': float(np.mean([estimate_source_rows(file, catalog) for file in perf_files]))}
+            if acq_rows:
+                source_rows['acq'] = float(np.mean(acq_rows))
+            plan, plan_rewrites = optimize(mortgage_plan(), source_rows)
+            print(explain(plan, plan_rewrites, source_rows))
+            return plan
+
+
         # In[ ]:
 
 
-        client.run(initialize_rmm_pool)
+        if not preload_workers:
+            # otherwise the preload already started the pool
+            client.run(initialize_rmm_pool)
 
 
         # #### Define functions to encapsulate the workflow into a single call
@@ -123,14 +216,51 @@ if __name__ == '__main__':
             task = func(**kwargs)
             return task
 
-        def process_quarter_gpu(year=2000, quarter=1, perf_file=""):
-            ml_arrays = run_dask_task(delayed(run_gpu_workflow),
-                                                  quarter=quarter,
-                                                  year=year,
-                                                  perf_file=perf_file)
+        def etl_cache_key(year=2000, quarter=1, perf_file=""):
+            inputs = [perf_file, resolve_input(acq_data_path + "/Acquisition_" + str(year) + "Q" + str(quarter) + ".txt"),
+                      col_names_path, categories_path]
+            # only the ETL itself, so that e.g. tweaking training parameters keeps the cache valid
+            code = [inspect.getsource(func) for func in etl_functions]
+            for module in helper_modules:
+                with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module)) as f:
+                    code.append(f.read())
+            params = {'year': year, 'quarter': quarter, 'etl_output': etl_output, 'validation_percent': validation_percent,
+                      'sample_percent': sample_percent, 'filters': row_filters, 'pruned_inputs': sorted(pruned_inputs), 'etl_engine': etl_engine}
+            return result_cache.key(inputs, code, params)
+
+        def process_quarter_gpu(year=2000, quarter=1, perf_file="", registry=None, worker=None, cache_key=None):
+            workers = [worker] if worker else None
+            if training_input == "external":
+                # the partition stays pinned on this worker's disk until training streamed it; the task only
+                # returns where it is
+                ml_arrays = run_dask_task(delayed(stored_call),
+                                                      cache=result_cache,
+                                                      key=cache_key,
+                                                      func=run_gpu_workflow,
+                                                      quarter=quarter,
+                                                      year=year,
+                                                      perf_file=perf_file,
+                                                      registry=registry)
+            elif cache_key is not None:
+                # reads the partition back when this worker's disk has it, recomputes it otherwise
+                ml_arrays = run_dask_task(delayed(cached_call),
+                                                      cache=result_cache,
+                                                      key=cache_key,
+                                                      func=run_gpu_workflow,
+                                                      quarter=quarter,
+                                                      year=year,
+                                                      perf_file=perf_file,
+                                                      registry=registry)
+            else:
+                ml_arrays = run_dask_task(delayed(run_gpu_workflow),
+                                                      quarter=quarter,
+                                                      year=year,
+                                                      perf_file=perf_file,
+                                                      registry=registry)
             return client.compute(ml_arrays,
                                   optimize_graph=False,
-                                  fifo_timeout="0ms")
+                                  fifo_timeout="0ms",
+                                  workers=workers)
 
         def null_workaround(df, **kwargs):
             for column, data_type in df.dtypes.items():
@@ -140,30 +270,71 @@ if __name__ == '__main__':
                     df[column] = df[column].fillna(-1)
             return df
 
-        def run_gpu_workflow(quarter=1, year=2000, perf_file="", **kwargs):
-            names = gpu_load_names()
-            acq_gdf = gpu_load_acquisition_csv(acquisition_path= acq_data_path + "/Acquisition_"
-                                              + str(year) + "Q" + str(quarter) + ".txt")
-            acq_gdf = acq_gdf.merge(names, how='left', on=['seller_name'])
-            acq_gdf.drop_column('seller_name')
-            acq_gdf['seller_name'] = acq_gdf['new']
-            acq_gdf.drop_column('new')
-            perf_df_tmp = gpu_load_performance_csv(perf_file)
-            gdf = perf_df_tmp
-            everdf = create_ever_features(gdf)
-            delinq_merge = create_delinq_features(gdf)
-            everdf = join_ever_delinq_features(everdf, delinq_merge)
-            del(delinq_merge)
-            joined_df = create_joined_df(gdf, everdf)
-            testdf = create_12_mon_features(joined_df)
-            joined_df = combine_joined_12_mon(joined_df, testdf)
-            del(testdf)
-            perf_df = final_performance_delinquency(gdf, joined_df)
-            del(gdf, joined_df)
-            final_gdf = join_perf_acq_gdfs(perf_df, acq_gdf)
-            del(perf_df)
-            del(acq_gdf)
-            final_gdf = last_mile_cleaning(final_gdf)
+        def run_gpu_workflow(quarter=1, year=2000, perf_file="", registry=None, **kwargs):
+            with stage("load"):
+                names = gpu_load_names()
+                acq_gdf = gpu_load_acquisition_csv(acquisition_path=resolve_input(acq_data_path + "/Acquisition_"
+                                                  + str(year) + "Q" + str(quarter) + ".txt"))
+                if sample_percent < 100:
+                    acq_gdf = sample_loans(acq_gdf, sample_percent)
+                if row_filters:
+                    acq_rows = len(acq_gdf)
+                    acq_gdf = apply_filters(acq_gdf, row_filters)
+                    record_pushdown("acquisition", acq_rows, len(acq_gdf))
+                acq_gdf = acq_gdf.merge(names, how='left', on=['seller_name'])
+                acq_gdf.drop_column('seller_name')
+                acq_gdf['seller_name'] = acq_gdf['new']
+                acq_gdf.drop_column('new')
+                if prefetch_depth:
+                    prefetcher = get_prefetcher()
+                    try:
+                        perf_df_tmp = gpu_load_performance_csv(prefetcher.acquire(perf_file))
+                    finally:
+                        # a failed or cancelled parse must not keep its place in the read-ahead window
+                        prefetcher.release(perf_file)
+                else:
+                    perf_df_tmp = gpu_load_performance_csv(perf_file)
+                if sample_percent < 100:
+                    perf_df_tmp = sample_loans(perf_df_tmp, sample_percent)
+                if row_filters:
+                    perf_rows = len(perf_df_tmp)
+                    perf_df_tmp = keep_loans(perf_df_tmp, acq_gdf)
+                    record_pushdown("performance", perf_rows, len(perf_df_tmp), nbytes=os.path.getsize(perf_file))
+                if registry is not None:
+                    acq_gdf = encode_categories(acq_gdf, registry)
+                    perf_df_tmp = encode_categories(perf_df_tmp, registry)
+            rows = len(perf_df_tmp)
+            if etl_engine == "plan":
+                with stage("features"):
+                    # the sources are consumed: the plan fills the perf frame in place
+                    final_gdf = execute(etl_plan, {'perf': perf_df_tmp, 'acq': acq_gdf}, engine=CudfEngine())
+                    del(perf_df_tmp, acq_gdf)
+            else:
+                with stage("features"):
+                    gdf = perf_df_tmp
+                    everdf = create_ever_features(gdf)
+                    delinq_merge = create_delinq_features(gdf)
+                    everdf = join_ever_delinq_features(everdf, delinq_merge)
+                    del(delinq_merge)
+                    joined_df = create_joined_df(gdf, everdf)
+                    testdf = create_12_mon_features(joined_df)
+                    joined_df = combine_joined_12_mon(joined_df, testdf)
+                    del(testdf)
+                with stage("join"):
+                    perf_df = final_performance_delinquency(gdf, joined_df)
+                    del(gdf, joined_df)
+                    final_gdf = join_perf_acq_gdfs(perf_df, acq_gdf)
+                    del(perf_df)
+                    del(acq_gdf)
+            with stage("clean"):
+                if validation_percent:
+                    train_gdf, valid_gdf = split_validation(final_gdf, validation_percent)
+                    del(final_gdf)
+                    final_gdf = (last_mile_cleaning(train_gdf, output=etl_output),
+                                 last_mile_cleaning(valid_gdf, output=etl_output))
+                else:
+                    final_gdf = last_mile_cleaning(final_gdf, output=etl_output)
+            partition_done(rows, bytes_read=os.path.getsize(perf_file))
             return final_gdf
 
         def gpu_load_performance_csv(performance_path, **kwargs):
@@ -222,7 +393,9 @@ if __name__ == '__main__':
 
             print(performance_path)
             
-            return cudf.read_csv(performance_path, names=cols, delimiter='|', dtype=list(dtypes.values()), skiprows=1)
+            # compressed inputs (.gz/.bz2/.zst) are streamed to the parser, decompressed ahead of it on several threads
+            return cudf.read_csv(read_input(performance_path), names=cols, delimiter='|', dtype=list(dtypes.values()), skiprows=1,
+                                 usecols=[col for col in cols if col not in pruned_inputs])
 
         def gpu_load_acquisition_csv(acquisition_path, **kwargs):
             """ Loads acquisition data
@@ -270,7 +443,8 @@ if __name__ == '__main__':
             
             print(acquisition_path)
             
-            return cudf.read_csv(acquisition_path, names=cols, delimiter='|', dtype=list(dtypes.values()), skiprows=1)
+            return cudf.read_csv(read_input(acquisition_path), names=cols, delimiter='|', dtype=list(dtypes.values()), skiprows=1,
+                                 usecols=[col for col in cols if col not in pruned_inputs])
 
         def gpu_load_names(**kwargs):
             """ Loads names used for renaming the banks
@@ -291,6 +465,41 @@ if __name__ == '__main__':
 
             return cudf.read_csv(col_names_path, names=cols, delimiter='|', dtype=list(dtypes.values()), skiprows=1)
 
+        def gpu_load_category_lookup(registry, column, **kwargs):
+            """ Loads the global dictionary of one categorical column
+
+            Returns
+            -------
+            GPU DataFrame
+            """
+
+            cols = [
+                column, column + '_code'
+            ]
+
+            dtypes = OrderedDict([
+                (column, "category"),
+                (column + '_code', "int32"),
+            ])
+
+            return cudf.read_csv(registry.lookup_file(column), names=cols, delimiter='|', dtype=list(dtypes.values()), skiprows=1)
+
+        def encode_categories(gdf, registry, **kwargs):
+            """ Replaces categorical columns by their global int32 codes
+
+            Codes come from the registry shared by all partitions, so they
+            agree across files; unknown values and nulls become -1.
+            """
+            for column in registry.columns:
+                if column not in gdf.columns:
+                    continue
+                lookup = gpu_load_category_lookup(registry, column)
+                gdf = gdf.merge(lookup, how='left', on=[column], type='hash')
+                gdf.drop_column(column)
+                gdf[column] = gdf[column + '_code'].fillna(-1)
+                gdf.drop_column(column + '_code')
+            return gdf
+
 
         # In[ ]:
 
@@ -444,7 +653,66 @@ if __name__ == '__main__':
         # In[ ]:
 
 
-        def last_mile_cleaning(df, **kwargs):
+        def sample_loans(df, percent, **kwargs):
+            """ Keeps the rows of a deterministic `percent` of the loans
+
+            Applied to every acquisition and performance file right after
+            parsing, keyed on the loan_id hash above the validation split's
+            digits, so a kept loan keeps its whole history in every file.
+
+            Returns
+            -------
+            GPU DataFrame
+            """
+            df['sample_bucket'] = ((df['loan_id'] % LOAN_HASH_MODULUS) * LOAN_HASH_MULTIPLIER) % LOAN_HASH_MODULUS // 100 % SAMPLE_BUCKETS
+            df = df.query('sample_bucket < %d' % sample_threshold(percent))
+            df.drop_column('sample_bucket')
+            return df
+
+        def keep_loans(perf, acq, **kwargs):
+            """ Drops the performance rows of the loans missing from the (filtered) acquisition frame
+
+            Returns
+            -------
+            GPU DataFrame
+            """
+            return perf.merge(acq[['loan_id']], how='inner', on=['loan_id'], type='hash')
+
+        def split_validation(df, percent, **kwargs):
+            """ Splits off the rows of a deterministic `percent` of the loans
+
+            Whole loans go to one side, keyed on a hash of loan_id, so every
+            partition and every run holds out the same loans.
+
+            Returns
+            -------
+            (training GPU DataFrame, validation GPU DataFrame)
+            """
+            df['validation_bucket'] = ((df['loan_id'] % LOAN_HASH_MODULUS) * LOAN_HASH_MULTIPLIER) % LOAN_HASH_MODULUS % 100
+            valid_df = df.query('validation_bucket < %d' % percent)
+            train_df = df.query('validation_bucket >= %d' % percent)
+            valid_df.drop_column('validation_bucket')
+            train_df.drop_column('validation_bucket')
+            return train_df, valid_df
+
+        def last_mile_cleaning(df, output="arrow", order="C", **kwargs):
+            """ Drops the bookkeeping columns and casts the features for training
+
+            Parameters
+            ----------
+            output : str
+                "arrow" returns an Arrow table of float32 columns (with an
+                int32 label). "matrix" returns `(features, labels, names)`: a
+                float32 NumPy matrix assembled on the device, with nulls filled
+                as -1 there, and brought over in one device-to-host copy, a
+                float32 label vector and the column names.
+                The matrix goes to XGBoost as is, skipping the Arrow ->
+                DataFrame -> DMatrix round trip of the conversion phase.
+            order : str
+                memory layout of the "matrix" output. "C", row major, is what
+                XGBoost ingests without copying; "F" makes DMatrix copy the
+                matrix into rows on the host
+            """
             drop_list = [
                 'loan_id', 'orig_date', 'first_pay_date', 'seller_name',
                 'monthly_reporting_period', 'last_paid_installment_date', 'maturity_date', 'ever_30', 'ever_90', 'ever_180',
@@ -452,8 +720,13 @@ if __name__ == '__main__':
                 'zero_balance_effective_date','foreclosed_after', 'disposition_date','timestamp'
             ]
             for column in drop_list:
-                df.drop_column(column)
+                # pruned inputs were never loaded
+                if column in df.columns:
+                    df.drop_column(column)
+            if output == "matrix":
+                return emit_feature_matrix(df, order=order)
             for col, dtype in df.dtypes.iteritems():
+                # categorical columns arrive already encoded when a registry is used
                 if str(dtype)=='category':
                     df[col] = df[col].cat.codes
                 df[col] = df[col].astype('float32')
@@ -463,10 +736,61 @@ if __name__ == '__main__':
                 df[column] = df[column].fillna(-1)
             return df.to_arrow(preserve_index=False)
 
+        def emit_feature_matrix(df, label='delinquency_12', order="C", **kwargs):
+            features = [col for col in df.columns if col != label]
+            for col in features:
+                if str(df[col].dtype) == 'category':
+                    df[col] = df[col].cat.codes
+                # the cast and the null fill both run on the device, no host pass per column
+                df[col] = df[col].astype('float32').fillna(-1)
+            labels = (df[label].fillna(0) > 0).astype('float32').to_array()
+            # interleaved into `order` on the device, then a single contiguous copy
+            matrix = df.as_gpu_matrix(columns=features, order=order).copy_to_host()
+            return matrix, labels, features
+
+
+        # #### Optionally calibrate the cluster shape instead of running the workflow
+
+        # In[ ]:
+
+
+        def autotune_partition(perf_file):
+            year, quarter = re.search(r"Performance_(\d{4})Q(\d)", perf_file).groups()
+            result = run_gpu_workflow(quarter=int(quarter), year=int(year), perf_file=perf_file)
+            if validation_percent:
+                result = result[0]
+            return result[0].shape[0] if etl_output == "matrix" else result.num_rows
+
+        def autotune_setup(calibration_client):
+            for module in helper_modules:
+                calibration_client.upload_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), module))
+            calibration_client.run(initialize_rmm_pool)
+
+        if autotune:
+            # LocalCUDACluster starts one worker per GPU
+            autotune_workers = autotune_grid['workers'] or worker_counts(len(client.scheduler_info()['workers']))
+            client.close()
+            cluster.close()
+            sample = sorted(glob(os.path.join(perf_data_path + "/Performance_" + str(start_year) + "Q1*")))[:autotune_sample]
+            if etl_engine == "plan":
+                etl_plan = optimized_plan(sample)
+            best, _ = grid_search(lambda n, t: LocalCUDACluster(ip=IPADDR, n_workers=n, threads_per_worker=t),
+                                  sample, autotune_partition, setup=autotune_setup,
+                                  workers=autotune_workers, threads=autotune_grid['threads'],
+                                  split_sizes=autotune_grid['split_sizes'])
+            write_config(dask_conf_path, best)
+            print("best: %d workers x %d threads, split size %s, %.0f rows/s -> %s"
+                  % (best['nworkers'], best['nthreads'], best['split_size'] or "unchanged",
+                     best['rows_per_second'], dask_conf_path))
+            sys.exit(0)
+
+
+        metrics_server = MetricsServer(client, port=metrics_port, snapshot_path=metrics_snapshot_path).start()
 
         # ## ETL
         start = time.time()
         print("starting ETL-----")
+        metrics_server.set_phase("etl")
 
         # #### Perform all of ETL with a single call to
         # ```python
@@ -481,21 +805,143 @@ if __name__ == '__main__':
         # NOTE: The ETL calculates additional features which are then dropped before creating the XGBoost DMatrix.
         # This can be optimized to avoid calculating the dropped features.
 
-        gpu_dfs = []
+        acq_files = []
+        perf_files = []
+        for year in range(start_year, end_year + 1):
+            for quarter in range(1, 5):
+                acq_files += glob(resolve_input(acq_data_path + "/Acquisition_" + str(year) + "Q" + str(quarter) + ".txt"))
+                perf_files += glob(os.path.join(perf_data_path + "/Performance_" + str(year) + "Q" + str(quarter) + "*"))
+        registry = CategoryRegistry.load(categories_path) if os.path.exists(categories_path) else CategoryRegistry()
+        if not registry.covers(acq_files + perf_files):
+            # values of inputs the registry has not scanned would all be encoded as -1
+            print("scanning categories of %d input files not in %s" % (
+                sum(1 for file in acq_files + perf_files if not registry.covers([file])), categories_path))
+            registry.update(acq_files, perf_files)
+            registry.save(categories_path)
+        registry = client.scatter(registry, broadcast=True)
+
+        etl_tasks = []
         gpu_time = 0
         quarter = 1
         year = start_year
         count = 0
+        files_filtered = 0
+        bytes_filtered = 0
+        partition_catalog = None
+        if use_partition_catalog and row_filters and os.path.exists(catalog_path(perf_data_path)):
+            partition_catalog = PartitionCatalog.load(catalog_path(perf_data_path))
         while year <= end_year:
-            for file in glob(os.path.join(perf_data_path + "/Performance_" + str(year) + "Q" + str(quarter) + "*")):
-                print("file-->", file)
-                gpu_dfs.append(process_quarter_gpu(year=year, quarter=quarter, perf_file=file))
+            quarter_files = glob(os.path.join(perf_data_path + "/Performance_" + str(year) + "Q" + str(quarter) + "*"))
+            if not file_matches(file_filters, year, quarter):
+                # neither this quarter's performance files nor its acquisition file are read
+                quarter_files += glob(resolve_input(acq_data_path + "/Acquisition_" + str(year) + "Q" + str(quarter) + ".txt"))
+                files_filtered += len(quarter_files)
+                bytes_filtered += sum(os.path.getsize(file) for file in quarter_files)
+                quarter_files = []
+            if partition_catalog is not None:
+                skipped = [file for file in quarter_files if not partition_catalog.may_match(file, row_filters)]
+                files_filtered += len(skipped)
+                bytes_filtered += sum(os.path.getsize(file) for file in skipped)
+                quarter_files = [file for file in quarter_files if file not in skipped]
+            for file in quarter_files:
+                etl_tasks.append((year, quarter, file))
                 count += 1
             quarter += 1
             if quarter == 5:
                 year += 1
                 quarter = 1
-        wait(gpu_dfs)
+        if not etl_tasks:
+            raise ValueError("no performance files to process under %s for %d-%d (%d skipped by the filters)"
+                             % (perf_data_path, start_year, end_year, files_filtered))
+
+        if etl_engine == "plan":
+            etl_plan = optimized_plan([file for _, _, file in etl_tasks], partition_catalog)
+
+        etl_functions = [run_gpu_workflow, null_workaround, gpu_load_performance_csv, gpu_load_acquisition_csv,
+                         gpu_load_names, gpu_load_category_lookup, encode_categories, create_ever_features,
+                         create_delinq_features, join_ever_delinq_features, create_joined_df, create_12_mon_features,
+                         combine_joined_12_mon, final_performance_delinquency, join_perf_acq_gdfs,
+                         sample_loans, keep_loans, split_validation, last_mile_cleaning, emit_feature_matrix]
+        result_cache = ResultCache(cache_path, max_bytes=cache_bytes) if cache_path else None
+        if training_input == "external" and result_cache is None:
+            raise ValueError("training_input 'external' streams the partitions from the ETL cache, set cache_path")
+        workers = sorted(client.scheduler_info()['workers'])
+        cache_keys = {}
+        cached_files = {}
+        if result_cache is not None:
+            for year, quarter, file in etl_tasks:
+                cache_keys[file] = etl_cache_key(year=year, quarter=quarter, perf_file=file)
+            # entries are on the local disk of the worker that wrote them: ask every worker
+            holders = {}
+            for worker, sizes in client.run(cached_entries, result_cache, list(cache_keys.values())).items():
+                for key, size in sizes.items():
+                    holders.setdefault(key, {})[worker] = size
+            for file, key in cache_keys.items():
+                if key in holders:
+                    cached_files[file] = holders[key]
+
+        # work stealing is off, so place partitions up front: largest first, each on the least loaded worker,
+        # and a cached one on a worker holding it, which only reads its entry back.
+        # Knowing its queue also lets every worker read its upcoming files ahead.
+        costs = [min(cached_files[file].values()) if file in cached_files else estimate_cost(file)
+                 for _, _, file in etl_tasks]
+        allowed = dict((task, set(cached_files[file])) for task, (_, _, file) in enumerate(etl_tasks) if file in cached_files)
+        assignment, loads = lpt_assignment(costs, workers, allowed)
+        for worker in workers:
+            print("planned", worker, "%d partitions, %.2f GB" % (len(assignment[worker]), loads[worker] / 1e9))
+        if prefetch_depth:
+            for worker, tasks in assignment.items():
+                client.run(schedule_files, [etl_tasks[task][2] for task in tasks if etl_tasks[task][2] not in cached_files],
+                           depth=prefetch_depth, max_bytes=prefetch_bytes, workers=[worker])
+
+        def launch_partition(task, worker):
+            year, quarter, file = etl_tasks[task]
+            print("file-->", file)
+            return process_quarter_gpu(year=year, quarter=quarter, perf_file=file, registry=registry,
+                                       worker=worker, cache_key=cache_keys.get(file))
+
+        if speculation_slowdown:
+            speculation = SpeculativeExecutor(client, launch_partition, slowdown=speculation_slowdown)
+            gpu_dfs = speculation.run(assignment, costs)
+            speculation_stats = speculation.stats()
+            print("speculative copies: %d launched, %d finished first, %.1fs saved (%s)"
+                  % (speculation_stats['speculated'], speculation_stats['copy_wins'], speculation_stats['saved'],
+                     "projected" if speculation_stats['saved_projected'] else "measured"))
+            for record in speculation_stats['per_task']:
+                if record['winner'] == 'copy':
+                    print("  ", etl_tasks[record['task']][2], "copy on", record['worker'],
+                          "won after the original ran %.1fs of a projected %.1fs, saving %.1fs"
+                          % (record['original_elapsed'], record['original_projected'], record['saved']))
+        else:
+            gpu_dfs = [None] * len(etl_tasks)
+            for task, worker in submission_order(assignment):
+                gpu_dfs[task] = launch_partition(task, worker)
+        if training_input == "external":
+            # every future is released as soon as its partition is written, keeping where it went
+            task_of = dict((cache_keys[file], task) for task, (_, _, file) in enumerate(etl_tasks))
+            worker_keys = OrderedDict()
+            written = as_completed(gpu_dfs)
+            gpu_dfs = None
+            for future in written:
+                worker, key = future.result()
+                worker_keys.setdefault(worker, []).append(key)
+            del(written)
+            for keys in worker_keys.values():
+                keys.sort(key=task_of.get)
+        else:
+            wait(gpu_dfs)
+
+        if result_cache is not None:
+            # found at lookup time; an entry evicted before its task read it was recomputed all the same
+            print("etl cache entries found: %d of %d partitions" % (len(cached_files), len(etl_tasks)))
+
+        if filters:
+            print(pushdown_report(client.run(pushdown_stats).values(), files_filtered, bytes_filtered))
+
+        if prefetch_depth:
+            for worker, stats in client.run(prefetch_stats).items():
+                print("prefetch", worker, "hit rate: %.2f" % stats['hit_rate'],
+                      "io wait: %.2fs over %d tasks" % (stats['io_wait'], stats['tasks']))
 
 
         # In[ ]:
@@ -511,9 +957,17 @@ if __name__ == '__main__':
 
         end = time.time()
         print("****ETL done. Time used: ", end-start)
+        etl_seconds = end - start
+        if training_input == "external":
+            worker, keys = next(iter(worker_keys.items()))
+            feature_names = client.submit(result_feature_names, client.submit(load_cached, result_cache, keys[0],
+                                                                              workers=[worker])).result()
+        else:
+            feature_names = client.submit(result_feature_names, gpu_dfs[0]).result()
 
         start = time.time()
         print("starting data convertion----")
+        metrics_server.set_phase("conversion")
         # ## Machine Learning
 
         # #### Set the training parameters
@@ -552,28 +1006,73 @@ if __name__ == '__main__':
 
         # %%time
 
-        gpu_dfs = [delayed(DataFrame.from_arrow)(gpu_df) for gpu_df in gpu_dfs[:part_count]]
-        gpu_dfs = [gpu_df for gpu_df in gpu_dfs]
-        wait(gpu_dfs)
-
-        tmp_map = [(gpu_df, list(client.who_has(gpu_df).values())[0]) for gpu_df in gpu_dfs]
-        new_map = {}
-        for key, value in tmp_map:
-            if value not in new_map:
-                new_map[value] = [key]
+        def feature_matrices_to_dmatrix(parts):
+            if len(parts) == 1:
+                matrix, labels = parts[0][:2]
             else:
-                new_map[value].append(key)
-
-        del(tmp_map)
-        gpu_dfs = []
-        for list_delayed in new_map.values():
-            gpu_dfs.append(delayed(cudf.concat)(list_delayed))
+                matrix = np.concatenate([part[0] for part in parts])
+                labels = np.concatenate([part[1] for part in parts])
+            return xgb.DMatrix(matrix, label=labels)
+
+        def validation_dmatrix(parts):
+            if etl_output == "matrix":
+                return feature_matrices_to_dmatrix(parts)
+            frames = [part.to_pandas() for part in parts]
+            frame = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+            # the same column order the training DMatrix gets from columns.difference
+            features = frame[sorted(frame.columns.difference(['delinquency_12']))]
+            return xgb.DMatrix(features.values.astype(np.float32), label=frame['delinquency_12'].values,
+                               feature_names=list(features.columns))
+
+        if validation_percent:
+            # the held out loans are small; they are evaluated on the driver
+            if training_input == "external":
+                parts = [client.submit(load_cached, result_cache, key, workers=[worker])
+                         for worker, keys in worker_keys.items() for key in keys][:part_count]
+            else:
+                parts = gpu_dfs[:part_count]
+            dvalid = validation_dmatrix(client.gather([client.submit(operator.getitem, part, 1) for part in parts]))
+            del(parts)
+            if training_input != "external":
+                gpu_dfs = [client.submit(operator.getitem, gpu_df, 0) for gpu_df in gpu_dfs]
+            print("validation rows:", dvalid.num_row())
+
+        if training_input == "external":
+            # nothing is concatenated: each worker pages its partitions through XGBoost's external memory
+            gpu_dfs = [client.persist(delayed(worker_dmatrix)(result_cache, keys, external_cache_path,
+                                                               batch_rows=external_batch_rows), workers=[worker])
+                       for worker, keys in worker_keys.items()]
+        else:
+            if etl_output == "matrix":
+                gpu_dfs = gpu_dfs[:part_count]
+            else:
+                gpu_dfs = [delayed(DataFrame.from_arrow)(gpu_df) for gpu_df in gpu_dfs[:part_count]]
+                gpu_dfs = [gpu_df for gpu_df in gpu_dfs]
+            wait(gpu_dfs)
+
+            tmp_map = [(gpu_df, list(client.who_has(gpu_df).values())[0]) for gpu_df in gpu_dfs]
+            new_map = {}
+            for key, value in tmp_map:
+                if value not in new_map:
+                    new_map[value] = [key]
+                else:
+                    new_map[value].append(key)
+
+            del(tmp_map)
+            if etl_output == "matrix":
+                # the ETL output already is the training matrix; only partitions sharing a worker get stacked
+                gpu_dfs = [delayed(feature_matrices_to_dmatrix)(list_delayed) for list_delayed in new_map.values()]
+                del(new_map)
+            else:
+                gpu_dfs = []
+                for list_delayed in new_map.values():
+                    gpu_dfs.append(delayed(cudf.concat)(list_delayed))
 
-        del(new_map)
-        gpu_dfs = [(gpu_df[['delinquency_12']], gpu_df[delayed(list)(gpu_df.columns.difference(['delinquency_12']))]) for gpu_df in gpu_dfs]
-        gpu_dfs = [(gpu_df[0].persist(), gpu_df[1].persist()) for gpu_df in gpu_dfs]
+                del(new_map)
+                gpu_dfs = [(gpu_df[['delinquency_12']], gpu_df[delayed(list)(gpu_df.columns.difference(['delinquency_12']))]) for gpu_df in gpu_dfs]
+                gpu_dfs = [(gpu_df[0].persist(), gpu_df[1].persist()) for gpu_df in gpu_dfs]
 
-        gpu_dfs = [dask.delayed(xgb.DMatrix)(gpu_df[1], gpu_df[0]) for gpu_df in gpu_dfs]
+                gpu_dfs = [dask.delayed(xgb.DMatrix)(gpu_df[1], gpu_df[0]) for gpu_df in gpu_dfs]
         gpu_dfs = [gpu_df.persist() for gpu_df in gpu_dfs]
         gc.collect()
         wait(gpu_dfs)
@@ -590,10 +1089,51 @@ if __name__ == '__main__':
 
         start = time.time()
         print("starting training----")
+        metrics_server.set_phase("training")
 
         # %%time
         labels = None
-        bst = dxgb_gpu.train(client, dxgb_gpu_params, gpu_dfs, labels, num_boost_round=dxgb_gpu_params['nround'])
+        if validation_percent:
+            # train in chunks of eval_every rounds, each continuing the previous booster; the booster of the
+            # best validation score is kept, not the last one
+            def train_chunk(booster, rounds):
+                trees = len(booster.get_dump()) if booster is not None else 0
+                booster = dxgb_gpu.train(client, dxgb_gpu_params, gpu_dfs, labels,
+                                         num_boost_round=rounds, xgb_model=booster)
+                if len(booster.get_dump()) != trees + rounds:
+                    raise RuntimeError("dask_xgboost did not continue the previous booster (%d trees, expected %d)"
+                                       % (len(booster.get_dump()), trees + rounds))
+                return booster
+
+            bst, early_stopping = train_with_early_stopping(
+                train_chunk,
+                lambda booster: rmse(booster.predict(dvalid), dvalid.get_label()),
+                dxgb_gpu_params['nround'], eval_every=eval_every,
+                stopper=EarlyStopping(patience=early_stopping_rounds))
+            print("stopped after %d of %d rounds (best %d, validation RMSE %.6f), saved ~%.1fs"
+                  % (early_stopping['rounds'], dxgb_gpu_params['nround'], early_stopping['best_round'],
+                     early_stopping['best_score'], early_stopping['seconds_saved']))
+        else:
+            bst = dxgb_gpu.train(client, dxgb_gpu_params, gpu_dfs, labels, num_boost_round=dxgb_gpu_params['nround'])
 
         end = time.time()
         print("****Training done. Time used: ", end-start)
+        if training_input == "external":
+            # the partitions were pinned on every worker that wrote a copy of them
+            client.run(unpin_entries, result_cache, list(cache_keys.values()))
+            del(worker_keys)
+        usage = feature_usage(bst, feature_names)
+        validation_score = early_stopping['best_score'] if validation_percent else None
+        if prune_features:
+            print("pruned input columns:", ", ".join(sorted(pruned_inputs)))
+            print(pruning_report(load_profile(feature_profile_path), etl_seconds, validation_score))
+        else:
+            save_profile(feature_profile_path, usage, etl_seconds=etl_seconds, validation_score=validation_score)
+            print("feature usage written to", feature_profile_path)
+        train_rows = sum(client.gather(client.compute([delayed(xgb.DMatrix.num_row)(gpu_df) for gpu_df in gpu_dfs])))
+        trained_rounds = early_stopping['rounds'] if validation_percent else dxgb_gpu_params['nround']
+        print("training input %s: %d rows, %.0f rows*rounds/s" % (training_input, train_rows, train_rows * trained_rounds / (end - start)))
+
+        metrics_server.set_phase("done")
+        metrics_server.stop()
+        metrics_server.poll()
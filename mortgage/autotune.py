@@ -0,0 +1,169 @@
+"""Calibration of workers, threads per worker and split size.
+
+The number of workers, their thread count and the split size handed to
+`split-data-mortgage.sh` used to be picked by hand. `grid_search` runs
+the real per-partition ETL on a sample of the data for every combination
+of a small grid, each on a fresh cluster, measures rows/s and the peak
+resident memory of the workers, and `write_config` stores the winner in
+dask.conf, where the launcher, the run scripts and the split script pick
+it up (`NWORKERS`, `NTHREADS`, `SPLIT_SIZE`).
+"""
+import itertools
+import os
+import shutil
+import tempfile
+import time
+
+
+def resplit(paths, size, directory):
+    """ Re-cuts consecutive loan_id-sorted split files into parts of ~`size` bytes
+
+    Like split-data-mortgage.sh, a part is only closed where the loan_id
+    changes, so no loan's history spans two parts. The loaders skip the
+    first line of every split, so the first line of each input is left
+    out and each part starts with an empty line of its own: the parts
+    hold exactly the rows the ETL reads from the inputs.
+
+    Returns
+    -------
+    list of str
+        paths of the new parts, named after the first input
+    """
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.basename(paths[0]).split(".txt")[0] + ".txt"
+    parts = []
+    out = None
+    written = 0
+    last_loan = None
+    for path in paths:
+        with open(path, "rb") as f:
+            next(f, None)
+            for line in f:
+                loan = line.split(b"|", 1)[0]
+                if out is None or (written >= size and loan != last_loan):
+                    if out is not None:
+                        out.close()
+                    parts.append(os.path.join(directory, "%s_%d" % (base, len(parts))))
+                    out = open(parts[-1], "wb")
+                    out.write(b"\n")
+                    written = 0
+                out.write(line)
+                written += len(line)
+                last_loan = loan
+    if out is not None:
+        out.close()
+    return parts
+
+
+def worker_counts(max_workers):
+    """ Worker counts worth trying on a node with `max_workers` GPUs: powers of two, and all of them """
+    counts = [1]
+    while counts[-1] * 2 < max_workers:
+        counts.append(counts[-1] * 2)
+    if max_workers > counts[-1]:
+        counts.append(max_workers)
+    return tuple(counts)
+
+
+def peak_rss():
+    """ Peak resident set size of the calling process, in bytes """
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(make_cluster, nworkers, nthreads, files, etl, setup=None):
+    """ Runs `etl` over `files` on a fresh cluster
+
+    Parameters
+    ----------
+    make_cluster : callable
+        `make_cluster(nworkers, nthreads)` returns a started cluster
+    etl : callable
+        `etl(path)` processes one partition and returns its row count
+    setup : callable
+        `setup(client)` prepares the workers (upload modules, init pools);
+        it runs before the clock starts
+
+    Returns
+    -------
+    dict
+    """
+    from distributed import Client
+
+    cluster = make_cluster(nworkers, nthreads)
+    client = Client(cluster)
+    try:
+        if setup is not None:
+            setup(client)
+        start = time.time()
+        rows = sum(client.gather(client.map(etl, files, pure=False)))
+        elapsed = time.time() - start
+        peaks = client.run(peak_rss)
+    finally:
+        client.close()
+        cluster.close()
+    return {"nworkers": nworkers, "nthreads": nthreads, "rows": rows, "seconds": elapsed,
+            "rows_per_second": rows / elapsed if elapsed else 0.0,
+            "peak_worker_rss": max(peaks.values()) if peaks else 0,
+            "peak_total_rss": sum(peaks.values())}
+
+
+def grid_search(make_cluster, sample, etl, workers=(1,), threads=(1, 2),
+                split_sizes=(None,), memory_limit=None, setup=None, log=print):
+    """ Measures every (workers, threads, split size) combination
+
+    Parameters
+    ----------
+    sample : list of str
+        consecutive split files of one quarter, the calibration data
+    workers : sequence
+        worker counts to try, e.g. `worker_counts` of the node's GPUs
+    split_sizes : sequence
+        byte sizes to re-split the sample into; None keeps the sample as is
+    memory_limit : int
+        configurations whose total peak RSS exceeds it are not eligible
+
+    Returns
+    -------
+    (best result dict, list of all result dicts)
+    """
+    results = []
+    for size in split_sizes:
+        directory = tempfile.mkdtemp(prefix="autotune-") if size else None
+        try:
+            files = resplit(sample, size, directory) if size else list(sample)
+            for nworkers, nthreads in itertools.product(workers, threads):
+                result = measure(make_cluster, nworkers, nthreads, files, etl, setup=setup)
+                result["split_size"] = size
+                result["partitions"] = len(files)
+                results.append(result)
+                if log is not None:
+                    log("workers %2d threads %2d split %-12s %10.0f rows/s  peak RSS %6.2f GB"
+                        % (nworkers, nthreads, size or "as is", result["rows_per_second"],
+                           result["peak_total_rss"] / 1e9))
+        finally:
+            if directory:
+                shutil.rmtree(directory, ignore_errors=True)
+    eligible = [r for r in results if memory_limit is None or r["peak_total_rss"] <= memory_limit]
+    if not eligible:
+        raise RuntimeError("no configuration stayed within the memory limit")
+    return max(eligible, key=lambda r: r["rows_per_second"]), results
+
+
+def write_config(path, best):
+    """ Stores NWORKERS, NTHREADS and SPLIT_SIZE in dask.conf, keeping everything else """
+    values = {"NWORKERS": best["nworkers"], "NTHREADS": best["nthreads"]}
+    if best.get("split_size"):
+        values["SPLIT_SIZE"] = best["split_size"]
+    lines = []
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            lines = f.read().split("\n")
+    for i, line in enumerate(lines):
+        fields = line.split()
+        if fields and fields[0] in values:
+            lines[i] = "%s %s" % (fields[0], values.pop(fields[0]))
+    for key, value in sorted(values.items()):
+        lines += ["", "%s %s" % (key, value)]
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
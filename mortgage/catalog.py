@@ -0,0 +1,216 @@
+"""Statistics catalog of the performance split files.
+
+The `Performance_YYYYQq_NN` splits carry no metadata, so anything that
+wants a range of loans or months has to parse every one of them. The
+catalog scans each split once, in parallel, and records its row count,
+byte size, min/max loan_id and min/max monthly_reporting_period (plus
+whether its rows are sorted by loan_id) in a JSON sidecar next to the
+splits. The ETL driver and ad-hoc queries then open only the splits
+whose ranges can hold what they look for.
+
+Entries are tied to the size and mtime of their file; a split that
+changed since it was scanned is treated as unknown (always opened) until
+`update` rescans it.
+
+Run `python catalog.py PERF_DIR` to build or refresh the catalog, and
+`python catalog.py PERF_DIR LOAN_FROM LOAN_TO [PERIOD_FROM PERIOD_TO]` to
+list the splits a loan_id/period range needs.
+"""
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from compression import open_text
+from filters import normalize
+
+
+CATALOG_NAME = "_catalog.json"
+
+# predicates the catalog can decide from its ranges
+RANGE_COLUMNS = ("loan_id", "monthly_reporting_period")
+
+
+def iso_date(value):
+    """ MM/DD/YYYY (as in the input files) or YYYY[-MM[-DD]] -> YYYY-MM-DD, which orders as text """
+    value = str(value)
+    if "/" in value:
+        month, day, year = value.split("/")
+        return "%s-%s-%s" % (year, month.zfill(2), day.zfill(2))
+    return value + "-01-01"[:10 - len(value)]
+
+
+def scan_split(path, skiprows=1):
+    """ Statistics of one performance split
+
+    Parameters
+    ----------
+    path : str
+        pipe-delimited performance file, possibly compressed
+    skiprows : int
+        leading lines to ignore, same as the loaders
+
+    Returns
+    -------
+    dict
+    """
+    rows = 0
+    loan_min = loan_max = previous = None
+    period_min = period_max = None
+    is_sorted = True
+    with open_text(path) as f:
+        for _ in range(skiprows):
+            f.readline()
+        for line in f:
+            fields = line.split("|", 2)
+            if len(fields) < 2:
+                continue
+            loan_id = int(fields[0])
+            period = iso_date(fields[1])
+            if rows == 0:
+                loan_min = loan_max = loan_id
+                period_min = period_max = period
+            else:
+                loan_min = min(loan_min, loan_id)
+                loan_max = max(loan_max, loan_id)
+                period_min = min(period_min, period)
+                period_max = max(period_max, period)
+                is_sorted = is_sorted and loan_id >= previous
+            previous = loan_id
+            rows += 1
+    stat = os.stat(path)
+    return OrderedDict([
+        ("rows", rows),
+        ("bytes", stat.st_size),
+        ("mtime", stat.st_mtime),
+        ("loan_id", [loan_min, loan_max]),
+        ("monthly_reporting_period", [period_min, period_max]),
+        ("sorted", is_sorted),
+    ])
+
+
+def range_may_match(low, high, op, value):
+    """ Whether a column with values in [low, high] can satisfy `op value` """
+    if low is None:
+        # an empty split
+        return False
+    if op == "==":
+        return low <= value <= high
+    if op == "<":
+        return low < value
+    if op == "<=":
+        return low <= value
+    if op == ">":
+        return high > value
+    if op == ">=":
+        return high >= value
+    if op == "in":
+        return any(low <= item <= high for item in value)
+    # != and "not in" rule a range out only when it is a single excluded value
+    if op == "!=":
+        return not (low == high == value)
+    return not (low == high and low in value)
+
+
+class PartitionCatalog(object):
+    """ Per-split statistics, keyed by file name """
+
+    def __init__(self, entries=None):
+        self.entries = OrderedDict(entries or [])
+
+    @classmethod
+    def build(cls, paths, max_workers=None):
+        """ Scans the splits in parallel
+
+        Returns
+        -------
+        PartitionCatalog
+        """
+        return cls().update(paths, max_workers=max_workers)
+
+    def update(self, paths, max_workers=None):
+        """ Scans the splits that are missing or changed since their entry; returns self """
+        stale = [path for path in paths if self.entry(path) is None]
+        if stale:
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                for path, entry in zip(stale, pool.map(scan_split, stale)):
+                    self.entries[os.path.basename(path)] = entry
+        self.entries = OrderedDict(sorted(self.entries.items()))
+        return self
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            return cls(json.load(f, object_pairs_hook=OrderedDict))
+
+    def save(self, path):
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f, indent=1)
+        os.rename(tmp, path)
+
+    def entry(self, path):
+        """ Statistics of a split, None if it is not catalogued or changed since """
+        entry = self.entries.get(os.path.basename(path))
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if stat.st_size != entry["bytes"] or stat.st_mtime != entry["mtime"]:
+            return None
+        return entry
+
+    def may_match(self, path, filters):
+        """ Whether a split can hold rows matching the loan_id/period predicates
+
+        Predicates on other columns are ignored; unknown splits always match.
+        """
+        entry = self.entry(path)
+        if entry is None:
+            return True
+        for column, op, value in normalize(filters):
+            if column not in RANGE_COLUMNS:
+                continue
+            if column == "monthly_reporting_period":
+                value = [iso_date(item) for item in value] if op in ("in", "not in") else iso_date(value)
+            low, high = entry[column]
+            if not range_may_match(low, high, op, value):
+                return False
+        return True
+
+    def select(self, paths, filters):
+        """ The splits of `paths` that may match, in their original order """
+        return [path for path in paths if self.may_match(path, filters)]
+
+
+def catalog_path(perf_data_path):
+    return os.path.join(perf_data_path, CATALOG_NAME)
+
+
+if __name__ == '__main__':
+    import sys
+    from glob import glob
+
+    perf_data_path = sys.argv[1]
+    paths = sorted(glob(os.path.join(perf_data_path, "Performance_*")))
+    if len(sys.argv) == 2:
+        path = catalog_path(perf_data_path)
+        catalog = PartitionCatalog.load(path) if os.path.exists(path) else PartitionCatalog()
+        catalog.update(paths).save(path)
+        rows = sum(entry["rows"] for entry in catalog.entries.values())
+        unsorted = [name for name, entry in catalog.entries.items() if not entry["sorted"]]
+        print("%d splits, %d rows catalogued in %s" % (len(catalog.entries), rows, path))
+        if unsorted:
+            print("not sorted by loan_id: %s" % ", ".join(unsorted))
+    else:
+        catalog = PartitionCatalog.load(catalog_path(perf_data_path))
+        filters = [("loan_id", ">=", int(sys.argv[2])), ("loan_id", "<=", int(sys.argv[3]))]
+        if len(sys.argv) > 5:
+            filters += [("monthly_reporting_period", ">=", sys.argv[4]), ("monthly_reporting_period", "<=", sys.argv[5])]
+        selected = catalog.select(paths, filters)
+        for path in selected:
+            entry = catalog.entry(path)
+            print(path, "%d rows" % entry["rows"] if entry else "(not catalogued)")
+        print("%d of %d splits" % (len(selected), len(paths)))
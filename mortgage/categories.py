@@ -0,0 +1,189 @@
+"""Global category dictionaries for the mortgage ETL.
+
+Every Performance_*/Acquisition_* file used to be parsed with its own
+category dictionary, so the codes `last_mile_cleaning` emitted for e.g.
+`servicer` meant different things in different partitions. The registry
+below is built once by scanning all inputs, broadcast to the workers, and
+used by the loaders to encode categorical columns straight to stable int32
+codes. Partitions encoded against the same registry concatenate without
+any re-coding.
+
+The registry records the size and mtime of every input it scanned. A run
+over inputs it does not cover (more years, a changed file) extends it
+first: otherwise their unseen values would all be encoded as -1.
+"""
+import json
+import os
+import tempfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from compression import open_text
+
+
+# column name -> field index in the pipe-delimited input files
+PERFORMANCE_CATEGORIES = OrderedDict([
+    ("servicer", 2),
+    ("mod_flag", 11),
+    ("zero_balance_code", 12),
+    ("repurchase_make_whole_proceeds_flag", 28),
+    ("servicing_activity_indicator", 30),
+])
+
+# seller_name is renamed through names.csv and dropped before training,
+# so it is left out of the registry
+ACQUISITION_CATEGORIES = OrderedDict([
+    ("orig_channel", 1),
+    ("first_home_buyer", 13),
+    ("loan_purpose", 14),
+    ("property_type", 15),
+    ("occupancy_status", 17),
+    ("property_state", 18),
+    ("product_type", 21),
+    ("relocation_mortgage_indicator", 24),
+])
+
+
+def scan_file(path, fields, skiprows=1):
+    """ Collects the distinct non-empty values of some fields of one file
+
+    Parameters
+    ----------
+    path : str
+        pipe-delimited input file, possibly compressed
+    fields : dict
+        column name -> field index
+    skiprows : int
+        leading lines to ignore, same as the loaders
+
+    Returns
+    -------
+    dict of column name -> set of str
+    """
+    values = {column: set() for column in fields}
+    with open_text(path) as f:
+        for _ in range(skiprows):
+            f.readline()
+        for line in f:
+            record = line.rstrip("\n").split("|")
+            for column, index in fields.items():
+                if index < len(record) and record[index] != "":
+                    values[column].add(record[index])
+    return values
+
+
+class CategoryRegistry(object):
+    """ Stable value -> code dictionaries for the categorical columns
+
+    Codes are assigned in sorted value order, so rebuilding the registry
+    from the same inputs always yields the same codes. Values that were
+    not seen during the scan are encoded as -1, like nulls.
+    """
+
+    def __init__(self, categories=None, inputs=None):
+        self.categories = OrderedDict(categories or [])
+        # path -> [bytes, mtime] of every scanned input
+        self.inputs = OrderedDict(inputs or [])
+
+    @property
+    def columns(self):
+        return list(self.categories.keys())
+
+    @classmethod
+    def build(cls, acquisition_paths, performance_paths, max_workers=None):
+        """ Scans the inputs in parallel and builds the registry
+
+        Returns
+        -------
+        CategoryRegistry
+        """
+        return cls().update(acquisition_paths, performance_paths, max_workers=max_workers)
+
+    def covers(self, paths):
+        """ Whether every one of `paths` was scanned, unchanged since """
+        return all(self.inputs.get(os.path.abspath(path)) == _stat(path) for path in paths)
+
+    def update(self, acquisition_paths, performance_paths, max_workers=None):
+        """ Scans the inputs the registry does not cover and adds their values; returns self
+
+        Codes stay in sorted value order, so they are the ones a build over
+        every input scanned so far would assign. When an input changed
+        since it was scanned, its old values cannot be told apart, and the
+        registry is rebuilt from the given inputs.
+        """
+        paths = [os.path.abspath(path) for path in list(acquisition_paths) + list(performance_paths)]
+        if any(path in self.inputs and self.inputs[path] != _stat(path) for path in paths):
+            self.categories = OrderedDict()
+            self.inputs = OrderedDict()
+        # stat before the scan: a file changing during it must not look covered
+        stats = dict((path, _stat(path)) for path in paths if path not in self.inputs)
+        jobs = [(path, ACQUISITION_CATEGORIES) for path in acquisition_paths]
+        jobs += [(path, PERFORMANCE_CATEGORIES) for path in performance_paths]
+        jobs = [(os.path.abspath(path), fields) for path, fields in jobs if os.path.abspath(path) in stats]
+        seen = OrderedDict(
+            (column, set(self.categories.get(column, ()))) for column in
+            list(PERFORMANCE_CATEGORIES) + list(ACQUISITION_CATEGORIES))
+        if jobs:
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                futures = [pool.submit(scan_file, path, fields) for path, fields in jobs]
+                for future in futures:
+                    for column, values in future.result().items():
+                        seen[column].update(values)
+        self.categories = OrderedDict((column, sorted(values)) for column, values in seen.items())
+        self.inputs.update(sorted(stats.items()))
+        return self
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            data = json.load(f, object_pairs_hook=OrderedDict)
+        if "categories" not in data:
+            # saved before the inputs were recorded: it covers nothing
+            return cls(data)
+        return cls(data["categories"], data["inputs"])
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(OrderedDict([("inputs", self.inputs), ("categories", self.categories)]), f, indent=1)
+
+    def codes(self, column):
+        """ Returns the value -> code mapping of one column """
+        return {value: code for code, value in enumerate(self.categories[column])}
+
+    def lookup_file(self, column, directory=None):
+        """ Materializes one column's dictionary as a pipe-delimited file
+
+        The file has the same layout as names.csv (a header line followed by
+        `value|code` rows), so workers parse it with the same reader as the
+        inputs and the join keys are guaranteed to match. Files are written
+        once per worker and reused by every later task.
+
+        Returns
+        -------
+        str
+            path of the lookup file
+        """
+        directory = directory or os.path.join(tempfile.gettempdir(), "mortgage-categories")
+        path = os.path.join(directory, "%s-%08x.csv" % (column, self._fingerprint(column)))
+        if not os.path.exists(path):
+            os.makedirs(directory, exist_ok=True)
+            tmp = "%s.%d.tmp" % (path, os.getpid())
+            with open(tmp, "w") as f:
+                f.write("%s|code\n" % column)
+                for code, value in enumerate(self.categories[column]):
+                    f.write("%s|%d\n" % (value, code))
+            os.rename(tmp, path)
+        return path
+
+    def _fingerprint(self, column):
+        # distinguishes lookup files of registries built from different inputs
+        return zlib.crc32("\n".join(self.categories[column]).encode())
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime]
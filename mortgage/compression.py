@@ -0,0 +1,324 @@
+"""Direct reading of compressed mortgage inputs.
+
+The Fannie Mae files ship compressed. Instead of decompressing them to
+disk before a run, the loaders hand them to `read_input`, which returns
+a stream the parser reads while the members are decompressed ahead of
+it on several cores.
+
+gzip, bzip2 and zstd files are all sequences of independently decodable
+members (pigz/bgzip blocks, pbzip2 streams, zstd frames). Member starts
+are located by their magic bytes. The member being read is streamed, and
+the candidates past its end are decoded speculatively on a thread pool;
+the real members are chained together from offset 0, so a magic
+sequence that merely happens to occur inside compressed data is
+discarded. zlib, bz2 and
+zstandard release the GIL while decoding, and threads, unlike a process
+pool, can be started from the daemonic processes of Dask workers.
+Single-member files simply decode on one core, chunk by chunk, whatever
+false candidates they contain.
+
+zstd support needs the optional `zstandard` package.
+
+Run `python compression.py FILE...` to benchmark against the
+decompress-to-disk-then-read baseline.
+"""
+import bz2
+import gzip
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+SUFFIXES = {".gz": "gzip", ".bz2": "bz2", ".zst": "zstd"}
+
+# bzip2 magic is followed by the block size digit
+MAGIC = {
+    "gzip": b"\x1f\x8b\x08",
+    "bz2": b"BZh",
+    "zstd": b"\x28\xb5\x2f\xfd",
+}
+
+FEED_SIZE = 1 << 20
+# output a speculatively decoded member may reach before it is left to be streamed
+SPECULATIVE_BYTES = 4 << 20
+# marks a member to stream at the read position
+STREAM = "stream"
+
+
+def compression_of(path):
+    """ Returns "gzip", "bz2", "zstd" or None judging by the file suffix """
+    return SUFFIXES.get(os.path.splitext(path)[1])
+
+
+def resolve_input(path):
+    """ Returns `path`, or its compressed variant when only that one exists """
+    if os.path.exists(path):
+        return path
+    for suffix in SUFFIXES:
+        if os.path.exists(path + suffix):
+            return path + suffix
+    return path
+
+
+def open_text(path):
+    """ Opens a possibly compressed input as a text stream (single core) """
+    kind = compression_of(path)
+    if kind == "gzip":
+        return gzip.open(path, "rt")
+    if kind == "bz2":
+        return bz2.open(path, "rt")
+    if kind == "zstd":
+        _require_zstandard()
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb")))
+    return open(path, "r")
+
+
+def read_input(path, max_workers=None):
+    """ Returns an input ready for the parser
+
+    Uncompressed files are returned as their path. Compressed ones are
+    returned as a buffered `MemberStream`, decompressed in parallel as the
+    parser reads it.
+    """
+    kind = compression_of(path)
+    if kind is None:
+        return path
+    return io.BufferedReader(MemberStream(path, kind, max_workers=max_workers), buffer_size=FEED_SIZE)
+
+
+class MemberStream(io.RawIOBase):
+    """ Read-only binary stream over the decompressed contents of a file
+
+    Holds one decoded member, plus the few decoding ahead of it, at a time.
+    """
+
+    def __init__(self, path, kind=None, max_workers=None):
+        super(MemberStream, self).__init__()
+        self._members = iter_decompressed(path, kind, max_workers=max_workers)
+        self._data = b""
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._position >= len(self._data):
+            self._data = next(self._members, None)
+            self._position = 0
+            if self._data is None:
+                self._data = b""
+                return 0
+        size = min(len(buffer), len(self._data) - self._position)
+        buffer[:size] = self._data[self._position:self._position + size]
+        self._position += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            # stops the decoding pool of an unfinished read
+            self._members.close()
+        super(MemberStream, self).close()
+
+
+def decompress(path, kind=None, max_workers=None):
+    """ Decompresses a whole file, decoding its members on several cores
+
+    Returns
+    -------
+    bytes
+    """
+    return b"".join(iter_decompressed(path, kind, max_workers=max_workers))
+
+
+def iter_decompressed(path, kind=None, max_workers=None):
+    """ Yields the decompressed contents of a file in order
+
+    The member at the read position is streamed in chunks as it decodes.
+    Once it ended, the candidates at or after its real end are decoded
+    speculatively, at most two per worker thread and `SPECULATIVE_BYTES`
+    of output each, and the next member is taken from them when it is
+    ready; a longer one is streamed like the first. A consumer can thus
+    parse incrementally in bounded memory, and the magic bytes that turn
+    up by chance inside a large member never cost more than its read.
+    """
+    kind = kind or compression_of(path)
+    if kind == "zstd":
+        _require_zstandard()
+    size = os.path.getsize(path)
+    candidates = iter(find_members(path, kind))
+    max_workers = max_workers or os.cpu_count() or 1
+    pool = None
+    pending = OrderedDict()
+    try:
+        offset = 0
+        while offset < size:
+            end, chunks = pending.pop(offset).result() if offset in pending else (STREAM, None)
+            if end is None:
+                raise IOError("%s: corrupt %s member at byte %d" % (path, kind, offset))
+            if end is STREAM:
+                end = yield from _stream_member(path, kind, offset)
+            else:
+                for data in chunks:
+                    yield data
+            offset = end
+            # candidates inside the members read so far were false starts
+            for start in [start for start in pending if start < offset]:
+                pending.pop(start).cancel()
+            while len(pending) < 2 * max_workers:
+                start = next(candidates, None)
+                if start is None:
+                    break
+                if start >= offset and start < size:
+                    pool = pool or ThreadPoolExecutor(max_workers=max_workers)
+                    pending[start] = pool.submit(_decode_member, path, kind, start)
+    finally:
+        for future in pending.values():
+            future.cancel()
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+
+def find_members(path, kind):
+    """ Returns the byte offsets where a member could start """
+    magic = MAGIC[kind]
+    offsets = []
+    overlap = len(magic) - 1
+    with open(path, "rb") as f:
+        base = 0
+        tail = b""
+        while True:
+            chunk = f.read(FEED_SIZE)
+            if not chunk:
+                break
+            window = tail + chunk
+            start = base - len(tail)
+            i = window.find(magic)
+            while i != -1:
+                if not offsets or offsets[-1] != start + i:
+                    if kind != "bz2" or window[i + 3:i + 4].isdigit() or i + 3 >= len(window):
+                        offsets.append(start + i)
+                i = window.find(magic, i + 1)
+            tail = window[-overlap:] if overlap else b""
+            base += len(chunk)
+    return offsets
+
+
+def _decompressor(kind):
+    if kind == "gzip":
+        return zlib.decompressobj(zlib.MAX_WBITS | 16)
+    if kind == "bz2":
+        return bz2.BZ2Decompressor()
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def _stream_member(path, kind, offset=0):
+    """ Yields the decoded chunks of the member starting at `offset`; returns where it ends """
+    decoder = _decompressor(kind)
+    consumed = 0
+    with open(path, "rb") as f:
+        f.seek(offset)
+        try:
+            while not decoder.eof:
+                chunk = f.read(FEED_SIZE)
+                if not chunk:
+                    break
+                data = decoder.decompress(chunk)
+                consumed += len(chunk) - (len(decoder.unused_data) if decoder.eof else 0)
+                if data:
+                    yield data
+        except (zlib.error, OSError, EOFError, ValueError) + _zstd_errors():
+            raise IOError("%s: corrupt %s member at byte %d" % (path, kind, offset))
+    if os.path.getsize(path) > offset and not decoder.eof:
+        raise IOError("%s: truncated %s input" % (path, kind))
+    return offset + consumed
+
+
+def _decode_member(path, kind, offset, max_bytes=None):
+    """ Decodes the single member starting at `offset`, unless it grows past `max_bytes`
+
+    Returns
+    -------
+    (end offset, list of decoded chunks); the end is None when `offset`
+    is not a member start, and `STREAM` (without chunks) when the member
+    decodes to more than `max_bytes` (default `SPECULATIVE_BYTES`)
+    """
+    max_bytes = max_bytes or SPECULATIVE_BYTES
+    out = []
+    decoded = 0
+    consumed = 0
+    decoder = _decompressor(kind)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        try:
+            while True:
+                chunk = f.read(FEED_SIZE)
+                if not chunk:
+                    break
+                data = decoder.decompress(chunk)
+                out.append(data)
+                decoded += len(data)
+                if decoder.eof:
+                    consumed += len(chunk) - len(decoder.unused_data)
+                    return offset + consumed, out
+                if decoded > max_bytes:
+                    return STREAM, None
+                consumed += len(chunk)
+        except (zlib.error, OSError, EOFError, ValueError) + _zstd_errors():
+            return None, None
+    return None, None
+
+
+def _zstd_errors():
+    return (zstandard.ZstdError,) if zstandard is not None else ()
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("reading .zst inputs requires the zstandard package")
+
+
+def benchmark(path, max_workers=None):
+    """ Times parallel in-memory decoding against decompress-to-disk-then-read
+
+    Returns
+    -------
+    dict of seconds
+    """
+    kind = compression_of(path)
+    start = time.time()
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    try:
+        with open_text(path) as src:
+            shutil.copyfileobj(src.buffer if hasattr(src, "buffer") else src, tmp)
+        tmp.close()
+        with open(tmp.name, "rb") as f:
+            baseline = f.read()
+        baseline_time = time.time() - start
+    finally:
+        os.unlink(tmp.name)
+    start = time.time()
+    data = decompress(path, kind, max_workers=max_workers)
+    parallel_time = time.time() - start
+    if data != baseline:
+        raise AssertionError("%s: parallel and serial decompression differ" % path)
+    return {"members": len(find_members(path, kind)),
+            "baseline": baseline_time, "parallel": parallel_time}
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        result = benchmark(path)
+        print("%s: %d candidate members, decompress-then-read %.2fs, parallel %.2fs (%.1fx)"
+              % (path, result["members"], result["baseline"], result["parallel"],
+                 result["baseline"] / max(result["parallel"], 1e-9)))
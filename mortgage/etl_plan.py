@@ -0,0 +1,751 @@
+"""Declarative form of the mortgage ETL with a small plan optimizer.
+
+The feature functions in E2E.py each slice their own columns out of the
+same performance frame, `null_workaround` refills every column of frames
+that are already filled, and the 12 passes of `create_12_mon_features`
+recompute the same month index each time. Here the same workflow is a
+graph of operators (scan, project, filter, groupby-agg, join, assign,
+drop, fill, cast, concat) and `optimize` rewrites it before it runs:
+
+- identical subgraphs are merged (common subexpressions run once) and
+  every scan of a source is served by a single scan,
+- null filling is restricted to the columns that can still be null (a
+  left join only introduces nulls on its right side), and dropped when
+  none can,
+- chains of fills and casts are fused into one per-column pass, with
+  integer casts that a later, no wider integer cast overrides removed,
+- chains of left joins on keys of the same base frame are reordered so
+  that the smallest estimated right side is joined first.
+
+`explain` prints the optimized plan; `execute` runs it on cudf through
+`CudfEngine`, freeing each intermediate once its last consumer ran.
+
+Run `python etl_plan.py` to print the optimized mortgage plan.
+"""
+import operator
+from collections import OrderedDict
+
+
+class Node(object):
+    """ One operator of a plan; `params` must be hashable """
+
+    def __init__(self, op, inputs=(), **params):
+        self.op = op
+        self.inputs = tuple(inputs)
+        self.params = params
+        self._key = None
+
+    def key(self):
+        """ Structural identity: equal keys compute equal results """
+        if self._key is None:
+            self._key = (self.op, tuple(sorted(self.params.items())), tuple(node.key() for node in self.inputs))
+        return self._key
+
+    def with_inputs(self, inputs, **params):
+        merged = dict(self.params)
+        merged.update(params)
+        return Node(self.op, inputs, **merged)
+
+
+# operators
+
+def scan(source, columns=None):
+    """ The frame passed as `sources[source]`; None reads all its columns """
+    return Node("scan", source=source, columns=tuple(columns) if columns else None)
+
+
+def project(node, columns):
+    return Node("project", [node], columns=tuple(columns))
+
+
+def filter_rows(node, column, comparison, value, selectivity=0.5):
+    """ Keeps the rows where `column comparison value`; `selectivity` feeds the size estimates """
+    return Node("filter", [node], column=column, comparison=comparison, value=value, selectivity=selectivity)
+
+
+def groupby_agg(node, by, aggs, reduction=0.1):
+    """ Groups by `by`; `aggs` is a sequence of (column, function, output name) """
+    return Node("groupby_agg", [node], by=tuple(by), aggs=tuple(tuple(agg) for agg in aggs), reduction=reduction)
+
+
+def join(left, right, on, how="left"):
+    return Node("join", [left, right], on=tuple(on), how=how)
+
+
+def assign(node, name, expr):
+    return Node("assign", [node], name=name, expr=expr)
+
+
+def drop(node, columns):
+    return Node("drop", [node], columns=tuple(columns))
+
+
+def fill(node, values):
+    """ Fills the nulls of each column with its value, given as (column, value) pairs """
+    return Node("fill", [node], values=tuple(tuple(value) for value in values))
+
+
+def fill_nulls(node, columns=None):
+    """ `null_workaround`: categories to int32 codes, numeric nulls to -1 """
+    return Node("fill_nulls", [node], columns=tuple(columns) if columns else None)
+
+
+def cast(node, dtypes):
+    return Node("cast", [node], dtypes=tuple(tuple(dtype) for dtype in dtypes))
+
+
+def concat(nodes):
+    return Node("concat", nodes)
+
+
+# expressions of `assign`, as nested tuples so that they hash
+
+def col(name):
+    return ("col", name)
+
+
+def lit(value, dtype=None):
+    return ("lit", value, dtype)
+
+
+def binary(op, left, right):
+    return (op, left, right)
+
+
+def call(function, arg, *params):
+    return (function, arg) + params
+
+
+def epoch(unit="ms"):
+    """ The 1970-01-01 fill value of the delinquency dates """
+    return ("datetime64[%s]" % unit, "1970-01-01")
+
+
+BINARY = {
+    "+": operator.add, "-": operator.sub, "*": operator.mul, "/": operator.truediv,
+    ">=": operator.ge, ">": operator.gt, "==": operator.eq,
+}
+
+
+def _expr_columns(expr):
+    if expr[0] == "col":
+        return set([expr[1]])
+    if expr[0] == "lit":
+        return set()
+    columns = set()
+    for arg in expr[1:]:
+        if isinstance(arg, tuple):
+            columns |= _expr_columns(arg)
+    return columns
+
+
+def _format_expr(expr):
+    if expr[0] == "col":
+        return expr[1]
+    if expr[0] == "lit":
+        return repr(expr[1]) if expr[2] is None else "%s(%r)" % (expr[2], expr[1])
+    if expr[0] in BINARY:
+        return "(%s %s %s)" % (_format_expr(expr[1]), expr[0], _format_expr(expr[2]))
+    return "%s(%s)" % (expr[0], ", ".join(_format_expr(arg) if isinstance(arg, tuple) else repr(arg)
+                                          for arg in expr[1:]))
+
+
+# graph helpers
+
+def _postorder(root):
+    """ Nodes in execution order; right inputs first, so the left (probe)
+    side, usually the big frame updated in place, is touched last """
+    order = []
+    seen = set()
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            order.append(node)
+            continue
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        stack.append((node, True))
+        for child in node.inputs:
+            stack.append((child, False))
+    return order
+
+
+def consumer_counts(root):
+    counts = {id(root): 1}
+    for node in _postorder(root):
+        for child in node.inputs:
+            counts[id(child)] = counts.get(id(child), 0) + 1
+    return counts
+
+
+def _rewrite(root, rule):
+    """ Rebuilds the graph bottom up
+
+    `rule(rebuilt, original, memo)` returns the replacement of every node;
+    `memo` maps the id of an original node to its replacement.
+    """
+    memo = {}
+    for node in _postorder(root):
+        rebuilt = node.with_inputs([memo[id(child)] for child in node.inputs]) if node.inputs else node
+        memo[id(node)] = rule(rebuilt, node, memo)
+    return memo[id(root)]
+
+
+def columns_of(node, memo=None):
+    """ Output columns of a node, None when they depend on an unknown source schema """
+    memo = {} if memo is None else memo
+    if id(node) in memo:
+        return memo[id(node)]
+    op = node.op
+    inputs = [columns_of(child, memo) for child in node.inputs]
+    if op == "scan":
+        result = set(node.params["columns"]) if node.params["columns"] else None
+    elif op == "project":
+        result = set(node.params["columns"])
+    elif op == "groupby_agg":
+        result = set(node.params["by"]) | set(agg[2] for agg in node.params["aggs"])
+    elif op == "join":
+        result = None if None in inputs else inputs[0] | inputs[1]
+    elif op == "assign":
+        result = None if inputs[0] is None else inputs[0] | set([node.params["name"]])
+    elif op == "drop":
+        result = None if inputs[0] is None else inputs[0] - set(node.params["columns"])
+    else:
+        result = inputs[0]
+    memo[id(node)] = result
+    return result
+
+
+def nullable_of(node, memo=None, columns=None):
+    """ Columns of a node's output that may hold nulls, None for "any of them" """
+    memo = {} if memo is None else memo
+    columns = {} if columns is None else columns
+    if id(node) in memo:
+        return memo[id(node)]
+    op = node.op
+    inputs = [nullable_of(child, memo, columns) for child in node.inputs]
+    if op == "scan":
+        result = None
+    elif op == "project":
+        result = set(node.params["columns"]) if inputs[0] is None else inputs[0] & set(node.params["columns"])
+    elif op == "groupby_agg":
+        sources = set(agg[0] for agg in node.params["aggs"])
+        if inputs[0] is not None:
+            sources &= inputs[0]
+        result = set(agg[2] for agg in node.params["aggs"] if agg[0] in sources)
+    elif op == "join":
+        right_columns = columns_of(node.inputs[1], columns)
+        if node.params["how"] == "left" and right_columns is not None and inputs[0] is not None:
+            result = inputs[0] | (right_columns - set(node.params["on"]))
+        elif node.params["how"] == "inner" and None not in inputs:
+            result = inputs[0] | inputs[1]
+        else:
+            result = None
+    elif op == "assign":
+        if inputs[0] is None:
+            result = None
+        elif _expr_columns(node.params["expr"]) & inputs[0]:
+            result = inputs[0] | set([node.params["name"]])
+        else:
+            result = inputs[0] - set([node.params["name"]])
+    elif op == "drop":
+        result = None if inputs[0] is None else inputs[0] - set(node.params["columns"])
+    elif op == "fill":
+        filled = set(value[0] for value in node.params["values"])
+        result = None if inputs[0] is None else inputs[0] - filled
+    elif op == "fill_nulls":
+        if node.params["columns"] is None:
+            result = set()
+        else:
+            result = None if inputs[0] is None else inputs[0] - set(node.params["columns"])
+    elif op == "concat":
+        result = None if None in inputs else set().union(*inputs)
+    else:
+        result = inputs[0]
+    memo[id(node)] = result
+    return result
+
+
+def estimate_rows(node, source_rows=None, memo=None):
+    source_rows = source_rows or {}
+    memo = {} if memo is None else memo
+    if id(node) in memo:
+        return memo[id(node)]
+    inputs = [estimate_rows(child, source_rows, memo) for child in node.inputs]
+    if node.op == "scan":
+        result = source_rows.get(node.params["source"], 1e6)
+    elif node.op == "filter":
+        result = inputs[0] * node.params["selectivity"]
+    elif node.op == "groupby_agg":
+        result = inputs[0] * node.params["reduction"]
+    elif node.op == "join":
+        result = min(inputs) if node.params["how"] == "inner" else inputs[0]
+    elif node.op == "concat":
+        result = sum(inputs)
+    else:
+        result = inputs[0]
+    memo[id(node)] = result
+    return result
+
+
+# optimizer passes
+
+def _cse(root, report):
+    canonical = {}
+
+    def rule(node, original, memo):
+        key = node.key()
+        if key in canonical:
+            report["merged"] += 1
+            return canonical[key]
+        canonical[key] = node
+        return node
+    return _rewrite(root, rule)
+
+
+def _merge_scans(root, report):
+    wanted = OrderedDict()
+    for node in _postorder(root):
+        if node.op == "scan":
+            source, columns = node.params["source"], node.params["columns"]
+            if source in wanted and (wanted[source] is None or columns is None):
+                wanted[source] = None
+            else:
+                wanted[source] = sorted(set(wanted.get(source) or ()) | set(columns or ()))
+    shared = dict((source, scan(source, columns)) for source, columns in wanted.items())
+
+    def rule(node, original, memo):
+        if node.op != "scan":
+            return node
+        merged = shared[node.params["source"]]
+        if node.params["columns"] is not None and merged.params["columns"] != node.params["columns"]:
+            report["scans"] += 1
+            return project(merged, node.params["columns"])
+        return merged
+    return _rewrite(root, rule)
+
+
+def _merge_projections(root, report):
+    def rule(node, original, memo):
+        if node.op == "project" and node.inputs[0].op == "project":
+            report["projections"] += 1
+            return project(node.inputs[0].inputs[0], node.params["columns"])
+        return node
+    return _rewrite(root, rule)
+
+
+def _narrow_fills(root, report):
+    nullable = {}
+    columns = {}
+
+    def rule(node, original, memo):
+        if node.op != "fill_nulls":
+            return node
+        # category columns only come from scans, whose columns always count
+        # as nullable, so narrowing never skips a conversion to codes
+        may_be_null = nullable_of(node.inputs[0], nullable, columns)
+        if may_be_null is None:
+            return node
+        wanted = may_be_null if node.params["columns"] is None else may_be_null & set(node.params["columns"])
+        if not wanted:
+            report["fills"] += 1
+            return node.inputs[0]
+        if node.params["columns"] is None or set(node.params["columns"]) != wanted:
+            report["fills"] += 1
+            return fill_nulls(node.inputs[0], sorted(wanted))
+        return node
+    return _rewrite(root, rule)
+
+
+FILL_CAST = ("fill", "fill_nulls", "cast", "fill_cast")
+
+
+def _steps(node):
+    if node.op == "fill":
+        return [("fill", column, value) for column, value in node.params["values"]]
+    if node.op == "cast":
+        return [("cast", column, dtype) for column, dtype in node.params["dtypes"]]
+    if node.op == "fill_nulls":
+        return [("fill_nulls", node.params["columns"])]
+    return list(node.params["steps"])
+
+
+def _touches(step, column):
+    if step[0] == "fill_nulls":
+        return step[1] is None or column in step[1]
+    return step[1] == column
+
+
+def _overrides(later, earlier):
+    """ Whether a cast to `later` gives the same values with or without a cast to `earlier` before it
+
+    Only when the later cast keeps no more than the earlier one did: the
+    same dtype, or an integer no wider than the earlier integer, since
+    narrowing twice keeps the same low bits as narrowing once. Anything
+    else (float to int32 to float64, int8 to int64) depends on the earlier cast.
+    """
+    import numpy as np
+    later, earlier = np.dtype(later), np.dtype(earlier)
+    if later == earlier:
+        return True
+    return later.kind in "iu" and earlier.kind in "iu" and later.itemsize <= earlier.itemsize
+
+
+def _drop_overridden_casts(steps):
+    kept = []
+    for i, step in enumerate(steps):
+        if step[0] == "cast":
+            following = [later for later in steps[i + 1:] if _touches(later, step[1])]
+            if following and following[0][0] == "cast" and _overrides(following[0][2], step[2]):
+                continue
+        kept.append(step)
+    return kept
+
+
+def _fuse_fill_cast(root, report):
+    consumers = consumer_counts(root)
+    memo = {}
+    for node in _postorder(root):
+        if node.op in FILL_CAST:
+            steps = _steps(node)
+            child = node.inputs[0]
+            chain = 1
+            while child.op in FILL_CAST and consumers[id(child)] == 1:
+                steps = _steps(child) + steps
+                child = child.inputs[0]
+                chain += 1
+            if chain > 1:
+                report["fused"] += chain - 1
+                memo[id(node)] = Node("fill_cast", [memo[id(child)]], steps=tuple(_drop_overridden_casts(steps)))
+                continue
+        memo[id(node)] = node.with_inputs([memo[id(child)] for child in node.inputs]) if node.inputs else node
+    return memo[id(root)]
+
+
+def _reorder_joins(root, report, source_rows):
+    consumers = consumer_counts(root)
+    columns = {}
+    rows = {}
+
+    def rule(node, original, memo):
+        if node.op != "join" or node.params["how"] != "left":
+            return node
+        # the chain is read off the original graph, where consumer counts are known
+        rights = [(original.inputs[1], original.params["on"])]
+        base = original.inputs[0]
+        while base.op == "join" and base.params["how"] == "left" and consumers[id(base)] == 1:
+            rights.insert(0, (base.inputs[1], base.params["on"]))
+            base = base.inputs[0]
+        if len(rights) < 2:
+            return node
+        base_columns = columns_of(base, columns)
+        for right, on in rights:
+            # every key must come from the base, or the order is not free
+            if base_columns is None or not set(on) <= base_columns:
+                return node
+        ordered = sorted(rights, key=lambda right_on: estimate_rows(right_on[0], source_rows, rows))
+        if [id(r) for r, _ in ordered] == [id(r) for r, _ in rights]:
+            return node
+        report["joins"] += 1
+        rebuilt = memo[id(base)]
+        for right, on in ordered:
+            rebuilt = join(rebuilt, memo[id(right)], on)
+        return rebuilt
+    return _rewrite(root, rule)
+
+
+def optimize(root, source_rows=None):
+    """ Applies every rewrite until the plan stops changing
+
+    Parameters
+    ----------
+    source_rows : dict
+        estimated rows of each scanned source, for join ordering
+
+    Returns
+    -------
+    (optimized root, dict of rewrite counts)
+    """
+    report = OrderedDict((name, 0) for name in ("merged", "scans", "projections", "fills", "fused", "joins"))
+    root = _merge_scans(root, report)
+    root = _cse(root, report)
+    for _ in range(4):
+        before = root.key()
+        root = _merge_projections(root, report)
+        root = _narrow_fills(root, report)
+        root = _reorder_joins(root, report, source_rows)
+        root = _cse(root, report)
+        if root.key() == before:
+            break
+    root = _fuse_fill_cast(root, report)
+    return root, report
+
+
+def explain(root, report=None, source_rows=None):
+    """ Renders the plan as an indented tree; shared nodes are expanded once """
+    consumers = consumer_counts(root)
+    rows = {}
+    ids = {}
+    lines = []
+
+    def describe(node):
+        params = []
+        for name, value in sorted(node.params.items()):
+            if name == "expr":
+                value = _format_expr(value)
+            elif name in ("selectivity", "reduction"):
+                continue
+            params.append("%s=%s" % (name, value))
+        return "%s %s" % (node.op, " ".join(params))
+
+    def visit(node, depth):
+        if id(node) in ids:
+            lines.append("%s#%d (shared, see above)" % ("  " * depth, ids[id(node)]))
+            return
+        ids[id(node)] = len(ids) + 1
+        shared = " [used %dx]" % consumers[id(node)] if consumers[id(node)] > 1 else ""
+        lines.append("%s#%d %s (~%d rows)%s" % ("  " * depth, ids[id(node)], describe(node),
+                                                estimate_rows(node, source_rows, rows), shared))
+        for child in node.inputs:
+            visit(child, depth + 1)
+
+    visit(root, 0)
+    if report:
+        lines.append("rewrites: " + ", ".join("%s %d" % item for item in report.items()))
+    return "\n".join(lines)
+
+
+# execution
+
+def execute(root, sources, engine=None):
+    """ Runs the plan; the frames in `sources` may be updated in place
+
+    Each node runs once, however many consumers it has. A consumer may
+    modify its input in place only when it is that input's last consumer;
+    otherwise the engine works on a copy. Intermediates are released as
+    soon as their last consumer has run.
+    """
+    engine = engine or CudfEngine()
+    remaining = consumer_counts(root)
+    results = {}
+    for node in _postorder(root):
+        args = [results[id(child)] for child in node.inputs]
+        owned = all(remaining[id(child)] == 1 for child in node.inputs)
+        results[id(node)] = engine.run(node, args, sources, owned)
+        for child in node.inputs:
+            remaining[id(child)] -= 1
+            if remaining[id(child)] == 0:
+                del results[id(child)]
+        del args
+    return results[id(root)]
+
+
+class CudfEngine(object):
+    """ Runs plan operators on GPU DataFrames with the cudf API E2E.py uses """
+
+    def run(self, node, args, sources, owned):
+        return getattr(self, node.op)(node.params, args, sources, owned)
+
+    def _writable(self, df, owned):
+        return df if owned else df.copy()
+
+    def scan(self, params, args, sources, owned):
+        df = sources[params["source"]]
+        return df[list(params["columns"])] if params["columns"] else df
+
+    def project(self, params, args, sources, owned):
+        return args[0][list(params["columns"])]
+
+    def filter(self, params, args, sources, owned):
+        return args[0].query("%s %s %r" % (params["column"], params["comparison"], params["value"]))
+
+    def groupby_agg(self, params, args, sources, owned):
+        by = list(params["by"])
+        aggs = OrderedDict((column, function) for column, function, _ in params["aggs"])
+        df = args[0][by + list(aggs)]
+        grouped = df.groupby(by if len(by) > 1 else by[0], method='hash').agg(aggs)
+        for column, function, name in params["aggs"]:
+            grouped[name] = grouped["%s_%s" % (function, column)]
+            grouped.drop_column("%s_%s" % (function, column))
+        return grouped
+
+    def join(self, params, args, sources, owned):
+        return args[0].merge(args[1], how=params["how"], on=list(params["on"]), type='hash')
+
+    def assign(self, params, args, sources, owned):
+        df = self._writable(args[0], owned)
+        df[params["name"]] = self.evaluate(df, params["expr"])
+        return df
+
+    def drop(self, params, args, sources, owned):
+        df = self._writable(args[0], owned)
+        for column in params["columns"]:
+            df.drop_column(column)
+        return df
+
+    def fill(self, params, args, sources, owned):
+        return self.fill_cast({"steps": [("fill", c, v) for c, v in params["values"]]}, args, sources, owned)
+
+    def cast(self, params, args, sources, owned):
+        return self.fill_cast({"steps": [("cast", c, d) for c, d in params["dtypes"]]}, args, sources, owned)
+
+    def fill_nulls(self, params, args, sources, owned):
+        return self.fill_cast({"steps": [("fill_nulls", params["columns"])]}, args, sources, owned)
+
+    def fill_cast(self, params, args, sources, owned):
+        df = self._writable(args[0], owned)
+        per_column = OrderedDict()
+        for step in params["steps"]:
+            if step[0] == "fill_nulls":
+                for column in (step[1] or df.columns):
+                    per_column.setdefault(column, []).append(step)
+            else:
+                per_column.setdefault(step[1], []).append(step)
+        # every column is read once, run through its steps and written back once
+        for column, steps in per_column.items():
+            series = df[column]
+            for step in steps:
+                if step[0] == "fill":
+                    series = series.fillna(self.value(step[2]))
+                elif step[0] == "cast":
+                    series = series.astype(step[2])
+                else:
+                    series = self.null_workaround(series)
+            df[column] = series
+        return df
+
+    def concat(self, params, args, sources, owned):
+        import cudf
+        return cudf.concat(args)
+
+    def null_workaround(self, series):
+        dtype = str(series.dtype)
+        if dtype == "category":
+            return series.astype('int32').fillna(-1)
+        if dtype in ['int8', 'int16', 'int32', 'int64', 'float32', 'float64']:
+            return series.fillna(-1)
+        return series
+
+    def value(self, value):
+        if isinstance(value, tuple):
+            import numpy as np
+            return np.dtype(value[0]).type(value[1]).astype(value[0])
+        return value
+
+    def evaluate(self, df, expr):
+        kind = expr[0]
+        if kind == "col":
+            return df[expr[1]]
+        if kind == "lit":
+            if expr[2] is None:
+                return expr[1]
+            import numpy as np
+            return np.dtype(expr[2]).type(expr[1])
+        if kind in BINARY:
+            return BINARY[kind](self.evaluate(df, expr[1]), self.evaluate(df, expr[2]))
+        arg = self.evaluate(df, expr[1])
+        if kind == "floor":
+            return arg.floor()
+        if kind == "month":
+            return arg.dt.month
+        if kind == "year":
+            return arg.dt.year
+        if kind == "astype":
+            return arg.astype(expr[2])
+        raise ValueError("unknown expression %r" % (kind,))
+
+
+# the mortgage workflow
+
+PER_LOAN = 1.0 / 60
+
+
+def mortgage_plan():
+    """ `create_ever_features` through `join_perf_acq_gdfs` as one plan
+
+    Sources are "perf" (the loaded, encoded performance frame) and "acq"
+    (the acquisition frame with renamed sellers). The result matches
+    `join_perf_acq_gdfs`, though the optimizer may order its columns
+    differently.
+    """
+    status, period = "current_loan_delinquency_status", "monthly_reporting_period"
+    perf = scan("perf")
+    acq = scan("acq")
+
+    # create_ever_features
+    ever = groupby_agg(project(perf, ["loan_id", status]), ["loan_id"], [(status, "max", "max_status")],
+                       reduction=PER_LOAN)
+    for months, name in ((1, "ever_30"), (3, "ever_90"), (6, "ever_180")):
+        ever = assign(ever, name, call("astype", binary(">=", col("max_status"), lit(months)), "int8"))
+    ever = drop(ever, ["max_status"])
+
+    # create_delinq_features; both fills of the original come after both joins
+    history = project(perf, ["loan_id", period, status])
+    first = []
+    for months, name, selectivity in ((1, "delinquency_30", 0.1), (3, "delinquency_90", 0.05),
+                                      (6, "delinquency_180", 0.03)):
+        late = project(filter_rows(history, status, ">=", months, selectivity=selectivity), ["loan_id", period])
+        first.append(groupby_agg(late, ["loan_id"], [(period, "min", name)], reduction=PER_LOAN))
+    delinq = join(join(first[0], first[1], ["loan_id"]), first[2], ["loan_id"])
+    delinq = fill(delinq, [("delinquency_90", epoch()), ("delinquency_180", epoch())])
+
+    # join_ever_delinq_features
+    ever = join(ever, delinq, ["loan_id"])
+    ever = fill(ever, [(name, epoch()) for name in ("delinquency_30", "delinquency_90", "delinquency_180")])
+
+    # create_joined_df
+    test = project(perf, ["loan_id", period, status, "current_actual_upb"])
+    test = assign(test, "timestamp", col(period))
+    test = assign(test, "timestamp_month", call("month", col("timestamp")))
+    test = assign(test, "timestamp_year", call("year", col("timestamp")))
+    test = assign(test, "delinquency_12", col(status))
+    test = assign(test, "upb_12", col("current_actual_upb"))
+    test = drop(test, [period, status, "current_actual_upb"])
+    test = fill(test, [("upb_12", 999999999), ("delinquency_12", -1)])
+    joined = join(test, ever, ["loan_id"])
+    joined = fill(joined, [(name, -1) for name in ("ever_30", "ever_90", "ever_180", "delinquency_30",
+                                                   "delinquency_90", "delinquency_180")])
+    joined = cast(joined, [("timestamp_year", "int32"), ("timestamp_month", "int32")])
+
+    # create_12_mon_features
+    windows = []
+    for y in range(1, 13):
+        # the same in every pass, as in the original; the optimizer computes it once
+        months = assign(project(joined, ["loan_id", "timestamp_year", "timestamp_month", "delinquency_12", "upb_12"]),
+                        "josh_months", binary("+", binary("*", col("timestamp_year"), lit(12)), col("timestamp_month")))
+        window = assign(months, "josh_mody_n", call("floor", binary("/", binary(
+            "-", binary("-", call("astype", col("josh_months"), "float64"), lit(24000)), lit(y)), lit(12))))
+        window = groupby_agg(window, ["loan_id", "josh_mody_n"], [("delinquency_12", "max", "max_delinquency_12"),
+                                                                   ("upb_12", "min", "min_upb_12")], reduction=1.0 / 12)
+        window = assign(window, "delinquency_12", binary(
+            "+", call("astype", binary(">", col("max_delinquency_12"), lit(3)), "int32"),
+            call("astype", binary("==", col("min_upb_12"), lit(0)), "int32")))
+        window = assign(window, "upb_12", col("min_upb_12"))
+        window = assign(window, "timestamp_year", call("astype", call("floor", binary("/", binary(
+            "+", binary("+", binary("*", col("josh_mody_n"), lit(12)), lit(24000)), lit(y - 1)), lit(12))), "int16"))
+        window = assign(window, "timestamp_month", lit(y, "int8"))
+        windows.append(drop(window, ["max_delinquency_12", "min_upb_12", "josh_mody_n"]))
+    testdf = concat(windows)
+
+    # combine_joined_12_mon
+    joined = cast(joined, [("timestamp_year", "int16"), ("timestamp_month", "int8")])
+    joined = drop(joined, ["delinquency_12", "upb_12"])
+    joined = join(joined, testdf, ["loan_id", "timestamp_year", "timestamp_month"])
+
+    # final_performance_delinquency
+    merged = fill_nulls(perf)
+    merged = assign(merged, "timestamp_month", call("astype", call("month", col(period)), "int8"))
+    merged = assign(merged, "timestamp_year", call("astype", call("year", col(period)), "int16"))
+    merged = join(merged, fill_nulls(joined), ["loan_id", "timestamp_year", "timestamp_month"])
+    merged = drop(merged, ["timestamp_year", "timestamp_month"])
+
+    # join_perf_acq_gdfs
+    return join(fill_nulls(merged), fill_nulls(acq), ["loan_id"])
+
+
+if __name__ == '__main__':
+    source_rows = {"perf": 2.5e7, "acq": 4e5}
+    plan, report = optimize(mortgage_plan(), source_rows)
+    print(explain(plan, report, source_rows))
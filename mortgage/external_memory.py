@@ -0,0 +1,204 @@
+"""Out-of-core training input streamed from the ETL result cache.
+
+The conversion phase concatenates every partition a worker holds before
+building its DMatrix, so `part_count` is capped by host memory. Here a
+worker instead streams its cached partitions one batch of rows at a time
+into XGBoost's external memory: through `xgboost.DataIter` where the
+installed XGBoost has it, otherwise into a libsvm file that XGBoost pages
+through with a `#cache` prefix. Either way only one batch is resident at
+once, plus the pages XGBoost keeps in its cache files.
+
+Run `python external_memory.py [PARTITIONS] [ROWS]` to compare training
+time and peak memory against the in-memory path on synthetic partitions.
+"""
+import os
+import time
+
+import numpy as np
+
+
+LABEL = "delinquency_12"
+
+
+def _training_part(result):
+    # with a validation split the cached result is (training, validation)
+    if isinstance(result, tuple) and len(result) == 2 and not isinstance(result[0], np.ndarray):
+        return result[0]
+    return result
+
+
+def iter_batches(cache, keys, batch_rows=1 << 20):
+    """ Yields `(features, labels)` float32 batches of the cached partitions
+
+    Arrow entries are memory mapped and sliced, so a batch is the only
+    copy made; pickled "matrix" entries are loaded one partition at a
+    time. Arrow feature columns are ordered like the in-memory conversion
+    (sorted, label excluded).
+
+    Parameters
+    ----------
+    cache : ResultCache
+    keys : list of str
+        cache keys of the partitions, in training order
+    batch_rows : int
+        rows per yielded batch
+    """
+    for key in keys:
+        part = _training_part(cache.load(key))
+        if isinstance(part, tuple):
+            features, labels = part[:2]
+            for begin in range(0, len(labels), batch_rows):
+                yield features[begin:begin + batch_rows], labels[begin:begin + batch_rows]
+            continue
+        columns = sorted(name for name in part.column_names if name != LABEL)
+        for begin in range(0, part.num_rows, batch_rows):
+            batch = part.slice(begin, batch_rows)
+            features = np.empty((batch.num_rows, len(columns)), dtype=np.float32)
+            for i, name in enumerate(columns):
+                features[:, i] = batch.column(name).to_pandas().values
+            labels = batch.column(LABEL).to_pandas().values.astype(np.float32)
+            yield features, labels
+
+
+def write_libsvm(batches, path):
+    """ Streams batches into a libsvm file, returning the number of rows
+
+    Every value is written, zeros included: XGBoost treats entries absent
+    from a sparse row as missing, not as 0. Nine significant digits
+    round-trip float32, so the file holds the same values as the batches.
+    """
+    rows = 0
+    with open(path, "w") as f:
+        for features, labels in batches:
+            if not len(labels):
+                continue
+            row_format = "%.9g " + " ".join("%d:%%.9g" % i for i in range(features.shape[1])) + "\n"
+            f.writelines(row_format % tuple(row) for row in np.column_stack([labels, features]).tolist())
+            rows += len(labels)
+    return rows
+
+
+def external_dmatrix(cache, keys, cache_dir, batch_rows=1 << 20, prefix="train"):
+    """ Builds an external memory DMatrix over cached partitions
+
+    Parameters
+    ----------
+    cache_dir : str
+        local scratch directory for XGBoost's page cache (and the libsvm
+        file when `xgboost.DataIter` is unavailable)
+
+    Returns
+    -------
+    xgboost.DMatrix
+    """
+    import xgboost as xgb
+
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_prefix = os.path.join(cache_dir, "%s-%d" % (prefix, os.getpid()))
+    if hasattr(xgb, "DataIter"):
+        return xgb.DMatrix(_partition_iter(xgb, cache, keys, batch_rows, cache_prefix), missing=np.nan)
+    path = cache_prefix + ".libsvm"
+    write_libsvm(iter_batches(cache, keys, batch_rows), path)
+    return xgb.DMatrix("%s#%s.cache" % (path, cache_prefix))
+
+
+def _partition_iter(xgb, cache, keys, batch_rows, cache_prefix):
+    class PartitionIter(xgb.DataIter):
+        def __init__(self):
+            self._batches = None
+            super(PartitionIter, self).__init__(cache_prefix=cache_prefix)
+
+        def next(self, input_data):
+            if self._batches is None:
+                self._batches = iter_batches(cache, keys, batch_rows)
+            try:
+                features, labels = next(self._batches)
+            except StopIteration:
+                return 0
+            input_data(data=features, label=labels)
+            return 1
+
+        def reset(self):
+            self._batches = None
+
+    return PartitionIter()
+
+
+def worker_dmatrix(cache, keys, cache_dir, batch_rows=1 << 20):
+    """ Per-worker entry point: the external memory DMatrix of this worker's partitions """
+    return external_dmatrix(cache, keys, cache_dir, batch_rows=batch_rows, prefix="worker")
+
+
+def _synthetic_partitions(cache, count, rows, features=27, seed=0):
+    import pyarrow as pa
+
+    rng = np.random.RandomState(seed)
+    keys = []
+    for i in range(count):
+        data = dict(("f%02d" % j, rng.standard_normal(rows).astype(np.float32)) for j in range(features))
+        data[LABEL] = (rng.uniform(size=rows) < 0.05).astype(np.int32)
+        key = "synthetic-%d-%d" % (rows, i)
+        cache.store(key, pa.Table.from_pydict(data))
+        keys.append(key)
+    return keys
+
+
+def _peak_rss():
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _timed_training(build, params, rounds):
+    import xgboost as xgb
+
+    start = time.time()
+    dtrain = build()
+    built = time.time()
+    xgb.train(params, dtrain, num_boost_round=rounds)
+    return built - start, time.time() - built, dtrain.num_row()
+
+
+def _benchmark_child(mode, directory, keys, rounds, batch_rows, queue):
+    from result_cache import ResultCache
+    import xgboost as xgb
+
+    cache = ResultCache(directory, max_bytes=1 << 40)
+    params = {"tree_method": "hist", "max_depth": 8, "eta": 0.1, "objective": "reg:linear"}
+    if mode == "memory":
+        def build():
+            batches = list(iter_batches(cache, keys))
+            return xgb.DMatrix(np.concatenate([b[0] for b in batches]),
+                               label=np.concatenate([b[1] for b in batches]))
+    else:
+        def build():
+            return external_dmatrix(cache, keys, os.path.join(directory, "xgb-cache"), batch_rows=batch_rows)
+    baseline = _peak_rss()
+    build_seconds, train_seconds, nrows = _timed_training(build, params, rounds)
+    queue.put((build_seconds, train_seconds, nrows, _peak_rss() - baseline))
+
+
+if __name__ == '__main__':
+    import multiprocessing
+    import shutil
+    import sys
+    import tempfile
+    from result_cache import ResultCache
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 250000
+    rounds = 20
+    directory = tempfile.mkdtemp(prefix="external-memory-")
+    try:
+        keys = _synthetic_partitions(ResultCache(directory, max_bytes=1 << 40), count, rows)
+        for mode in ("memory", "external"):
+            # a fresh process per mode, so that neither inherits the other's peak RSS
+            queue = multiprocessing.Queue()
+            child = multiprocessing.Process(target=_benchmark_child,
+                                            args=(mode, directory, keys, rounds, rows // 4, queue))
+            child.start()
+            build_seconds, train_seconds, nrows, peak = queue.get()
+            child.join()
+            print("%-8s %d rows: build %6.2fs, train %6.2fs (%10.0f rows*rounds/s), peak RSS growth %6.2f GB"
+                  % (mode, nrows, build_seconds, train_seconds, nrows * rounds / train_seconds, peak / 1e9))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,134 @@
+"""Feature-usage profile of the trained model and input pruning driven by it.
+
+`last_mile_cleaning` hands every surviving column to XGBoost, whether or
+not the trees ever split on it, and the loaders parse a few more columns
+that are dropped unseen. After training, `feature_usage` reads the split
+count and total gain of every feature off the booster and `save_profile`
+stores them with the run's ETL time and validation score. A later run
+with pruning enabled loads the profile, and `pruned_columns` names the
+input columns the loaders can skip: those below a share of the total
+gain and those the ETL drops anyway. Columns the ETL itself needs (join
+keys, the inputs of the delinquency features) are never pruned.
+
+Run `python feature_usage.py PROFILE [MIN_GAIN_SHARE]` to inspect a profile.
+"""
+import json
+import os
+import time
+from collections import OrderedDict
+
+
+LABEL = "delinquency_12"
+
+# keys and inputs of the derived features; the ETL cannot run without them
+REQUIRED_INPUTS = frozenset([
+    "loan_id", "monthly_reporting_period", "current_loan_delinquency_status", "current_actual_upb",
+    "seller_name",
+])
+
+# parsed by the loaders but dropped by last_mile_cleaning before training
+UNUSED_INPUTS = frozenset([
+    "orig_date", "first_pay_date", "maturity_date", "last_paid_installment_date",
+    "zero_balance_effective_date", "foreclosed_after", "disposition_date",
+])
+
+
+def result_feature_names(result, label=LABEL):
+    """ Training feature order of one ETL result; meant to run on a worker
+
+    Arrow tables train on their sorted columns, "matrix" results carry
+    their column names as a third element.
+    """
+    if isinstance(result, tuple):
+        if len(result) == 3:
+            return list(result[2])
+        # (training, validation)
+        return result_feature_names(result[0], label)
+    return sorted(name for name in result.schema.names if name != label)
+
+
+def feature_usage(booster, feature_names=None):
+    """ Split count and total gain of every feature
+
+    Parameters
+    ----------
+    booster : xgboost.Booster
+    feature_names : list of str
+        training feature order, to name the features of a booster trained
+        on unnamed data (f0, f1, ...)
+
+    Returns
+    -------
+    OrderedDict of feature -> {"splits": int, "gain": float}
+    """
+    weight = booster.get_score(importance_type="weight")
+    # "gain" is the average gain per split, which older XGBoost also has
+    gain = booster.get_score(importance_type="gain")
+    rename = {}
+    if feature_names is not None:
+        rename = dict(("f%d" % i, name) for i, name in enumerate(feature_names))
+    names = feature_names or booster.feature_names or sorted(weight)
+    usage = OrderedDict((name, {"splits": 0, "gain": 0.0}) for name in names)
+    for key, splits in weight.items():
+        usage[rename.get(key, key)] = {"splits": int(splits), "gain": gain.get(key, 0.0) * splits}
+    return usage
+
+
+def gain_shares(usage):
+    total = sum(values["gain"] for values in usage.values())
+    return OrderedDict((name, values["gain"] / total if total else 0.0) for name, values in usage.items())
+
+
+def save_profile(path, usage, etl_seconds=None, validation_score=None):
+    profile = {
+        "created": time.time(),
+        "features": usage,
+        "etl_seconds": etl_seconds,
+        "validation_score": validation_score,
+    }
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(profile, f, indent=1)
+    os.rename(tmp, path)
+    return profile
+
+
+def load_profile(path):
+    with open(path, "r") as f:
+        return json.load(f, object_pairs_hook=OrderedDict)
+
+
+def pruned_columns(profile, min_gain_share=0.001):
+    """ Input columns the loaders may skip under `profile`
+
+    Returns
+    -------
+    sorted list of str
+    """
+    shares = gain_shares(profile["features"])
+    unused = set(name for name, share in shares.items() if share < min_gain_share)
+    return sorted((unused | UNUSED_INPUTS) - REQUIRED_INPUTS)
+
+
+def pruning_report(profile, etl_seconds, validation_score=None):
+    """ ETL speedup and validation delta of a pruned run against the profiled one """
+    lines = []
+    if profile.get("etl_seconds") and etl_seconds:
+        lines.append("ETL %.1fs pruned vs %.1fs unpruned (%.2fx)"
+                     % (etl_seconds, profile["etl_seconds"], profile["etl_seconds"] / etl_seconds))
+    if profile.get("validation_score") is not None and validation_score is not None:
+        lines.append("validation RMSE %.6f pruned vs %.6f unpruned (%+.6f)"
+                     % (validation_score, profile["validation_score"],
+                        validation_score - profile["validation_score"]))
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    import sys
+
+    profile = load_profile(sys.argv[1])
+    min_gain_share = float(sys.argv[2]) if len(sys.argv) > 2 else 0.001
+    shares = gain_shares(profile["features"])
+    for name in sorted(shares, key=lambda name: -shares[name]):
+        print("%-40s %8d splits %7.3f%% gain" % (name, profile["features"][name]["splits"], 100 * shares[name]))
+    print("pruned at %.3f%%: %s" % (100 * min_gain_share, ", ".join(pruned_columns(profile, min_gain_share))))
@@ -0,0 +1,200 @@
+"""Predicate pushdown for models of a subset of the loans.
+
+A model of, say, a few states or origination years used to need the
+full ETL with the rows filtered out afterwards. `filters` is a list of
+`(column, op, value)` predicates, ANDed, pushed as far down as they go:
+
+- `year` and `quarter` name the acquisition quarter of a file; they are
+  decided per file, so files that cannot match are never read,
+- any other column is an acquisition column; the predicates drop
+  acquisition rows right after parsing, and the loan_ids that survive
+  drop the performance rows of every other loan before any feature is
+  computed.
+
+Each worker counts the rows it parsed and dropped; the driver adds the
+bytes of the files it never read.
+
+    filters = [('property_state', 'in', ['CA', 'NY']), ('orig_date', '>=', '2001-01-01'), ('year', '<=', 2001)]
+
+Run `python filters.py` to see the predicates applied to a small frame.
+"""
+import operator
+import threading
+from collections import OrderedDict
+
+
+FILE_COLUMNS = ("year", "quarter")
+
+OPERATORS = OrderedDict([
+    ("==", operator.eq),
+    ("!=", operator.ne),
+    ("<", operator.lt),
+    ("<=", operator.le),
+    (">", operator.gt),
+    (">=", operator.ge),
+    ("in", None),
+    ("not in", None),
+])
+
+
+def normalize(filters):
+    """ Checks the predicates and returns them as a list of tuples
+
+    Raises
+    ------
+    ValueError
+        on a malformed predicate or an unknown operator
+    """
+    normalized = []
+    for predicate in filters or ():
+        if len(predicate) != 3:
+            raise ValueError("filters are (column, op, value) tuples, got %r" % (predicate,))
+        column, op, value = predicate
+        if op not in OPERATORS:
+            raise ValueError("unknown filter operator %r, expected one of %s" % (op, ", ".join(OPERATORS)))
+        if op in ("in", "not in"):
+            value = list(value)
+        normalized.append((column, op, value))
+    return normalized
+
+
+def split_filters(filters):
+    """ (file predicates on year/quarter, row predicates on acquisition columns) """
+    filters = normalize(filters)
+    return ([f for f in filters if f[0] in FILE_COLUMNS],
+            [f for f in filters if f[0] not in FILE_COLUMNS])
+
+
+def filter_columns(filters):
+    """ Input columns the row predicates read, which must not be pruned """
+    return set(column for column, _, _ in normalize(filters) if column not in FILE_COLUMNS)
+
+
+def _compare(values, op, value):
+    if op == "in":
+        mask = None
+        for item in value:
+            mask = values == item if mask is None else mask | (values == item)
+        return mask
+    if op == "not in":
+        mask = None
+        for item in value:
+            mask = values != item if mask is None else mask & (values != item)
+        return mask
+    return OPERATORS[op](values, value)
+
+
+def file_matches(filters, year, quarter):
+    """ Whether a file of this acquisition quarter can hold matching loans """
+    keys = {"year": year, "quarter": quarter}
+    for column, op, value in normalize(filters):
+        if column in keys and not _compare(keys[column], op, value):
+            return False
+    return True
+
+
+def _coerce(series, value):
+    # dates are given as strings; compare them as the column's datetime64 unit
+    if "datetime" in str(series.dtype) and isinstance(value, str):
+        import numpy as np
+        return np.datetime64(value, "ms")
+    return value
+
+
+def row_mask(df, filters):
+    """ Boolean Series of the rows of `df` matching every row predicate, None if there are none
+
+    Works on cudf and pandas frames alike: it only compares Series with
+    scalars and combines the results with & and |.
+    """
+    mask = None
+    for column, op, value in normalize(filters):
+        if column in FILE_COLUMNS:
+            continue
+        if column not in df.columns:
+            raise ValueError("filter column %r is not an acquisition column" % column)
+        series = df[column]
+        if op in ("in", "not in"):
+            value = [_coerce(series, item) for item in value]
+        else:
+            value = _coerce(series, value)
+        matches = _compare(series, op, value)
+        if matches is None:
+            # "in" an empty list matches nothing, "not in" one matches everything
+            matches = series != series if op == "in" else series == series
+        mask = matches if mask is None else mask & matches
+    return mask
+
+
+def apply_filters(df, filters):
+    """ The rows of `df` matching every row predicate """
+    mask = row_mask(df, filters)
+    return df if mask is None else df[mask]
+
+
+class PushdownStats(object):
+    """ Rows parsed and dropped by the predicates on one worker """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = OrderedDict((name, 0) for name in ("acquisition_rows", "acquisition_skipped",
+                                                         "performance_rows", "performance_skipped",
+                                                         "performance_bytes", "performance_bytes_skipped"))
+
+    def record(self, kind, rows, kept, nbytes=0):
+        """ Counts `rows` parsed rows of `kind` of which `kept` survived
+
+        The bytes skipped of a file are estimated from the share of its
+        rows dropped.
+        """
+        with self._lock:
+            self.counts[kind + "_rows"] += rows
+            self.counts[kind + "_skipped"] += rows - kept
+            if nbytes:
+                self.counts[kind + "_bytes"] += nbytes
+                self.counts[kind + "_bytes_skipped"] += int(nbytes * (rows - kept) / float(rows or 1))
+
+    def stats(self):
+        with self._lock:
+            return OrderedDict(self.counts)
+
+
+_stats = PushdownStats()
+
+
+def record_pushdown(kind, rows, kept, nbytes=0):
+    _stats.record(kind, rows, kept, nbytes)
+
+
+def pushdown_stats():
+    """ `client.run` entry point: this worker's pushdown counters """
+    return _stats.stats()
+
+
+def pushdown_report(worker_stats, files_skipped=0, bytes_skipped=0):
+    """ One line summing the workers' counters and the files pruned by the driver """
+    totals = OrderedDict()
+    for stats in worker_stats:
+        for name, count in stats.items():
+            totals[name] = totals.get(name, 0) + count
+    return ("filters skipped %d files (%.2f GB) unread, %d of %d acquisition rows, "
+            "%d of %d performance rows (~%.2f GB of parsed input)"
+            % (files_skipped, bytes_skipped / 1e9,
+               totals.get("acquisition_skipped", 0), totals.get("acquisition_rows", 0),
+               totals.get("performance_skipped", 0), totals.get("performance_rows", 0),
+               totals.get("performance_bytes_skipped", 0) / 1e9))
+
+
+if __name__ == '__main__':
+    import pandas as pd
+
+    acq = pd.DataFrame({
+        "loan_id": [1, 2, 3, 4],
+        "property_state": ["CA", "NY", "TX", "CA"],
+        "loan_purpose": ["P", "R", "P", "C"],
+        "orig_date": pd.to_datetime(["2000-12-01", "2001-02-01", "2001-03-01", "2001-06-01"]),
+    })
+    filters = [("property_state", "in", ["CA", "NY"]), ("orig_date", ">=", "2001-01-01"), ("year", "<=", 2001)]
+    print(filters)
+    print("reads 2001Q1: %s, 2002Q1: %s" % (file_matches(filters, 2001, 1), file_matches(filters, 2002, 1)))
+    print(apply_filters(acq, filters))
@@ -0,0 +1,285 @@
+"""Byte-offset index for looking up single loans in the raw input files.
+
+Looking into one loan meant grepping gigabytes of pipe-delimited
+performance files. The index records, for every run of consecutive lines
+of the same loan in a file, the loan_id, the file, the run's byte offset
+and its length. In the loan_id-sorted splits a loan is one run per split
+it appears in (two when a split boundary cuts its history); unsorted
+files still work, with more runs. Acquisition files get the same index,
+one run per loan.
+
+Files are scanned in parallel; a scan memory maps the file and finds the
+line starts and loan_ids with NumPy, without a Python loop over lines,
+one window of the file at a time.
+The runs of all files are stored as four sorted `.npy` arrays (loan_id,
+file number, offset, length: 24 bytes per run) that a lookup memory maps
+and binary searches, then reads each run with one slice of the memory
+mapped file. Lookups of many loans are grouped by file and read in offset
+order. The index records the size and mtime of every file and refuses to
+read a file that changed since: rebuild the index instead.
+
+Compressed inputs cannot be read at an offset; decompress them first.
+
+Run `python loan_index.py build INDEX_DIR PERF_DIR ACQ_DIR` to build an
+index and `python loan_index.py INDEX_DIR LOAN_ID...` to print loans (`-`
+reads loan_ids from stdin).
+"""
+import json
+import mmap
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from compression import compression_of
+
+
+ARRAYS = ("loan_id", "file", "offset", "length")
+MAX_ID_DIGITS = 19
+WINDOW_BYTES = 64 << 20
+
+
+def scan_runs(path, window_bytes=WINDOW_BYTES):
+    """ Runs of consecutive lines with the same loan_id in one file
+
+    Lines whose first field is not a number (headers, blank lines) are
+    left out. The file is scanned in windows of about `window_bytes`, so
+    the temporary arrays stay bounded whatever the file size.
+
+    Returns
+    -------
+    (loan_id int64 array, offset int64 array, length int64 array)
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return (np.empty(0, np.int64),) * 3
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        windows = []
+        begin = 0
+        while begin < size:
+            # windows end after a newline, so that no line is cut
+            end = buffer.find(b"\n", min(begin + window_bytes, size) - 1) + 1 or size
+            windows.append(_window_runs(data, begin, end))
+            begin = end
+        del data
+    finally:
+        buffer.close()
+    loan_ids, starts, lengths = [np.concatenate(arrays) for arrays in zip(*windows)]
+    if not len(loan_ids):
+        return loan_ids, starts, lengths
+    # a run cut by a window boundary is one run
+    ends = starts + lengths
+    joined = np.concatenate([[False], (loan_ids[1:] == loan_ids[:-1]) & (starts[1:] == ends[:-1])])
+    first = np.flatnonzero(~joined)
+    last = np.concatenate([first[1:] - 1, [len(loan_ids) - 1]])
+    return loan_ids[first], starts[first], ends[last] - starts[first]
+
+
+def _window_runs(data, begin, end):
+    """ Runs of the lines in data[begin:end], which starts a line and ends one """
+    ends = np.flatnonzero(data[begin:end] == ord("\n")) + (begin + 1)
+    if not len(ends) or ends[-1] != end:
+        ends = np.append(ends, end)
+    starts = np.concatenate([[begin], ends[:-1]])
+    # the first field is read up to its pipe, a digit at a time; a line without one is a
+    # whole-line field only when the file ends without a newline
+    loan_ids = np.zeros(len(starts), dtype=np.int64)
+    valid = np.zeros(len(starts), dtype=bool)
+    open_lines = np.arange(len(starts))
+    for digit in range(MAX_ID_DIGITS + 1):
+        position = starts[open_lines] + digit
+        at_end = position >= ends[open_lines]
+        values = np.full(len(open_lines), ord("|"), dtype=np.int64)
+        values[~at_end] = data[position[~at_end]]
+        closed = values == ord("|")
+        valid[open_lines[closed]] = digit > 0
+        values -= ord("0")
+        digits = (values >= 0) & (values <= 9)
+        loan_ids[open_lines[digits]] = loan_ids[open_lines[digits]] * 10 + values[digits]
+        # anything else (a newline included) ends the line as invalid
+        open_lines = open_lines[digits]
+        if not len(open_lines):
+            break
+    loan_ids, starts, ends = loan_ids[valid], starts[valid], ends[valid]
+    if not len(loan_ids):
+        return (np.empty(0, np.int64),) * 3
+    # a new run wherever the loan changes or an invalid line was skipped
+    breaks = np.flatnonzero((loan_ids[1:] != loan_ids[:-1]) | (starts[1:] != ends[:-1])) + 1
+    first = np.concatenate([[0], breaks])
+    last = np.concatenate([breaks - 1, [len(loan_ids) - 1]])
+    return loan_ids[first], starts[first], ends[last] - starts[first]
+
+
+class LoanIndex(object):
+    """ Sorted runs of a set of files, searched by loan_id """
+
+    def __init__(self, files, loan_id, file, offset, length):
+        # {"path", "bytes", "mtime"} of each file when it was scanned
+        self.files = list(files)
+        self.loan_id = loan_id
+        self.file = file
+        self.offset = offset
+        self.length = length
+        self._maps = {}
+
+    @classmethod
+    def build(cls, paths, max_workers=None):
+        """ Scans the files in parallel
+
+        Returns
+        -------
+        LoanIndex
+        """
+        paths = [os.path.abspath(path) for path in paths]
+        compressed = [path for path in paths if compression_of(path)]
+        if compressed:
+            raise ValueError("cannot index compressed inputs, decompress them first: %s" % ", ".join(compressed))
+        # stat before the scan: a file changing during it must not look indexed
+        files = []
+        for path in paths:
+            stat = os.stat(path)
+            files.append(OrderedDict([("path", path), ("bytes", stat.st_size), ("mtime", stat.st_mtime)]))
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            scans = list(pool.map(scan_runs, paths))
+        loan_id = np.concatenate([scan[0] for scan in scans] or [np.empty(0, np.int64)])
+        file = np.concatenate([np.full(len(scan[0]), i, dtype=np.int32) for i, scan in enumerate(scans)]
+                              or [np.empty(0, np.int32)])
+        offset = np.concatenate([scan[1] for scan in scans] or [np.empty(0, np.int64)])
+        length = np.concatenate([scan[2] for scan in scans] or [np.empty(0, np.int64)])
+        order = np.lexsort((offset, file, loan_id))
+        return cls(files, loan_id[order], file[order], offset[order], length[order].astype(np.int32))
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, name + ".npy"), getattr(self, name))
+        with open(os.path.join(directory, "files.json"), "w") as f:
+            json.dump(self.files, f, indent=1)
+
+    @classmethod
+    def load(cls, directory):
+        """ Memory maps a saved index; nothing is read until a lookup touches it """
+        with open(os.path.join(directory, "files.json"), "r") as f:
+            files = json.load(f, object_pairs_hook=OrderedDict)
+        # indexes saved before files carried their stats can only be refused
+        files = [OrderedDict([("path", entry), ("bytes", None), ("mtime", None)]) if isinstance(entry, str) else entry
+                 for entry in files]
+        arrays = [np.load(os.path.join(directory, name + ".npy"), mmap_mode="r") for name in ARRAYS]
+        return cls(files, *arrays)
+
+    def runs(self, loan_ids):
+        """ Indices of the runs of each loan
+
+        Returns
+        -------
+        list of int ranges, one per loan_id
+        """
+        loan_ids = np.asarray(loan_ids, dtype=np.int64)
+        low = np.searchsorted(self.loan_id, loan_ids, side="left")
+        high = np.searchsorted(self.loan_id, loan_ids, side="right")
+        return [range(a, b) for a, b in zip(low.tolist(), high.tolist())]
+
+    def _map(self, file):
+        if file not in self._maps:
+            entry = self.files[file]
+            with open(entry["path"], "rb") as f:
+                stat = os.fstat(f.fileno())
+                if stat.st_size != entry["bytes"] or stat.st_mtime != entry["mtime"]:
+                    raise ValueError("%s changed since it was indexed, rebuild the index" % entry["path"])
+                self._maps[file] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[file]
+
+    def lookup(self, loan_ids):
+        """ The lines of each loan, in file and then offset order
+
+        Reads are grouped by file and issued in offset order, so a batch
+        of thousands of loans walks every file once.
+
+        Returns
+        -------
+        OrderedDict of loan_id -> list of str
+        """
+        loan_ids = [int(loan_id) for loan_id in loan_ids]
+        runs = self.runs(loan_ids)
+        wanted = np.array([run for loan_runs in runs for run in loan_runs], dtype=np.int64)
+        text = {}
+        for run in wanted[np.lexsort((self.offset[wanted], self.file[wanted]))].tolist():
+            begin = int(self.offset[run])
+            text[run] = self._map(int(self.file[run]))[begin:begin + int(self.length[run])].decode()
+        lines = OrderedDict()
+        for loan_id, loan_runs in zip(loan_ids, runs):
+            lines[loan_id] = [line for run in loan_runs for line in text[run].splitlines()]
+        return lines
+
+    def close(self):
+        for buffer in self._maps.values():
+            buffer.close()
+        self._maps = {}
+
+
+class LoanLookup(object):
+    """ Acquisition record and performance history of loans, from an index directory
+
+    `build` writes the performance and acquisition indexes to
+    `directory/performance` and `directory/acquisition`.
+    """
+
+    def __init__(self, directory):
+        self.performance = LoanIndex.load(os.path.join(directory, "performance"))
+        acquisition = os.path.join(directory, "acquisition")
+        self.acquisition = LoanIndex.load(acquisition) if os.path.exists(acquisition) else None
+
+    @staticmethod
+    def build(directory, performance_paths, acquisition_paths=(), max_workers=None):
+        LoanIndex.build(performance_paths, max_workers=max_workers).save(os.path.join(directory, "performance"))
+        if acquisition_paths:
+            LoanIndex.build(acquisition_paths, max_workers=max_workers).save(os.path.join(directory, "acquisition"))
+        return LoanLookup(directory)
+
+    def histories(self, loan_ids):
+        """ loan_id -> (acquisition line or None, list of performance lines) """
+        performance = self.performance.lookup(loan_ids)
+        acquisition = self.acquisition.lookup(loan_ids) if self.acquisition is not None else {}
+        return OrderedDict((loan_id, ((acquisition.get(loan_id) or [None])[0], lines))
+                           for loan_id, lines in performance.items())
+
+    def history(self, loan_id):
+        return self.histories([loan_id])[int(loan_id)]
+
+    def close(self):
+        self.performance.close()
+        if self.acquisition is not None:
+            self.acquisition.close()
+
+
+if __name__ == '__main__':
+    import sys
+    from glob import glob
+
+    if sys.argv[1] == "build":
+        directory, perf_data_path, acq_data_path = sys.argv[2:5]
+        start = time.time()
+        performance_paths = sorted(glob(os.path.join(perf_data_path, "Performance_*")))
+        acquisition_paths = sorted(glob(os.path.join(acq_data_path, "Acquisition_*")))
+        lookup = LoanLookup.build(directory, performance_paths, acquisition_paths)
+        acquisition_records = len(lookup.acquisition.loan_id) if lookup.acquisition is not None else 0
+        print("indexed %d performance runs in %d files and %d acquisition records in %d files, %.1fs"
+              % (len(lookup.performance.loan_id), len(performance_paths), acquisition_records,
+                 len(acquisition_paths), time.time() - start))
+    else:
+        lookup = LoanLookup(sys.argv[1])
+        loan_ids = sys.stdin.read().split() if sys.argv[2:] == ["-"] else sys.argv[2:]
+        start = time.time()
+        histories = lookup.histories(loan_ids)
+        elapsed = time.time() - start
+        for loan_id, (acquisition, performance) in histories.items():
+            print(acquisition if acquisition is not None else "%d: no acquisition record" % loan_id)
+            for line in performance:
+                print(line)
+        sys.stderr.write("%d loans, %d performance rows in %.1f ms\n"
+                         % (len(histories), sum(len(lines) for _, lines in histories.values()), elapsed * 1e3))
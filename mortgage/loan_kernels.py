@@ -0,0 +1,243 @@
+"""Per-loan delinquency features as compiled loops over sorted loan history.
+
+`create_ever_features`, `create_delinq_features` and
+`create_12_mon_features` derive everything from one sequential walk over
+each loan's monthly history, but express it as a dozen groupbys: one per
+delinquency threshold and twelve for the rolling window, each followed
+by a join back. Here the history is sorted by (loan_id, month) once and
+a Numba kernel walks every loan a single time, in parallel over loans,
+producing all the features per row:
+
+- ever_30/90/180: the loan ever reached 1/3/6 months of delinquency,
+- delinquency_30/90/180: first period it did (1970-01-01 if never),
+- delinquency_12/upb_12: over the 12 months starting at the row's month,
+  whether the loan went more than 3 months delinquent (+1 if the unpaid
+  balance hit 0), and the smallest unpaid balance.
+
+The last two are exactly what the 12 `josh_mody_n` groupbys of
+`create_12_mon_features` produce once joined back by
+`combine_joined_12_mon`.
+
+Numba is optional; without it the same loops run interpreted, which is
+only good for checking results.
+
+Run `python loan_kernels.py [LOANS]` to validate the kernel against the
+groupby formulation and benchmark it across thread counts.
+"""
+import time
+
+import numpy as np
+
+try:
+    import numba
+    from numba import njit, prange
+except ImportError:
+    numba = None
+    prange = range
+
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+
+STATUS_THRESHOLDS = (1, 3, 6)
+EVER_NAMES = ("ever_30", "ever_90", "ever_180")
+FIRST_NAMES = ("delinquency_30", "delinquency_90", "delinquency_180")
+
+
+@njit(parallel=True, cache=True)
+def _loan_kernel(starts, months, status, upb, period, ever, first, delinquency_12, upb_12):
+    for loan in prange(len(starts) - 1):
+        begin = starts[loan]
+        end = starts[loan + 1]
+        worst = -1
+        firsts = np.zeros(3, dtype=np.int64)
+        found = np.zeros(3, dtype=np.bool_)
+        for i in range(begin, end):
+            if status[i] > worst:
+                worst = status[i]
+            for t in range(3):
+                # rows are in month order, so the first hit is the earliest period
+                if not found[t] and status[i] >= (1, 3, 6)[t]:
+                    found[t] = True
+                    firsts[t] = period[i]
+        low = begin
+        for i in range(begin, end):
+            for t in range(3):
+                ever[i, t] = 1 if worst >= (1, 3, 6)[t] else 0
+                first[i, t] = firsts[t]
+            # 12 month window starting at this row's month
+            while months[low] < months[i]:
+                low += 1
+            window_status = -1
+            window_upb = np.inf
+            j = low
+            while j < end and months[j] <= months[i] + 11:
+                if status[j] > window_status:
+                    window_status = status[j]
+                if upb[j] < window_upb:
+                    window_upb = upb[j]
+                j += 1
+            delinquency_12[i] = (1 if window_status > 3 else 0) + (1 if window_upb == 0 else 0)
+            upb_12[i] = window_upb
+
+
+def month_index(period):
+    """ year * 12 + month of datetime64 periods, as `create_12_mon_features` counts them """
+    period = np.asarray(period).astype("datetime64[M]")
+    return period.astype(np.int64) + 1970 * 12 + 1
+
+
+def loan_features(loan_id, period, status, upb):
+    """ Every per-loan temporal feature of each performance row
+
+    Parameters
+    ----------
+    loan_id : int64 array
+    period : datetime64 array
+        monthly_reporting_period
+    status : int array
+        current_loan_delinquency_status, nulls filled with -1
+    upb : float array
+        current_actual_upb, nulls filled with 999999999
+
+    Returns
+    -------
+    dict of column name -> array, in the input row order
+    """
+    loan_id = np.asarray(loan_id, dtype=np.int64)
+    period_ms = np.asarray(period).astype("datetime64[ms]").astype(np.int64)
+    months = month_index(period)
+    order = np.lexsort((months, loan_id))
+    sorted_ids = loan_id[order]
+    starts = np.concatenate([[0], np.flatnonzero(sorted_ids[1:] != sorted_ids[:-1]) + 1, [len(order)]]).astype(np.int64)
+    n = len(order)
+    ever = np.empty((n, 3), dtype=np.int8)
+    first = np.empty((n, 3), dtype=np.int64)
+    delinquency_12 = np.empty(n, dtype=np.int32)
+    upb_12 = np.empty(n, dtype=np.float64)
+    _loan_kernel(starts, months[order], np.asarray(status, dtype=np.int32)[order],
+                 np.asarray(upb, dtype=np.float64)[order], period_ms[order],
+                 ever, first, delinquency_12, upb_12)
+    features = {}
+    for t in range(3):
+        features[EVER_NAMES[t]] = _unsort(ever[:, t], order)
+        features[FIRST_NAMES[t]] = _unsort(first[:, t], order).astype("datetime64[ms]")
+    features["delinquency_12"] = _unsort(delinquency_12, order)
+    features["upb_12"] = _unsort(upb_12, order)
+    return features
+
+
+def _unsort(values, order):
+    result = np.empty_like(values)
+    result[order] = values
+    return result
+
+
+def groupby_features(loan_id, period, status, upb):
+    """ The same features the way E2E.py computes them, with pandas groupbys and joins """
+    import pandas as pd
+
+    period = pd.Series(np.asarray(period).astype("datetime64[ms]"))
+    df = pd.DataFrame({"loan_id": np.asarray(loan_id, dtype=np.int64), "period": period,
+                       "status": np.asarray(status, dtype=np.int32), "upb": np.asarray(upb, dtype=np.float64)})
+    df["timestamp_year"] = period.dt.year.astype(np.int32)
+    df["timestamp_month"] = period.dt.month.astype(np.int32)
+
+    # create_ever_features, create_delinq_features, join_ever_delinq_features
+    everdf = df.groupby("loan_id")["status"].max().to_frame("max_status")
+    for threshold, ever_name, first_name in zip(STATUS_THRESHOLDS, EVER_NAMES, FIRST_NAMES):
+        everdf[ever_name] = (everdf["max_status"] >= threshold).astype(np.int8)
+        everdf[first_name] = df[df["status"] >= threshold].groupby("loan_id")["period"].min()
+        everdf[first_name] = everdf[first_name].fillna(pd.Timestamp("1970-01-01"))
+
+    # create_12_mon_features
+    testdfs = []
+    josh_months = df["timestamp_year"] * 12 + df["timestamp_month"]
+    for y in range(1, 13):
+        tmpdf = df[["loan_id", "status", "upb"]].copy()
+        tmpdf["josh_mody_n"] = np.floor((josh_months.astype(np.float64) - 24000 - y) / 12)
+        tmpdf = tmpdf.groupby(["loan_id", "josh_mody_n"]).agg(max_status=("status", "max"), min_upb=("upb", "min")).reset_index()
+        tmpdf["delinquency_12"] = (tmpdf["max_status"] > 3).astype(np.int32) + (tmpdf["min_upb"] == 0).astype(np.int32)
+        tmpdf["upb_12"] = tmpdf["min_upb"]
+        tmpdf["timestamp_year"] = np.floor(((tmpdf["josh_mody_n"] * 12) + 24000 + (y - 1)) / 12).astype(np.int32)
+        tmpdf["timestamp_month"] = np.int32(y)
+        testdfs.append(tmpdf[["loan_id", "timestamp_year", "timestamp_month", "delinquency_12", "upb_12"]])
+    testdf = pd.concat(testdfs)
+
+    # combine_joined_12_mon
+    joined = df.merge(testdf, how="left", on=["loan_id", "timestamp_year", "timestamp_month"])
+    joined = joined.merge(everdf, how="left", left_on="loan_id", right_index=True)
+    features = dict((name, joined[name].values) for name in EVER_NAMES + FIRST_NAMES)
+    features["delinquency_12"] = joined["delinquency_12"].values
+    features["upb_12"] = joined["upb_12"].values
+    return features
+
+
+def synthetic_history(nloans, months=60, seed=0):
+    """ Loan histories with random start dates, gaps and delinquency runs, shuffled """
+    rng = np.random.RandomState(seed)
+    lengths = rng.randint(1, months + 1, size=nloans)
+    loan_id = np.repeat(np.arange(nloans, dtype=np.int64) + 100000000000, lengths)
+    start = rng.randint(0, 120, size=nloans)
+    first_row = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    # consecutive months with an occasional skipped one
+    skips = np.cumsum(rng.uniform(size=len(loan_id)) < 0.02)
+    offset = np.arange(len(loan_id)) - first_row + skips - skips[first_row]
+    month = np.repeat(start, lengths) + offset
+    period = (np.datetime64("2000-01", "M") + month).astype("datetime64[ms]")
+    status = np.clip(rng.poisson(0.4, size=len(loan_id)) - 1 + (rng.uniform(size=len(loan_id)) < 0.01) * 6, -1, 12)
+    upb = rng.uniform(0, 400000, size=len(loan_id)).round(2)
+    upb[rng.uniform(size=len(upb)) < 0.01] = 0
+    shuffle = rng.permutation(len(loan_id))
+    return loan_id[shuffle], period[shuffle], status[shuffle].astype(np.int32), upb[shuffle]
+
+
+def validate(nloans=20000, seed=0):
+    """ Compares the kernel with the groupby formulation; raises on any difference """
+    history = synthetic_history(nloans, seed=seed)
+    expected = groupby_features(*history)
+    actual = loan_features(*history)
+    for name in expected:
+        if not np.array_equal(np.asarray(expected[name]).astype(actual[name].dtype), actual[name]):
+            mismatches = np.flatnonzero(np.asarray(expected[name]).astype(actual[name].dtype) != actual[name])
+            raise AssertionError("%s differs in %d rows, e.g. row %d" % (name, len(mismatches), mismatches[0]))
+    return len(history[0])
+
+
+def benchmark(nloans=200000, threads=None, repeat=3):
+    """ rows/s of the kernel for each thread count, and of the groupby version
+
+    Returns
+    -------
+    list of (label, rows per second)
+    """
+    history = synthetic_history(nloans, seed=1)
+    rows = len(history[0])
+    loan_features(*history)  # compile
+    results = []
+    if numba is not None:
+        available = numba.config.NUMBA_NUM_THREADS
+        for n in threads or sorted(set([1, 2, 4, 8, 16, 32, available])):
+            if n > available:
+                continue
+            numba.set_num_threads(n)
+            best = min(_timed(loan_features, history) for _ in range(repeat))
+            results.append(("kernel, %d thread(s)" % n, rows / best))
+        numba.set_num_threads(available)
+    results.append(("groupbys (pandas)", rows / _timed(groupby_features, history)))
+    return results
+
+
+def _timed(func, args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    import sys
+
+    nloans = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print("validated on %d rows" % validate())
+    for label, rate in benchmark(nloans):
+        print("%-24s %12.0f rows/s" % (label, rate))
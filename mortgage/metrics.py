@@ -0,0 +1,305 @@
+"""Live throughput and memory metrics for long mortgage runs.
+
+Each worker keeps a few in-process counters that the ETL updates at
+stage boundaries (partitions done, rows, bytes read, current stage). The
+driver's `MetricsServer` polls them with `client.run` on an interval,
+adds each worker's RSS and spilled bytes, and serves the aggregate on a
+local HTTP endpoint in Prometheus text format while also appending JSON
+snapshots to a file. Updating a counter is a couple of attribute writes
+under a lock; everything heavier happens once per poll.
+
+The endpoint defaults to port 19100, outside the 9100-9999 range where
+Prometheus exporters (node_exporter is 9100) take their ports; when the
+port is taken anyway the run goes on without it.
+
+Run `python metrics.py` to scrape the endpoint of a small local run.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+RATE_WINDOW = 60.0
+METRICS_PORT = 19100
+
+
+class WorkerMetrics(object):
+    """ Counters of one worker process """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.partitions_done = 0
+        self.rows = 0
+        self.bytes_read = 0
+        self.stage = "idle"
+        self.stage_since = time.time()
+        self.started = time.time()
+        self._completions = deque()
+
+    @contextmanager
+    def stage_of(self, name):
+        with self._lock:
+            previous = self.stage
+            self.stage = name
+            self.stage_since = time.time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stage = previous
+                self.stage_since = time.time()
+
+    def partition_done(self, rows, bytes_read=0):
+        now = time.time()
+        with self._lock:
+            self.partitions_done += 1
+            self.rows += rows
+            self.bytes_read += bytes_read
+            self._completions.append((now, rows))
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            while self._completions and self._completions[0][0] < now - RATE_WINDOW:
+                self._completions.popleft()
+            recent = sum(rows for _, rows in self._completions)
+            # early on, the rate is over the time the worker has been up, not the full window
+            window = min(RATE_WINDOW, now - self.started)
+            return {
+                "partitions_done": self.partitions_done,
+                "rows": self.rows,
+                "bytes_read": self.bytes_read,
+                "rows_per_second": recent / window if window > 0 else 0.0,
+                "stage": self.stage,
+                "stage_seconds": now - self.stage_since,
+                "rss_bytes": rss_bytes(),
+                "spilled_bytes": spilled_bytes(),
+            }
+
+
+_metrics = WorkerMetrics()
+
+
+def stage(name):
+    """ Context manager marking the stage the calling worker is in """
+    return _metrics.stage_of(name)
+
+
+def partition_done(rows, bytes_read=0):
+    """ Counts one finished partition on the calling worker """
+    _metrics.partition_done(rows, bytes_read)
+
+
+def worker_snapshot():
+    """ `client.run` entry point: this worker's current metrics """
+    return _metrics.snapshot()
+
+
+def rss_bytes():
+    """ Current resident set size, None where neither /proc nor psutil can tell """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        # getrusage only knows the peak, which is not what this gauge shows
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def spilled_bytes():
+    """ Bytes the Dask worker's spill buffer holds on disk, 0 outside a worker
+
+    Read off the buffer's own bookkeeping: `spilled_total` on recent
+    distributed, the slow store's `total_weight` on older ones. Stores that
+    keep no sizes (plain zict.File, dask-cuda's DeviceHostFile) count as 0.
+    """
+    try:
+        from distributed import get_worker
+        data = get_worker().data
+    except (ImportError, ValueError, AttributeError):
+        return 0
+    spilled = getattr(data, "spilled_total", None)
+    if spilled is None:
+        spilled = getattr(getattr(data, "slow", None), "total_weight", None)
+    # a (memory, disk) pair where the buffer also tracks the pickled size
+    spilled = getattr(spilled, "disk", spilled)
+    return spilled if isinstance(spilled, (int, float)) else 0
+
+
+# (metric, snapshot key, type, help, also summed over the cluster)
+METRICS = [
+    ("mortgage_partitions_done_total", "partitions_done", "counter", "ETL partitions finished", True),
+    ("mortgage_rows_total", "rows", "counter", "performance rows processed", True),
+    ("mortgage_bytes_read_total", "bytes_read", "counter", "input bytes read", True),
+    ("mortgage_rows_per_second", "rows_per_second", "gauge", "rows/s over the last minute", True),
+    ("mortgage_rss_bytes", "rss_bytes", "gauge", "worker resident set size", False),
+    ("mortgage_spilled_bytes", "spilled_bytes", "gauge", "bytes spilled to local disk", False),
+    ("mortgage_stage_seconds", "stage_seconds", "gauge", "seconds in the current stage", False),
+]
+
+
+def _family(lines, name, kind, help_text, samples):
+    lines.append("# HELP %s %s" % (name, help_text))
+    lines.append("# TYPE %s %s" % (name, kind))
+    for labels, value in samples:
+        value = "NaN" if value is None else value
+        lines.append("%s{%s} %s" % (name, labels, value) if labels else "%s %s" % (name, value))
+
+
+def prometheus_text(workers, driver):
+    """ Renders worker and driver metrics in the Prometheus exposition format
+
+    Every worker gets one sample per metric, labelled with its address.
+    Counters and the row rate are also summed into `mortgage_cluster_*`
+    metrics of their own; memory and stage times are not, their sums mean
+    nothing.
+    """
+    lines = []
+    for name, key, kind, help_text, summed in METRICS:
+        samples = []
+        for worker, values in sorted(workers.items()):
+            labels = 'worker="%s"' % worker
+            if key == "stage_seconds":
+                labels += ',stage="%s"' % values["stage"]
+            samples.append((labels, values[key]))
+        _family(lines, name, kind, help_text, samples)
+    for name, key, kind, help_text, summed in METRICS:
+        if summed:
+            _family(lines, name.replace("mortgage_", "mortgage_cluster_", 1), kind, help_text + ", all workers",
+                    [("", sum(values[key] for values in workers.values()))])
+    _family(lines, "mortgage_phase_seconds", "gauge", "seconds in the current driver phase",
+            [('phase="%s"' % driver["phase"], driver["phase_seconds"])])
+    return "\n".join(lines) + "\n"
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer(object):
+    """ Aggregates worker metrics on the driver and publishes them
+
+    Parameters
+    ----------
+    client : distributed.Client
+    port : int
+        HTTP port of the /metrics endpoint; None disables the endpoint, 0
+        picks a free port (see `port` after `start`)
+    snapshot_path : str
+        file JSON snapshots are appended to, one per line; None disables them
+    interval : float
+        seconds between polls of the workers
+    """
+
+    def __init__(self, client, port=METRICS_PORT, snapshot_path=None, interval=5.0):
+        self.client = client
+        self.port = port
+        self.snapshot_path = snapshot_path
+        self.interval = interval
+        self.phase = "startup"
+        self.phase_since = time.time()
+        self.latest = {"workers": {}, "driver": self._driver()}
+        self._stop = threading.Event()
+        self._thread = None
+        self._httpd = None
+
+    def set_phase(self, phase):
+        self.phase = phase
+        self.phase_since = time.time()
+
+    def start(self):
+        if self.port is not None:
+            server = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] not in ("/metrics", "/"):
+                        self.send_error(404)
+                        return
+                    body = prometheus_text(server.latest["workers"], server._driver()).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            try:
+                self._httpd = _ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+            except OSError as e:
+                # monitoring must not end the run it monitors
+                print("metrics endpoint disabled, cannot listen on port %d: %s" % (self.port, e))
+                self.port = None
+            else:
+                self.port = self._httpd.server_address[1]
+                threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+        return self
+
+    def poll(self):
+        """ Collects one round of worker metrics and writes a snapshot """
+        workers = self.client.run(worker_snapshot)
+        self.latest = {"time": time.time(), "workers": workers, "driver": self._driver()}
+        if self.snapshot_path is not None:
+            with open(self.snapshot_path, "a") as f:
+                f.write(json.dumps(self.latest) + "\n")
+        return self.latest
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+
+    def _poll(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                # a worker going away must not end the monitoring
+                print("metrics poll failed:", e)
+            self._stop.wait(self.interval)
+
+    def _driver(self):
+        return {"phase": self.phase, "phase_seconds": time.time() - self.phase_since}
+
+
+def _demo_partition(rows):
+    with stage("etl"):
+        time.sleep(0.2)
+        partition_done(rows, bytes_read=rows * 100)
+    return rows
+
+
+if __name__ == '__main__':
+    from urllib.request import urlopen
+    from distributed import Client, LocalCluster
+    # workers must share the imported module, not pickled copies of __main__
+    import metrics
+
+    cluster = LocalCluster(n_workers=2, threads_per_worker=1)
+    client = Client(cluster)
+    client.upload_file(os.path.abspath(__file__))
+    server = metrics.MetricsServer(client, port=0, interval=0.5).start()
+    server.set_phase("etl")
+    client.gather(client.map(metrics._demo_partition, [1000] * 10, pure=False))
+    server.poll()
+    text = urlopen("http://127.0.0.1:%d/metrics" % server.port).read().decode()
+    print(text)
+    server.stop()
+    client.close()
+    cluster.close()
@@ -0,0 +1,139 @@
+"""Size-aware placement of ETL partitions on workers.
+
+With work stealing disabled, a task stays on the worker it was first
+given to, and submitting splits in glob order leaves the big late-2000s
+quarters for last. The planner estimates each partition's cost from its
+file size and applies longest-processing-time-first: partitions are
+taken largest first and each goes to the worker with the least estimated
+work so far. That is within 4/3 of the optimal makespan and in practice
+much closer.
+
+Run `python planner.py PERF_DIR NWORKERS [START_YEAR END_YEAR]` to
+compare the estimated makespan of the glob-order schedules against LPT.
+"""
+import heapq
+import os
+import sys
+from glob import glob
+
+
+# fixed per-task cost, in bytes of input, covering loading the acquisition
+# file, scheduling and result transfer
+TASK_OVERHEAD_BYTES = 32 << 20
+
+
+def estimate_cost(path, overhead=TASK_OVERHEAD_BYTES):
+    """ Estimated cost of one partition in bytes-equivalent units """
+    return os.path.getsize(path) + overhead
+
+
+def lpt_assignment(costs, workers, allowed=None):
+    """ Assigns tasks to workers longest-processing-time first
+
+    Parameters
+    ----------
+    costs : list of float
+        estimated cost of each task
+    workers : list
+        worker identifiers
+    allowed : dict
+        task index -> workers it may run on (e.g. the ones holding its
+        cached result); other tasks may run anywhere
+
+    Returns
+    -------
+    (dict of worker -> list of task indices in execution order,
+     dict of worker -> total estimated cost)
+    """
+    allowed = allowed or {}
+    assignment = dict((worker, []) for worker in workers)
+    loads = [(0.0, i, worker) for i, worker in enumerate(workers)]
+    heapq.heapify(loads)
+    for task in sorted(range(len(costs)), key=lambda task: -costs[task]):
+        if task in allowed:
+            candidates = [entry for entry in loads if entry[2] in allowed[task]] or loads
+            entry = min(candidates)
+            loads.remove(entry)
+            heapq.heapify(loads)
+        else:
+            entry = heapq.heappop(loads)
+        load, i, worker = entry
+        assignment[worker].append(task)
+        heapq.heappush(loads, (load + costs[task], i, worker))
+    return assignment, dict((worker, load) for load, _, worker in loads)
+
+
+def submission_order(assignment):
+    """ Interleaves the per-worker queues so every worker starts at once
+
+    Returns
+    -------
+    list of (task index, worker)
+    """
+    queues = [list(tasks) for tasks in assignment.values()]
+    workers = list(assignment.keys())
+    order = []
+    while any(queues):
+        for worker, queue in zip(workers, queues):
+            if queue:
+                order.append((queue.pop(0), worker))
+    return order
+
+
+def makespan_static(assignment, costs):
+    """ Makespan when every worker runs exactly the tasks it was given """
+    return max(sum(costs[task] for task in tasks) for tasks in assignment.values())
+
+
+def makespan_list_scheduling(costs, n_workers):
+    """ Makespan when tasks, in the given order, go to the next free worker """
+    finish = [0.0] * n_workers
+    heapq.heapify(finish)
+    for cost in costs:
+        heapq.heappush(finish, heapq.heappop(finish) + cost)
+    return max(finish)
+
+
+def round_robin_assignment(n_tasks, workers):
+    assignment = dict((worker, []) for worker in workers)
+    for task in range(n_tasks):
+        assignment[workers[task % len(workers)]].append(task)
+    return assignment
+
+
+def compare(costs, n_workers):
+    """ Estimated makespans of the glob-order schedules and of LPT
+
+    Returns
+    -------
+    dict of schedule name -> makespan, plus the lower bound
+    """
+    workers = list(range(n_workers))
+    lpt, _ = lpt_assignment(costs, workers)
+    return {
+        "glob order, round robin": makespan_static(round_robin_assignment(len(costs), workers), costs),
+        "glob order, next free worker": makespan_list_scheduling(costs, n_workers),
+        "largest first (LPT)": makespan_static(lpt, costs),
+        "lower bound": max(max(costs), sum(costs) / float(n_workers)) if costs else 0.0,
+    }
+
+
+def performance_files(perf_data_path, start_year, end_year):
+    files = []
+    for year in range(start_year, end_year + 1):
+        for quarter in range(1, 5):
+            files += glob(os.path.join(perf_data_path + "/Performance_" + str(year) + "Q" + str(quarter) + "*"))
+    return files
+
+
+if __name__ == '__main__':
+    perf_data_path = sys.argv[1]
+    n_workers = int(sys.argv[2])
+    start_year = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+    end_year = int(sys.argv[4]) if len(sys.argv) > 4 else 2016
+    costs = [estimate_cost(path) for path in performance_files(perf_data_path, start_year, end_year)]
+    results = compare(costs, n_workers)
+    baseline = results["glob order, round robin"]
+    print("%d partitions on %d workers, estimated makespan in GB-equivalents:" % (len(costs), n_workers))
+    for name, makespan in results.items():
+        print("  %-30s %8.2f  (%.2fx of round robin)" % (name, makespan / 1e9, makespan / baseline if baseline else 0.0))
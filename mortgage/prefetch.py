@@ -0,0 +1,174 @@
+"""Read-ahead of partition input files on the workers.
+
+The driver hands every worker the ordered list of files it is going to
+process. A small background thread pool reads the next files ahead of
+time, bounded by a byte budget, so that when `process_quarter_gpu` opens
+its split the bytes are already in memory (or in the page cache) and the
+parse starts without waiting on the disk.
+
+One `Prefetcher` lives in each worker process; use `get_prefetcher` to
+reach it from tasks and from `client.run`.
+"""
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+CHUNK_SIZE = 8 << 20
+
+
+class Prefetcher(object):
+    """ Reads queued files ahead of their consumers
+
+    Parameters
+    ----------
+    depth : int
+        how many upcoming files may be in flight or buffered at once
+    max_bytes : int
+        byte budget shared by all buffered files; a file bigger than the
+        whole budget is still prefetched when nothing else is buffered
+    threads : int
+        background reader threads
+    mode : str
+        "pagecache" only pulls the file into the OS page cache and hands the
+        path back, which works with any reader. "memory" keeps the bytes and
+        hands back a file-like buffer.
+    """
+
+    def __init__(self, depth=2, max_bytes=4 << 30, threads=2, mode="pagecache"):
+        if mode not in ("pagecache", "memory"):
+            raise ValueError("mode must be 'pagecache' or 'memory', got %r" % mode)
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self._pool = ThreadPoolExecutor(max_workers=threads)
+        self._lock = threading.Condition()
+        self._queue = []
+        self._inflight = OrderedDict()   # path -> Future
+        self._buffered_bytes = 0
+        self._tasks = []
+
+    def schedule(self, paths):
+        """ Appends files to this worker's queue, in processing order """
+        with self._lock:
+            self._queue.extend(paths)
+        self._fill()
+        return len(self._queue)
+
+    def acquire(self, path):
+        """ Waits for a prefetched file and returns something to parse
+
+        Returns the path in "pagecache" mode and an in-memory buffer in
+        "memory" mode. Files that were never queued are a miss: their path
+        comes back at once, unread, so that the parser reads them only once.
+        Call `release` once the file has been parsed.
+        """
+        start = time.time()
+        with self._lock:
+            if path in self._queue:
+                self._queue.remove(path)
+            future = self._inflight.get(path)
+        if future is None:
+            hit = "miss"
+            data = None
+        else:
+            hit = "hit" if future.done() else "partial"
+            data = future.result()
+        wait = time.time() - start
+        with self._lock:
+            self._tasks.append({"path": path, "result": hit, "io_wait": wait})
+        if data is None:
+            return path
+        return io.BytesIO(data)
+
+    def release(self, path):
+        """ Returns a consumed file's bytes to the budget and reads further ahead """
+        with self._lock:
+            if path in self._inflight:
+                del self._inflight[path]
+                self._buffered_bytes = max(0, self._buffered_bytes - _size(path))
+        self._fill()
+
+    def stats(self):
+        """ Returns the hit rate and the time tasks spent waiting on input
+
+        Returns
+        -------
+        dict
+        """
+        with self._lock:
+            tasks = list(self._tasks)
+        hits = sum(1 for task in tasks if task["result"] == "hit")
+        return {
+            "tasks": len(tasks),
+            "hits": hits,
+            "partial_hits": sum(1 for task in tasks if task["result"] == "partial"),
+            "misses": sum(1 for task in tasks if task["result"] == "miss"),
+            "hit_rate": float(hits) / len(tasks) if tasks else 0.0,
+            "io_wait": sum(task["io_wait"] for task in tasks),
+            "per_task": tasks,
+        }
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+    def _fill(self):
+        with self._lock:
+            while self._queue:
+                path = self._queue[0]
+                if path in self._inflight:
+                    self._queue.pop(0)
+                    continue
+                if len(self._inflight) >= self.depth:
+                    break
+                size = _size(path)
+                if self._inflight and self._buffered_bytes + size > self.max_bytes:
+                    break
+                self._queue.pop(0)
+                self._buffered_bytes += size
+                self._inflight[path] = self._pool.submit(self._read, path)
+
+    def _read(self, path):
+        if self.mode == "memory":
+            with open(path, "rb") as f:
+                return f.read()
+        with open(path, "rb") as f:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            buf = bytearray(CHUNK_SIZE)
+            while f.readinto(buf):
+                pass
+        return None
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher(**kwargs):
+    """ Returns this process' prefetcher, creating it on first use """
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher(**kwargs)
+        return _prefetcher
+
+
+def schedule_files(paths, **kwargs):
+    """ `client.run` entry point: queues `paths` on the worker it runs on """
+    return get_prefetcher(**kwargs).schedule(paths)
+
+
+def prefetch_stats():
+    """ `client.run` entry point: this worker's prefetch metrics """
+    return get_prefetcher().stats()
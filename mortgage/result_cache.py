@@ -0,0 +1,232 @@
+"""Content-addressed on-disk cache of per-partition ETL results.
+
+A partition's ETL output only depends on its input files, on the ETL code
+and on the run parameters. `ResultCache.key` hashes exactly those, so
+re-running the workflow with, say, different training parameters finds
+every partition in the cache and skips its ETL entirely.
+
+Arrow tables are stored in the Arrow IPC file format, anything else
+(e.g. the `(features, labels)` arrays of the "matrix" output) is pickled.
+The cache is bounded by total size and evicts least recently used
+entries.
+
+Entries live on the local disk of the worker that produced them, so on a
+multi-node cluster only the driver's `client.run(cached_entries, ...)`
+tells which workers hold a partition. An entry can still be evicted by
+another worker between that lookup and the read: `cached_call` then
+recomputes it.
+
+Entries that must survive until a later phase reads them (the partitions
+streamed into external memory training) are pinned: a `<key>.pin` marker
+next to the entry, which `evict` never removes, so the cache may outgrow
+`max_bytes` until they are unpinned.
+"""
+import hashlib
+import json
+import os
+import pickle
+
+
+class ResultCache(object):
+    """ LRU-bounded directory of ETL results keyed by content hash
+
+    Parameters
+    ----------
+    directory : str
+        cache location; local disk of the node running the workers
+    max_bytes : int
+        total size above which the least recently used entries are evicted
+    fingerprint : str
+        "stat" identifies inputs by size and mtime, "content" by a hash of
+        their bytes (slower, but survives copies and touches)
+    """
+
+    def __init__(self, directory, max_bytes=200 << 30, fingerprint="stat"):
+        if fingerprint not in ("stat", "content"):
+            raise ValueError("fingerprint must be 'stat' or 'content', got %r" % fingerprint)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fingerprint = fingerprint
+
+    def key(self, input_paths, code, params):
+        """ Hashes the inputs, the ETL source code and the parameters
+
+        Parameters
+        ----------
+        input_paths : list of str
+            every file the partition's ETL reads
+        code : list of str
+            source of the ETL functions and helper modules; code that does
+            not shape the result (e.g. training) should be left out so that
+            editing it keeps the cache valid
+        params : dict
+            JSON-serializable run parameters
+
+        Returns
+        -------
+        str
+        """
+        digest = hashlib.sha256()
+        for path in input_paths:
+            digest.update(path.encode())
+            digest.update(self._input_fingerprint(path))
+        for source in code:
+            digest.update(source.encode())
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def contains(self, key):
+        """ Checks for an entry on this disk """
+        return self._path(key) is not None
+
+    def sizes(self, keys):
+        """ Size in bytes of the entries present on this disk
+
+        Returns
+        -------
+        dict of key -> int
+        """
+        found = {}
+        for key in keys:
+            path = self._path(key)
+            if path is not None:
+                try:
+                    found[key] = os.path.getsize(path)
+                except OSError:
+                    pass
+        return found
+
+    def load(self, key):
+        """ Reads an entry back; raises KeyError when it is missing or gets evicted while opening """
+        path = self._path(key)
+        if path is None:
+            raise KeyError(key)
+        try:
+            # the mtime doubles as the LRU timestamp
+            os.utime(path, None)
+            if path.endswith(".arrow"):
+                import pyarrow as pa
+                with pa.memory_map(path, "r") as source:
+                    return pa.RecordBatchFileReader(source).read_all()
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except (IOError, OSError):
+            if os.path.exists(path):
+                raise
+            raise KeyError(key)
+
+    def store(self, key, result):
+        """ Writes a result atomically, then evicts down to the size bound """
+        os.makedirs(self.directory, exist_ok=True)
+        if type(result).__module__.startswith("pyarrow"):
+            import pyarrow as pa
+            path = os.path.join(self.directory, key + ".arrow")
+            tmp = "%s.%d.tmp" % (path, os.getpid())
+            with pa.OSFile(tmp, "wb") as sink:
+                writer = pa.RecordBatchFileWriter(sink, result.schema)
+                writer.write_table(result)
+                writer.close()
+        else:
+            path = os.path.join(self.directory, key + ".pkl")
+            tmp = "%s.%d.tmp" % (path, os.getpid())
+            with open(tmp, "wb") as f:
+                pickle.dump(result, f, protocol=4)
+        os.rename(tmp, path)
+        self.evict()
+        return result
+
+    def pin(self, keys):
+        """ Protects the entries of `keys`, stored already or not, from eviction """
+        os.makedirs(self.directory, exist_ok=True)
+        for key in keys:
+            with open(os.path.join(self.directory, key + ".pin"), "w"):
+                pass
+
+    def unpin(self, keys):
+        """ Makes the entries of `keys` evictable again and evicts down to the size bound """
+        for key in keys:
+            try:
+                os.remove(os.path.join(self.directory, key + ".pin"))
+            except OSError:
+                pass
+        if os.path.isdir(self.directory):
+            self.evict()
+
+    def evict(self):
+        """ Removes least recently used entries until the cache fits, pinned ones excepted """
+        names = os.listdir(self.directory)
+        pinned = set(name[:-len(".pin")] for name in names if name.endswith(".pin"))
+        entries = []
+        for name in names:
+            if name.endswith((".tmp", ".pin")) or os.path.splitext(name)[0] in pinned:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # another worker got to it first
+                pass
+            total -= size
+
+    def _path(self, key):
+        for suffix in (".arrow", ".pkl"):
+            path = os.path.join(self.directory, key + suffix)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _input_fingerprint(self, path):
+        if self.fingerprint == "stat":
+            stat = os.stat(path)
+            return ("%d:%d" % (stat.st_size, stat.st_mtime_ns)).encode()
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(8 << 20), b""):
+                digest.update(block)
+        return digest.digest()
+
+
+def cached_call(cache, key, func, *args, **kwargs):
+    """ Returns the result stored under `key`, or runs `func` and stores its result; meant to run on a worker """
+    try:
+        return cache.load(key)
+    except KeyError:
+        return cache.store(key, func(*args, **kwargs))
+
+
+def stored_call(cache, key, func, *args, **kwargs):
+    """ Like `cached_call`, but pins the entry and returns `(worker address, key)` instead of the result
+
+    For results read back later from this worker's disk: the task's
+    future holds nothing but where to find them.
+    """
+    from distributed import get_worker
+
+    cache.pin([key])
+    if not cache.contains(key):
+        cache.store(key, func(*args, **kwargs))
+    return get_worker().address, key
+
+
+def unpin_entries(cache, keys):
+    """ `client.run` entry point: unpins `keys` on this worker's disk """
+    cache.unpin(keys)
+
+
+def cached_entries(cache, keys):
+    """ `client.run` entry point: sizes of the entries of `keys` on this worker's disk """
+    return cache.sizes(keys)
+
+
+def load_cached(cache, key):
+    """ Loads a stored result; meant to run on a worker """
+    return cache.load(key)
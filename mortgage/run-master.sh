@@ -1,6 +1,8 @@
 #!/usr/bin/bash
 
-export DASK_WORKERS_NUM=8
+# NWORKERS from dask.conf (written by the E2E.py autotune mode) when present
+CONF_WORKERS=$(awk '$1 == "NWORKERS" { print $2 }' ../utils/dask.conf 2>/dev/null)
+export DASK_WORKERS_NUM=${CONF_WORKERS:-8}
 
 #source activate rapids
 NUMBAPRO_NVVM=$CUDA_HOME/nvvm/lib64/libnvvm.so
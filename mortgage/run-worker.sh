@@ -1,5 +1,9 @@
 #!/usr/bin/bash
 
+# NTHREADS from dask.conf (written by the E2E.py autotune mode) when present
+CONF_THREADS=$(awk '$1 == "NTHREADS" { print $2 }' ../utils/dask.conf 2>/dev/null)
+NTHREADS=${CONF_THREADS:-1}
+
 export DASK_WORKERS_NUM=4
 
 #source activate rapids
@@ -10,5 +14,5 @@ port=5555
 devs='0,1,2,3'
 worker_id=100
 
-env CUDA_VISIBLE_DEVICES=$devs dask-cuda-worker $ip:$port --memory-limit=80e9 --nthreads=1 --name "worker_$worker_id"  --resources "GPU=1"  
+env CUDA_VISIBLE_DEVICES=$devs dask-cuda-worker $ip:$port --memory-limit=80e9 --nthreads=$NTHREADS --name "worker_$worker_id"  --resources "GPU=1" --preload "$(pwd)/worker_preload.py"  
 
@@ -0,0 +1,51 @@
+"""Deterministic loan-level sampling for fast development runs.
+
+`part_count` shrinks a run by dropping whole split files, which keeps
+only the first files of the first quarter and so skews toward early
+loans, and a file's loans still have part of their history in the next
+file. Sampling instead keeps a fixed share of the loans, chosen by the
+same loan_id hash as the validation split, in every acquisition and
+performance file as they are read: a kept loan keeps its full history
+and its acquisition row, everything else is dropped before the joins,
+features and training.
+
+The sample uses the hash's digits above the two the validation split
+buckets on, so the held-out share of a sample stays `validation_percent`
+of it, and sampling resolves to 0.01% of the loans.
+
+Run `python sampling.py [PERCENT] [LOANS]` to check the kept share and
+its independence from the validation split on random loan ids.
+"""
+from validation import LOAN_HASH_MODULUS, LOAN_HASH_MULTIPLIER, is_validation_loan
+
+
+# the validation split uses hash % 100, the sample (hash // 100) % SAMPLE_BUCKETS
+SAMPLE_BUCKETS = 10000
+
+
+def sample_threshold(percent):
+    """ Buckets below which a loan is kept when sampling `percent` of the loans """
+    if not 0 < percent <= 100:
+        raise ValueError("sample percent must be in (0, 100], got %r" % (percent,))
+    return int(round(percent * SAMPLE_BUCKETS / 100.0))
+
+
+def is_sampled_loan(loan_id, percent):
+    """ Scalar version of the ETL's sample, e.g. to check a single loan """
+    bucket = ((loan_id % LOAN_HASH_MODULUS) * LOAN_HASH_MULTIPLIER) % LOAN_HASH_MODULUS // 100 % SAMPLE_BUCKETS
+    return bucket < sample_threshold(percent)
+
+
+if __name__ == '__main__':
+    import random
+    import sys
+
+    percent = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+    rng = random.Random(0)
+    loans = [rng.randrange(100000000000, 999999999999) for _ in range(count)]
+    sampled = [loan for loan in loans if is_sampled_loan(loan, percent)]
+    held_out = sum(1 for loan in sampled if is_validation_loan(loan, 5))
+    print("kept %d of %d loans (%.3f%%, asked %.3f%%)" % (len(sampled), count, 100.0 * len(sampled) / count, percent))
+    print("validation share of the sample %.3f%% (5%% of all loans: %.3f%%)"
+          % (100.0 * held_out / max(len(sampled), 1), 100.0 * sum(1 for loan in loans if is_validation_loan(loan, 5)) / count))
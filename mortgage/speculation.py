@@ -0,0 +1,256 @@
+"""Speculative re-execution of straggling ETL partitions.
+
+Work stealing is disabled and the ETL ends in a barrier, so a single slow
+worker (a noisy disk, a swapping node) holds up the whole run. The
+`SpeculativeExecutor` submits the planned partitions, learns the seconds
+per unit of cost from the partitions that finish, and watches the ones
+still running. When a partition has been running much longer than its
+size predicts and some worker has drained its own queue, a duplicate is
+launched on that worker; whichever copy finishes first is kept and the
+other is cancelled.
+
+Every copy that wins records the time saved. With `cancel_losers=False`
+the original runs to completion and the saving is measured. Otherwise
+the original's finish is projected from its expected duration and the
+pace of its worker on the partitions it finished before (when it has
+none, from how long the original had already run, a lower bound).
+
+Start times are inferred from the per-worker queues: workers run their
+pinned partitions one after the other, so a partition starts when its
+predecessor on the same worker finishes.
+
+Run `python speculation.py` to try it on a local cluster where one
+worker is artificially slowed down.
+"""
+import time
+
+from planner import submission_order
+
+
+class SpeculativeExecutor(object):
+    """ Runs pinned tasks and duplicates the ones lagging behind
+
+    Parameters
+    ----------
+    client : distributed.Client
+    launch : callable
+        `launch(task, worker)` submits one task on a given worker and
+        returns its Future; it is called again for speculative copies, so
+        it must produce a fresh key every time
+    slowdown : float
+        a task is a straggler once it ran `slowdown` times its expected time
+    min_elapsed : float
+        never speculate on tasks that ran for less than this many seconds
+    min_samples : int
+        finished tasks needed before expected durations are trusted
+    poll_interval : float
+        seconds between progress checks
+    cancel_losers : bool
+        cancel the slower copy as soon as the other one finishes, in which
+        case the saving is projected; when False the loser runs to
+        completion so the saving can be measured
+    """
+
+    def __init__(self, client, launch, slowdown=2.0, min_elapsed=10.0, min_samples=3,
+                 poll_interval=1.0, cancel_losers=True):
+        self.client = client
+        self.launch = launch
+        self.slowdown = slowdown
+        self.min_elapsed = min_elapsed
+        self.min_samples = min_samples
+        self.poll_interval = poll_interval
+        self.cancel_losers = cancel_losers
+        self.speculations = []
+        self.elapsed = None
+        self._paces = {}   # worker -> (duration, cost) of the originals it finished
+
+    def run(self, assignment, costs):
+        """ Submits `assignment` and blocks until every task has a result
+
+        Parameters
+        ----------
+        assignment : dict of worker -> list of task indices in execution order
+        costs : list of float
+            estimated cost of each task, e.g. from `planner.estimate_cost`
+
+        Returns
+        -------
+        list of Future, one per task, each the copy that finished first
+        """
+        originals = {}
+        for task, worker in submission_order(assignment):
+            originals[task] = self.launch(task, worker)
+        queues = dict((worker, list(tasks)) for worker, tasks in assignment.items())
+        copies = {}        # task -> (worker, Future, launch time)
+        finished = {}      # task -> finish time of the original
+        winners = {}
+        rates = []
+        start = time.time()
+
+        while len(winners) < len(originals):
+            now = time.time()
+            for task, future in originals.items():
+                if task not in finished and future.done():
+                    finished[task] = now
+            started = self._start_times(queues, finished, start)
+            for task in list(originals):
+                if task in winners:
+                    continue
+                copy = copies.get(task)
+                if task in finished and originals[task].status == "finished":
+                    winners[task] = originals[task]
+                    if costs[task] > 0:
+                        rates.append((finished[task] - started[task]) / costs[task])
+                        if copy is None:
+                            self._paces.setdefault(self._worker_of(queues, task), []).append(
+                                (finished[task] - started[task], costs[task]))
+                    if copy is not None:
+                        self._settle(task, copy, lost=True, now=now)
+                elif copy is not None and copy[1].done() and copy[1].status == "finished":
+                    winners[task] = copy[1]
+                    self._settle(task, copy, lost=False, now=now, original=originals[task],
+                                 original_start=started.get(task),
+                                 projected=self._projected_runtime(queues, task, costs))
+                elif task in finished and (copy is None or copy[1].done()):
+                    # the original failed and there is no copy left to wait for
+                    winners[task] = originals[task]
+            if len(winners) == len(originals):
+                break
+            self._speculate(queues, originals, finished, winners, copies, started, rates, costs, now)
+            time.sleep(self.poll_interval)
+        self.elapsed = time.time() - start
+        self._measure_losers()
+        return [winners[task] for task in sorted(winners)]
+
+    def stats(self):
+        """ How often speculation fired and what it saved
+
+        `saved` sums the seconds between each copy's win and its original's
+        finish: measured with `cancel_losers=False`, projected otherwise
+        (`saved_projected` tells which). `per_task` has, for each copy that
+        won, when it won (`won_at`), how long the original had been running
+        (`original_elapsed`) and its projected total runtime
+        (`original_projected`).
+        """
+        wins = [s for s in self.speculations if s["winner"] == "copy"]
+        return {
+            "elapsed": self.elapsed,
+            "speculated": len(self.speculations),
+            "copy_wins": len(wins),
+            "saved": sum(s["saved"] for s in wins),
+            "saved_projected": self.cancel_losers,
+            "per_task": [dict((k, v) for k, v in s.items() if k != "original") for s in self.speculations],
+        }
+
+    @staticmethod
+    def _worker_of(queues, task):
+        for worker, tasks in queues.items():
+            if task in tasks:
+                return worker
+        return None
+
+    def _projected_runtime(self, queues, task, costs):
+        """ Runtime of a straggling original at the pace its worker kept on its earlier partitions """
+        paces = self._paces.get(self._worker_of(queues, task))
+        if not paces:
+            return None
+        return costs[task] * sum(duration for duration, _ in paces) / sum(cost for _, cost in paces)
+
+    def _start_times(self, queues, finished, start):
+        started = {}
+        for worker, tasks in queues.items():
+            previous = start
+            for task in tasks:
+                started[task] = previous
+                if task not in finished:
+                    break
+                previous = finished[task]
+        return started
+
+    def _speculate(self, queues, originals, finished, winners, copies, started, rates, costs, now):
+        if len(rates) < self.min_samples:
+            return
+        rate = sorted(rates)[len(rates) // 2]
+        busy = set(copies[task][0] for task in copies if task not in winners)
+        idle = [worker for worker, tasks in queues.items()
+                if worker not in busy and all(task in finished for task in tasks)]
+        if not idle:
+            return
+        lagging = []
+        for worker, tasks in queues.items():
+            running = [task for task in tasks if task not in finished][:1]
+            if not running or running[0] in copies:
+                continue
+            task = running[0]
+            elapsed = now - started[task]
+            expected = max(rate * costs[task], 1e-9)
+            if elapsed > self.min_elapsed and elapsed > self.slowdown * expected:
+                lagging.append((elapsed / expected, task))
+        for (_, task), worker in zip(sorted(lagging, reverse=True), idle):
+            copies[task] = (worker, self.launch(task, worker), now)
+
+    def _settle(self, task, copy, lost, now, original=None, original_start=None, projected=None):
+        worker, future, launched = copy
+        record = {"task": task, "worker": worker, "winner": "original" if lost else "copy",
+                  "copy_runtime": now - launched}
+        if lost:
+            if self.cancel_losers:
+                self.client.cancel([future])
+        else:
+            elapsed = now - original_start if original_start is not None else now - launched
+            record["won_at"] = now
+            record["original_elapsed"] = elapsed
+            # the original has run `elapsed` unfinished: it takes at least that long
+            record["original_projected"] = max(projected or 0.0, elapsed)
+            if self.cancel_losers:
+                self.client.cancel([original])
+                record["saved"] = record["original_projected"] - elapsed
+            else:
+                record["original"] = original
+                record["saved"] = None
+        self.speculations.append(record)
+
+    def _measure_losers(self):
+        pending = [s for s in self.speculations if s.get("saved", 0.0) is None]
+        while pending:
+            now = time.time()
+            for record in pending:
+                if record["original"].done():
+                    record["saved"] = now - record["won_at"]
+                    record["original_projected"] = record["original_elapsed"] + record["saved"]
+            pending = [s for s in pending if s["saved"] is None]
+            time.sleep(self.poll_interval)
+
+
+def _demo_task(cost, slow_worker):
+    from distributed import get_worker
+    delay = cost * (4 if get_worker().name == slow_worker else 1)
+    time.sleep(delay)
+    return delay
+
+
+if __name__ == '__main__':
+    from distributed import Client, LocalCluster
+    from planner import lpt_assignment
+
+    cluster = LocalCluster(n_workers=4, threads_per_worker=1, processes=True)
+    client = Client(cluster)
+    workers = sorted(client.scheduler_info()['workers'])
+    slow = client.scheduler_info()['workers'][workers[0]]['name']
+    costs = [1.0] * 16
+    assignment, _ = lpt_assignment(costs, workers)
+
+    def launch(task, worker):
+        return client.submit(_demo_task, costs[task], slow, workers=[worker], pure=False)
+
+    for speculate in (False, True):
+        # losers run to completion so that the saving is measured, not estimated
+        executor = SpeculativeExecutor(client, launch, min_elapsed=0.5, min_samples=2, poll_interval=0.1,
+                                       slowdown=1.5 if speculate else float("inf"), cancel_losers=False)
+        client.gather(executor.run(assignment, costs))
+        stats = executor.stats()
+        print("speculation %-3s makespan %.2fs, speculated %d, copy wins %d, saved %.2fs"
+              % ("on" if speculate else "off", stats["elapsed"],
+                 stats["speculated"], stats["copy_wins"], stats["saved"]))
+    client.close()
+    cluster.close()
@@ -0,0 +1,53 @@
+import os
+
+from autotune import resplit, worker_counts, write_config
+
+
+def write_split(path, loans, rows_per_loan=3):
+    with open(path, "w") as f:
+        for loan in loans:
+            for month in range(rows_per_loan):
+                f.write("%d|01/01/20%02d|%d\n" % (loan, month, loan * 10 + month))
+    return str(path)
+
+
+def loader_rows(paths):
+    """ What the loaders read: every split without its first line """
+    rows = []
+    for path in paths:
+        with open(path) as f:
+            rows += f.read().splitlines()[1:]
+    return rows
+
+
+def test_resplit_keeps_the_rows_the_loaders_read(tmp_path):
+    inputs = [write_split(tmp_path / ("Performance_2000Q1.txt_%d" % i), range(i * 40, i * 40 + 40))
+              for i in range(3)]
+    parts = resplit(inputs, 500, str(tmp_path / "parts"))
+    assert len(parts) > len(inputs)
+    assert loader_rows(parts) == loader_rows(inputs)
+
+
+def test_resplit_never_cuts_a_loan(tmp_path):
+    inputs = [write_split(tmp_path / "Performance_2000Q1.txt_0", range(50), rows_per_loan=7)]
+    parts = resplit(inputs, 300, str(tmp_path / "parts"))
+    loans = [set(row.split("|")[0] for row in loader_rows([part])) for part in parts]
+    for left, right in zip(loans, loans[1:]):
+        assert not left & right
+
+
+def test_worker_counts():
+    assert worker_counts(1) == (1,)
+    assert worker_counts(4) == (1, 2, 4)
+    assert worker_counts(6) == (1, 2, 4, 6)
+    assert worker_counts(16) == (1, 2, 4, 8, 16)
+
+
+def test_write_config_keeps_other_entries(tmp_path):
+    path = str(tmp_path / "dask.conf")
+    with open(path, "w") as f:
+        f.write("ARCH GPU\n\nNWORKERS 8\n")
+    write_config(path, {"nworkers": 4, "nthreads": 2, "split_size": 256 << 20})
+    with open(path) as f:
+        entries = dict(line.split() for line in f.read().split("\n") if line)
+    assert entries == {"ARCH": "GPU", "NWORKERS": "4", "NTHREADS": "2", "SPLIT_SIZE": str(256 << 20)}
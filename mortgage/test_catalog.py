@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from catalog import PartitionCatalog, iso_date, range_may_match, scan_split
+
+
+HEADER = "loan_id|monthly_reporting_period|servicer"
+
+
+def write_split(directory, name, rows):
+    path = directory / name
+    path.write_text("\n".join([HEADER] + ["%d|%s|X" % row for row in rows]) + "\n")
+    return str(path)
+
+
+@pytest.fixture
+def splits(tmp_path):
+    return [
+        write_split(tmp_path, "Performance_2000Q1_00", [(100, "01/01/2000"), (100, "02/01/2000"), (150, "03/01/2000")]),
+        write_split(tmp_path, "Performance_2000Q1_01", [(200, "01/01/2001"), (250, "06/01/2001")]),
+        # not sorted by loan_id
+        write_split(tmp_path, "Performance_2000Q1_02", [(400, "01/01/2002"), (300, "12/01/2002")]),
+        write_split(tmp_path, "Performance_2000Q1_03", []),
+    ]
+
+
+def test_scan_split(splits):
+    entry = scan_split(splits[2])
+    assert entry["rows"] == 2
+    assert entry["loan_id"] == [300, 400]
+    assert entry["monthly_reporting_period"] == ["2002-01-01", "2002-12-01"]
+    assert not entry["sorted"]
+    assert scan_split(splits[3])["loan_id"] == [None, None]
+
+
+@pytest.mark.parametrize("filters, expected", [
+    ([("loan_id", "==", 150)], [0]),
+    ([("loan_id", ">=", 200), ("loan_id", "<", 300)], [1]),
+    ([("loan_id", "in", [100, 350])], [0, 2]),
+    ([("monthly_reporting_period", ">=", "2001-06")], [1, 2]),
+    ([("monthly_reporting_period", "<=", "01/15/2000")], [0]),
+    # predicates on other columns cannot prune
+    ([("servicer", "==", "Y")], [0, 1, 2, 3]),
+    ([], [0, 1, 2, 3]),
+])
+def test_pruning(splits, filters, expected):
+    catalog = PartitionCatalog.build(splits, max_workers=2)
+    selected = catalog.select(splits, filters)
+    # the empty split matches no range predicate
+    assert selected == [splits[i] for i in expected if i != 3 or not any(
+        column in ("loan_id", "monthly_reporting_period") for column, _, _ in filters)]
+
+
+def test_saved_catalog_prunes_the_same(tmp_path, splits):
+    path = str(tmp_path / "_catalog.json")
+    PartitionCatalog.build(splits, max_workers=1).save(path)
+    catalog = PartitionCatalog.load(path)
+    assert catalog.select(splits, [("loan_id", ">", 260)]) == [splits[2]]
+
+
+def test_changed_split_is_opened_until_rescanned(splits):
+    catalog = PartitionCatalog.build(splits, max_workers=1)
+    with open(splits[0], "a") as f:
+        f.write("900|01/01/2010|X\n")
+    os.utime(splits[0], (1, 1))
+    assert catalog.entry(splits[0]) is None
+    assert catalog.may_match(splits[0], [("loan_id", "==", 123)])
+    catalog.update(splits, max_workers=1)
+    assert catalog.entry(splits[0])["loan_id"] == [100, 900]
+    assert not catalog.may_match(splits[0], [("loan_id", "==", 950)])
+
+
+def test_range_may_match_excluding_operators():
+    assert not range_may_match(5, 5, "!=", 5)
+    assert range_may_match(5, 6, "!=", 5)
+    assert not range_may_match(5, 5, "not in", [4, 5])
+    assert range_may_match(None, None, ">", 0) is False
+
+
+def test_iso_date():
+    assert iso_date("3/1/2000") == "2000-03-01"
+    assert iso_date("2000-03") == "2000-03-01"
+    assert iso_date("2000") == "2000-01-01"
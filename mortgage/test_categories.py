@@ -0,0 +1,52 @@
+import json
+import os
+
+from categories import CategoryRegistry
+
+
+def performance_file(path, servicers):
+    rows = ["%d|01/01/2000|%s|4.0|||||||||" % (i, servicer) for i, servicer in enumerate(servicers)]
+    path.write_text("header\n" + "\n".join(rows) + "\n")
+    return str(path)
+
+
+def test_codes_are_sorted_and_unseen_values_missing(tmp_path):
+    path = performance_file(tmp_path / "Performance_2000Q1.txt", ["WELLS", "BANK A", "WELLS", ""])
+    registry = CategoryRegistry.build([], [path], max_workers=1)
+    assert registry.codes("servicer") == {"BANK A": 0, "WELLS": 1}
+
+
+def test_saved_registry_covers_its_inputs_only(tmp_path):
+    first = performance_file(tmp_path / "Performance_2000Q1.txt", ["BANK B"])
+    second = performance_file(tmp_path / "Performance_2001Q1.txt", ["BANK A"])
+    path = str(tmp_path / "categories.json")
+    CategoryRegistry.build([], [first], max_workers=1).save(path)
+    registry = CategoryRegistry.load(path)
+    assert registry.covers([first])
+    assert not registry.covers([first, second])
+
+    registry.update([], [first, second], max_workers=1)
+    # the same codes as a build over both files
+    assert registry.categories == CategoryRegistry.build([], [first, second], max_workers=1).categories
+    assert registry.codes("servicer") == {"BANK A": 0, "BANK B": 1}
+    assert registry.covers([first, second])
+
+
+def test_changed_input_rebuilds(tmp_path):
+    path = performance_file(tmp_path / "Performance_2000Q1.txt", ["OLD BANK"])
+    registry = CategoryRegistry.build([], [path], max_workers=1)
+    performance_file(tmp_path / "Performance_2000Q1.txt", ["NEW BANK", "NEW BANK 2"])
+    os.utime(path, (1, 1))
+    assert not registry.covers([path])
+    registry.update([], [path], max_workers=1)
+    assert registry.categories["servicer"] == ["NEW BANK", "NEW BANK 2"]
+
+
+def test_registry_saved_without_inputs_covers_nothing(tmp_path):
+    path = performance_file(tmp_path / "Performance_2000Q1.txt", ["BANK A"])
+    saved = str(tmp_path / "categories.json")
+    with open(saved, "w") as f:
+        json.dump({"servicer": ["BANK A"]}, f)
+    registry = CategoryRegistry.load(saved)
+    assert registry.codes("servicer") == {"BANK A": 0}
+    assert not registry.covers([path])
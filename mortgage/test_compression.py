@@ -0,0 +1,111 @@
+import bz2
+import gzip
+import multiprocessing
+
+import pytest
+
+import compression
+from compression import MAGIC, decompress, find_members, iter_decompressed, read_input
+
+
+def lines(first, count):
+    return b"".join(b"%d|2000-01-01|%d\n" % (loan, loan * 7) for loan in range(first, first + count))
+
+
+def write_members(path, compress, parts):
+    with open(path, "wb") as f:
+        for part in parts:
+            f.write(compress(part))
+    return str(path)
+
+
+@pytest.mark.parametrize("suffix, compress", [
+    (".gz", gzip.compress),
+    (".bz2", bz2.compress),
+])
+def test_multi_member_round_trip(tmp_path, suffix, compress):
+    parts = [lines(i * 1000, 1000) for i in range(12)]
+    path = write_members(tmp_path / ("perf.txt" + suffix), compress, parts)
+    assert len(find_members(path, "gzip" if suffix == ".gz" else "bz2")) >= len(parts)
+    assert decompress(path) == b"".join(parts)
+    assert list(iter_decompressed(path, max_workers=2)) == parts
+    with read_input(path, max_workers=2) as stream:
+        assert stream.read() == b"".join(parts)
+
+
+def test_magic_inside_member_is_not_a_start(tmp_path):
+    # stored (level 0) members carry their text verbatim, magic bytes included
+    parts = [MAGIC["gzip"] * 50 + lines(i * 100, 100) for i in range(4)]
+    path = write_members(tmp_path / "perf.txt.gz", lambda part: gzip.compress(part, 0), parts)
+    assert len(find_members(path, "gzip")) > len(parts)
+    assert decompress(path, max_workers=3) == b"".join(parts)
+
+
+def test_single_member_streams_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(compression, "FEED_SIZE", 4096)
+    text = lines(0, 20000)
+    path = write_members(tmp_path / "perf.txt.gz", gzip.compress, [text])
+    chunks = list(iter_decompressed(path))
+    assert len(chunks) > 1
+    assert b"".join(chunks) == text
+
+
+def test_false_magic_in_a_single_member_is_not_decoded(tmp_path, monkeypatch):
+    monkeypatch.setattr(compression, "FEED_SIZE", 4096)
+    speculated = []
+    monkeypatch.setattr(compression, "_decode_member", lambda *args: speculated.append(args) or (None, None))
+    # a stored member is larger than FEED_SIZE and carries the planted magic verbatim
+    text = lines(0, 5000) + MAGIC["gzip"] + lines(5000, 5000)
+    path = write_members(tmp_path / "perf.txt.gz", lambda part: gzip.compress(part, 0), [text])
+    assert len(find_members(path, "gzip")) > 1
+    chunks = list(iter_decompressed(path, max_workers=4))
+    assert b"".join(chunks) == text
+    assert max(len(chunk) for chunk in chunks) <= 4096
+    assert not speculated
+
+
+def test_members_above_the_speculative_bound_are_streamed(tmp_path, monkeypatch):
+    monkeypatch.setattr(compression, "FEED_SIZE", 4096)
+    monkeypatch.setattr(compression, "SPECULATIVE_BYTES", 8192)
+    parts = [lines(i * 1000, 100 if i % 2 else 3000) for i in range(6)]
+    path = write_members(tmp_path / "perf.txt.gz", gzip.compress, parts)
+    chunks = list(iter_decompressed(path, max_workers=2))
+    assert b"".join(chunks) == b"".join(parts)
+    assert max(len(chunk) for chunk in chunks) < len(parts[0])
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / "perf.txt.gz"
+    path.write_bytes(b"")
+    assert decompress(str(path)) == b""
+
+
+def test_uncompressed_path_is_returned(tmp_path):
+    path = tmp_path / "perf.txt"
+    path.write_bytes(lines(0, 10))
+    assert read_input(str(path)) == str(path)
+
+
+def test_corrupt_member_raises(tmp_path):
+    parts = [gzip.compress(lines(i * 100, 100)) for i in range(3)]
+    path = tmp_path / "perf.txt.gz"
+    path.write_bytes(parts[0] + parts[1][:len(parts[1]) // 2] + parts[2])
+    with pytest.raises(IOError):
+        decompress(str(path), max_workers=2)
+
+
+def _read_in_daemon(path, queue):
+    with read_input(path, max_workers=2) as stream:
+        queue.put(len(stream.read()))
+
+
+def test_reads_inside_daemonic_process(tmp_path):
+    # Dask worker processes are daemonic and cannot start process pools
+    parts = [lines(i * 1000, 1000) for i in range(4)]
+    path = write_members(tmp_path / "perf.txt.gz", gzip.compress, parts)
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_read_in_daemon, args=(path, queue), daemon=True)
+    process.start()
+    process.join(60)
+    assert process.exitcode == 0
+    assert queue.get(timeout=5) == len(b"".join(parts))
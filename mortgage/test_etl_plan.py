@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+import etl_plan
+from etl_plan import (CudfEngine, assign, binary, cast, col, execute, fill, fill_nulls, join, lit, mortgage_plan,
+                      nullable_of, optimize, project, scan)
+
+
+class PandasEngine(CudfEngine):
+    """ `CudfEngine` with the few cudf-only calls swapped for pandas ones """
+
+    def groupby_agg(self, params, args, sources, owned):
+        aggs = dict((name, (column, function)) for column, function, name in params["aggs"])
+        return args[0].groupby(list(params["by"]), as_index=False).agg(**aggs)
+
+    def join(self, params, args, sources, owned):
+        return args[0].merge(args[1], how=params["how"], on=list(params["on"]))
+
+    def drop(self, params, args, sources, owned):
+        return args[0].drop(columns=list(params["columns"]))
+
+    def concat(self, params, args, sources, owned):
+        return pd.concat(args, ignore_index=True)
+
+    def evaluate(self, df, expr):
+        if expr[0] == "floor":
+            return np.floor(self.evaluate(df, expr[1]))
+        return CudfEngine.evaluate(self, df, expr)
+
+
+def mortgage_sources(loans=40, months=30, seed=0):
+    random = np.random.RandomState(seed)
+    loan_id = np.repeat(np.arange(loans), months)
+    period = np.tile(pd.date_range("2000-01-01", periods=months, freq="MS").values, loans)
+    status = random.choice([0, 0, 0, 1, 2, 3, 4, 7], len(loan_id)).astype("float64")
+    status[random.rand(len(loan_id)) < 0.05] = np.nan
+    perf = pd.DataFrame({"loan_id": loan_id, "monthly_reporting_period": period,
+                         "current_loan_delinquency_status": status,
+                         "current_actual_upb": random.choice([0.0, 1000.0, 2500.0], len(loan_id)),
+                         "interest_rate": random.rand(len(loan_id))})
+    acq = pd.DataFrame({"loan_id": np.arange(loans + 5), "orig_channel": random.randint(0, 3, loans + 5)})
+    return perf, acq
+
+
+def run(plan, perf, acq):
+    result = execute(plan, {"perf": perf.copy(), "acq": acq.copy()}, engine=PandasEngine())
+    result = result[sorted(result.columns)]
+    return result.sort_values(list(result.columns)).reset_index(drop=True)
+
+
+def test_optimized_mortgage_plan_gives_the_same_frame():
+    perf, acq = mortgage_sources()
+    plan = mortgage_plan()
+    optimized, report = optimize(plan, {"perf": len(perf), "acq": len(acq)})
+    assert report["merged"] and report["fused"]
+    expected = run(plan, perf, acq)
+    assert len(expected) == len(perf)
+    pd.testing.assert_frame_equal(run(optimized, perf, acq), expected, check_dtype=False)
+
+
+def test_lossy_cast_before_a_later_cast_is_kept():
+    df = pd.DataFrame({"loan_id": [1, 2, 3], "rate": [1.5, -2.7, 3.9]})
+    plan = cast(cast(scan("df", ["loan_id", "rate"]), [("rate", "int32")]), [("rate", "float64")])
+    optimized, _ = optimize(plan)
+    assert optimized.op == "fill_cast" and len(optimized.params["steps"]) == 2
+    result = execute(optimized, {"df": df}, engine=PandasEngine())
+    assert list(result["rate"]) == [1.0, -2.0, 3.0]
+
+
+def test_only_no_wider_integer_casts_override():
+    steps = [("cast", "a", "int32"), ("cast", "a", "int16"),
+             ("cast", "b", "int8"), ("cast", "b", "int64"),
+             ("cast", "c", "float64"), ("cast", "c", "float64")]
+    assert etl_plan._drop_overridden_casts(steps) == [("cast", "a", "int16"), ("cast", "b", "int8"),
+                                                      ("cast", "b", "int64"), ("cast", "c", "float64")]
+
+
+def test_nullable_columns_follow_joins_fills_and_assigns():
+    left = fill_nulls(scan("perf", ["loan_id", "upb"]))
+    right = project(scan("acq"), ["loan_id", "seller"])
+    assert nullable_of(left) == set()
+    joined = join(left, right, ["loan_id"])
+    # a left join only introduces nulls on its right side, never on the keys
+    assert nullable_of(joined) == set(["seller"])
+    assert nullable_of(assign(joined, "upb_12", col("upb"))) == set(["seller"])
+    assert nullable_of(assign(joined, "seller_2", col("seller"))) == set(["seller", "seller_2"])
+    assert nullable_of(fill(joined, [("seller", -1)])) == set()
+    assert nullable_of(join(left, scan("acq"), ["loan_id"])) is None
+    assert nullable_of(scan("perf")) is None
+
+
+def test_left_join_chain_joins_the_smallest_right_side_first():
+    base = scan("perf", ["loan_id", "month"])
+    big = scan("big", ["loan_id", "x"])
+    small = scan("small", ["loan_id", "y"])
+    report = {"joins": 0}
+    plan = join(join(base, big, ["loan_id"]), small, ["loan_id"])
+    reordered = etl_plan._reorder_joins(plan, report, {"perf": 100, "big": 50, "small": 5})
+    assert report["joins"] == 1
+    assert reordered.inputs[1].params["source"] == "big"
+    assert reordered.inputs[0].inputs[1].params["source"] == "small"
+
+    # a key that only the first right side provides pins the order
+    pinned = join(join(base, big, ["loan_id"]), scan("small", ["x", "y"]), ["x"])
+    assert etl_plan._reorder_joins(pinned, report, {"perf": 100, "big": 50, "small": 5}).key() == pinned.key()
+    assert report["joins"] == 1
+
+
+def test_shared_subexpressions_run_once():
+    months = binary("+", binary("*", col("year"), lit(12)), col("month"))
+    plan = join(assign(scan("perf", ["loan_id", "year", "month"]), "m", months),
+                assign(scan("perf", ["loan_id", "year", "month"]), "m", months), ["loan_id"], how="inner")
+    optimized, report = optimize(plan)
+    assert report["merged"] >= 1
+    assert optimized.inputs[0] is optimized.inputs[1]
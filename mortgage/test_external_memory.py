@@ -0,0 +1,26 @@
+import numpy as np
+
+from external_memory import write_libsvm
+
+
+def test_libsvm_round_trips_float32(tmp_path):
+    rng = np.random.RandomState(0)
+    features = rng.uniform(0, 1e6, size=(200, 5)).astype(np.float32)
+    features[:, 0] = 123456.78
+    features[:, 1] = 999999999
+    features[:5, 2] = 0
+    labels = (rng.uniform(size=200) < 0.1).astype(np.float32)
+    batches = [(features[:120], labels[:120]), (features[120:], labels[120:])]
+    path = str(tmp_path / "train.libsvm")
+    assert write_libsvm(batches, path) == 200
+
+    read_labels, read_features = [], []
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            read_labels.append(float(fields[0]))
+            columns = [field.split(":") for field in fields[1:]]
+            assert [int(index) for index, _ in columns] == list(range(5))
+            read_features.append([float(value) for _, value in columns])
+    np.testing.assert_array_equal(np.array(read_features, dtype=np.float32), features)
+    np.testing.assert_array_equal(np.array(read_labels, dtype=np.float32), labels)
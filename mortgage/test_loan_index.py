@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+import pytest
+
+from loan_index import LoanIndex, LoanLookup, scan_runs
+
+
+def write(path, lines, newline_at_end=True):
+    path.write_text("\n".join(lines) + ("\n" if newline_at_end else ""))
+    return str(path)
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    performance = [
+        write(tmp_path / "Performance_2000Q1.txt",
+              ["loan_id|period|rate"] + ["%d|01/01/2000|%d.5" % (loan_id, month)
+                                         for loan_id in (100, 200, 300) for month in range(4)]),
+        # unsorted, and without a newline at the end
+        write(tmp_path / "Performance_2000Q2.txt",
+              ["200|04/01/2000|1.0", "100|04/01/2000|2.0", "200|05/01/2000|3.0"], newline_at_end=False),
+    ]
+    acquisition = [write(tmp_path / "Acquisition_2000Q1.txt", ["100|R|BANK A", "200|C|BANK B"])]
+    return performance, acquisition
+
+
+def test_histories(tmp_path, inputs):
+    performance, acquisition = inputs
+    lookup = LoanLookup.build(str(tmp_path / "index"), performance, acquisition, max_workers=2)
+    lookup.close()
+    lookup = LoanLookup(str(tmp_path / "index"))
+    try:
+        acq, perf = lookup.history(200)
+        assert acq == "200|C|BANK B"
+        assert perf == ["200|01/01/2000|%d.5" % month for month in range(4)] + \
+            ["200|04/01/2000|1.0", "200|05/01/2000|3.0"]
+        histories = lookup.histories([300, 999])
+        assert histories[300][0] is None and len(histories[300][1]) == 4
+        assert histories[999] == (None, [])
+    finally:
+        lookup.close()
+
+
+def test_build_without_acquisition_files(tmp_path, inputs):
+    lookup = LoanLookup.build(str(tmp_path / "index"), inputs[0], max_workers=1)
+    assert lookup.acquisition is None
+    assert lookup.history(100)[0] is None
+    lookup.close()
+
+
+def test_changed_file_is_refused(tmp_path, inputs):
+    performance, _ = inputs
+    LoanIndex.build(performance, max_workers=1).save(str(tmp_path / "index"))
+    with open(performance[1], "a") as f:
+        f.write("\n400|06/01/2000|1.0")
+    index = LoanIndex.load(str(tmp_path / "index"))
+    with pytest.raises(ValueError, match="changed since it was indexed"):
+        index.lookup([100])
+    # loan 300 is only in the unchanged file
+    assert len(index.lookup([300])[300]) == 4
+    index.close()
+
+
+@pytest.mark.parametrize("window_bytes", [1, 7, 64, 1 << 20])
+def test_windows_do_not_change_the_runs(tmp_path, window_bytes):
+    rng = np.random.RandomState(0)
+    lines = ["loan_id|x"] + ["%d|%s" % (loan_id, "y" * rng.randint(0, 30))
+                             for loan_id in np.repeat(rng.randint(1, 50, 200), rng.randint(1, 5, 200))]
+    lines[50] = "not a loan|x"
+    lines[60] = ""
+    path = write(tmp_path / "Performance_2001Q1.txt", lines, newline_at_end=False)
+    loan_ids, offsets, lengths = scan_runs(path, window_bytes=window_bytes)
+    expected = scan_runs(path, window_bytes=os.path.getsize(path))
+    for got, want in zip((loan_ids, offsets, lengths), expected):
+        np.testing.assert_array_equal(got, want)
+    with open(path, "rb") as f:
+        data = f.read()
+    # every run holds whole lines of its loan
+    for loan_id, offset, length in zip(loan_ids, offsets, lengths):
+        for line in data[offset:offset + length].decode().splitlines():
+            assert line.split("|")[0] == str(loan_id)
+    assert sum(lengths) == sum(len(line) + 1 for line in lines[1:] if line[:1].isdigit()) - 1
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+from loan_kernels import groupby_features, loan_features, synthetic_history, validate
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_kernel_matches_the_groupbys(seed):
+    assert validate(nloans=2000, seed=seed) > 0
+
+
+def test_row_order_does_not_matter():
+    history = synthetic_history(500, seed=3)
+    order = np.argsort(history[0], kind="stable")
+    shuffled = loan_features(*history)
+    sorted_rows = loan_features(*[column[order] for column in history])
+    for name in shuffled:
+        np.testing.assert_array_equal(shuffled[name][order], sorted_rows[name])
+    assert set(shuffled) == set(groupby_features(*history))
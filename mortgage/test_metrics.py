@@ -0,0 +1,130 @@
+import socket
+import sys
+import types
+from collections import namedtuple
+from urllib.request import urlopen
+
+import pytest
+
+import metrics
+from metrics import MetricsServer, WorkerMetrics, prometheus_text
+
+
+class FakeClient(object):
+    def __init__(self, workers):
+        self.workers = workers
+
+    def run(self, func):
+        return dict((address, func()) for address in self.workers)
+
+
+def _families(text):
+    """ Parses the exposition text into {family: (type, help, [sample lines])} """
+    families = {}
+    current = None
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            current = line.split()[2]
+            families[current] = [None, line.split(" ", 3)[3], []]
+        elif line.startswith("# TYPE "):
+            name, kind = line.split()[2:4]
+            assert name == current
+            families[name][0] = kind
+        else:
+            name = line.split("{")[0].split(" ")[0]
+            assert name == current, "sample %r outside its family" % line
+            families[name][2].append(line)
+    return families
+
+
+def test_exposition_is_typed_and_sums_only_counters_and_rates():
+    workers = {}
+    for address, rows in (("tcp://a:1", 100), ("tcp://b:2", 300)):
+        worker = WorkerMetrics()
+        worker.partition_done(rows, bytes_read=10 * rows)
+        workers[address] = worker.snapshot()
+    text = prometheus_text(workers, {"phase": "etl", "phase_seconds": 1.5})
+    families = _families(text)
+
+    for name, (kind, help_text, samples) in families.items():
+        assert kind in ("counter", "gauge") and help_text and samples
+        assert (kind == "counter") == name.endswith("_total")
+    assert "mortgage_cluster_rows_total 400" in text
+    assert "mortgage_cluster_partitions_done_total 2" in text
+    assert 'mortgage_rows_total{worker="tcp://b:2"} 300' in text
+    assert 'mortgage_phase_seconds{phase="etl"} 1.5' in text
+    # sums of memory or of stage times mean nothing
+    assert not [name for name in families if "cluster" in name and ("rss" in name or "stage" in name)]
+
+
+def test_missing_rss_is_rendered_as_nan():
+    snapshot = WorkerMetrics().snapshot()
+    snapshot["rss_bytes"] = None
+    text = prometheus_text({"w": snapshot}, {"phase": "etl", "phase_seconds": 0.0})
+    assert 'mortgage_rss_bytes{worker="w"} NaN' in text
+
+
+def test_rate_uses_elapsed_time_before_the_window_fills(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(metrics.time, "time", lambda: now[0])
+    worker = WorkerMetrics()
+    now[0] += 10.0
+    worker.partition_done(500)
+    assert worker.snapshot()["rows_per_second"] == pytest.approx(50.0)
+    now[0] += 200.0
+    worker.partition_done(600)
+    assert worker.snapshot()["rows_per_second"] == pytest.approx(600 / metrics.RATE_WINDOW)
+
+
+def test_rss_is_current_not_peak():
+    before = metrics.rss_bytes()
+    assert before is None or before > 0
+    buffer = b"\x01" * (64 << 20)
+    grown = metrics.rss_bytes()
+    del buffer
+    if before is not None:
+        assert grown > before
+        assert metrics.rss_bytes() < grown
+
+
+def _in_worker(monkeypatch, data):
+    worker = types.SimpleNamespace(data=data, local_directory="/")
+    monkeypatch.setitem(sys.modules, "distributed", types.SimpleNamespace(get_worker=lambda: worker))
+
+
+def test_spilled_bytes_come_from_the_spill_buffer(monkeypatch):
+    assert metrics.spilled_bytes() == 0
+    spilled_size = namedtuple("SpilledSize", "memory disk")
+    _in_worker(monkeypatch, types.SimpleNamespace(spilled_total=spilled_size(100, 70)))
+    assert metrics.spilled_bytes() == 70
+    _in_worker(monkeypatch, types.SimpleNamespace(slow=types.SimpleNamespace(total_weight=1234)))
+    assert metrics.spilled_bytes() == 1234
+    # a plain dict, or dask-cuda's buffer, keeps no spilled sizes
+    _in_worker(monkeypatch, {})
+    assert metrics.spilled_bytes() == 0
+
+
+def test_endpoint_serves_the_polled_metrics():
+    server = MetricsServer(FakeClient(["tcp://a:1"]), port=0, interval=60).start()
+    try:
+        metrics.partition_done(42)
+        server.poll()
+        text = urlopen("http://127.0.0.1:%d/metrics" % server.port).read().decode()
+    finally:
+        server.stop()
+    assert 'mortgage_partitions_done_total{worker="tcp://a:1"}' in text
+    assert _families(text)["mortgage_cluster_rows_total"][0] == "counter"
+
+
+def test_taken_port_disables_the_endpoint_only(capsys):
+    taken = socket.socket()
+    taken.bind(("127.0.0.1", 0))
+    taken.listen(1)
+    try:
+        server = MetricsServer(FakeClient(["tcp://a:1"]), port=taken.getsockname()[1], interval=60).start()
+        assert server.port is None
+        assert server.poll()["workers"]
+        server.stop()
+    finally:
+        taken.close()
+    assert "metrics endpoint disabled" in capsys.readouterr().out
@@ -0,0 +1,20 @@
+from planner import compare, lpt_assignment, submission_order
+
+
+def test_lpt_balances_largest_first():
+    costs = [7, 5, 4, 3, 3, 2]
+    assignment, loads = lpt_assignment(costs, ["w0", "w1"])
+    assert sorted(task for tasks in assignment.values() for task in tasks) == list(range(len(costs)))
+    assert sorted(loads.values()) == [12, 12]
+    assert compare(costs, 2)["largest first (LPT)"] == 12
+
+
+def test_allowed_workers_hold_their_tasks():
+    costs = [10, 1, 1, 1]
+    assignment, loads = lpt_assignment(costs, ["w0", "w1", "w2"], allowed={1: {"w0"}, 2: {"w0"}})
+    assert {1, 2} <= set(assignment["w0"])
+    assert loads["w0"] == sum(costs[task] for task in assignment["w0"])
+
+
+def test_submission_order_interleaves_workers():
+    assert submission_order({"w0": [0, 2], "w1": [1]}) == [(0, "w0"), (1, "w1"), (2, "w0")]
@@ -0,0 +1,43 @@
+import pytest
+
+from prefetch import Prefetcher
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for i in range(3):
+        path = tmp_path / ("Performance_2000Q%d.txt" % (i + 1))
+        path.write_bytes(b"%d|x\n" % i * 1000)
+        paths.append(str(path))
+    return paths
+
+
+@pytest.mark.parametrize("mode", ["pagecache", "memory"])
+def test_scheduled_files_are_hits(files, mode):
+    prefetcher = Prefetcher(depth=2, mode=mode)
+    prefetcher.schedule(files)
+    for path in files:
+        data = prefetcher.acquire(path)
+        if mode == "memory":
+            with open(path, "rb") as f:
+                assert data.read() == f.read()
+        else:
+            assert data == path
+        prefetcher.release(path)
+    stats = prefetcher.stats()
+    assert stats["misses"] == 0
+    assert stats["hits"] + stats["partial_hits"] == len(files)
+    prefetcher.close()
+
+
+@pytest.mark.parametrize("mode", ["pagecache", "memory"])
+def test_miss_returns_the_path_unread(files, mode, monkeypatch):
+    prefetcher = Prefetcher(mode=mode)
+    monkeypatch.setattr(prefetcher, "_read", lambda path: pytest.fail("a miss must not read %s" % path))
+    assert prefetcher.acquire(files[0]) == files[0]
+    prefetcher.release(files[0])
+    stats = prefetcher.stats()
+    assert stats["misses"] == 1
+    assert prefetcher._buffered_bytes == 0
+    prefetcher.close()
@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+import pytest
+
+from result_cache import ResultCache, cached_call, cached_entries
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(str(tmp_path / "cache"))
+
+
+def matrix(value):
+    return np.full((100, 4), value, dtype=np.float32), np.zeros(100, dtype=np.float32)
+
+
+def test_key_follows_inputs_code_and_params(tmp_path, cache):
+    path = tmp_path / "Performance_2000Q1.txt"
+    path.write_text("1|a\n")
+    key = cache.key([str(path)], ["def f(): pass"], {"sample_percent": 100})
+    assert key == cache.key([str(path)], ["def f(): pass"], {"sample_percent": 100})
+    assert key != cache.key([str(path)], ["def f(): return 1"], {"sample_percent": 100})
+    assert key != cache.key([str(path)], ["def f(): pass"], {"sample_percent": 10})
+    path.write_text("1|a\n2|b\n")
+    assert key != cache.key([str(path)], ["def f(): pass"], {"sample_percent": 100})
+
+
+def test_cached_call_computes_once(cache):
+    calls = []
+
+    def etl(value):
+        calls.append(value)
+        return matrix(value)
+
+    first = cached_call(cache, "a", etl, 1.0)
+    second = cached_call(cache, "a", etl, 2.0)
+    assert calls == [1.0]
+    np.testing.assert_array_equal(first[0], second[0])
+
+
+def test_evicted_entry_is_recomputed(cache):
+    cache.store("a", matrix(1.0))
+    assert cached_entries(cache, ["a", "b"]).keys() == {"a"}
+    # another worker evicts it between the driver's lookup and the read
+    os.remove(os.path.join(cache.directory, "a.pkl"))
+    with pytest.raises(KeyError):
+        cache.load("a")
+    result = cached_call(cache, "a", matrix, 3.0)
+    assert result[0][0, 0] == 3.0
+    assert cached_entries(cache, ["a"]).keys() == {"a"}
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    for i, key in enumerate("abc"):
+        cache.store(key, matrix(i))
+        os.utime(os.path.join(cache.directory, key + ".pkl"), (i, i))
+    cache.max_bytes = 2.5 * cache.sizes("a")["a"]
+    cache.load("a")
+    cache.store("d", matrix(3))
+    assert set(cache.sizes("abcd")) == {"a", "d"}
+
+
+def test_pinned_entries_outlive_the_size_bound(cache):
+    cache.pin(["a", "b"])
+    for i, key in enumerate("abc"):
+        cache.store(key, matrix(i))
+        os.utime(os.path.join(cache.directory, key + ".pkl"), (i, i))
+    cache.max_bytes = cache.sizes("a")["a"]
+    cache.store("d", matrix(3))
+    # only the unpinned entries compete for the bound
+    assert set(cache.sizes("abcd")) == {"a", "b", "d"}
+    cache.unpin(["a", "b"])
+    assert set(cache.sizes("abcd")) == {"d"}
+    assert not [name for name in os.listdir(cache.directory) if name.endswith(".pin")]
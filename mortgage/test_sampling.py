@@ -0,0 +1,36 @@
+import random
+
+import pytest
+
+from sampling import is_sampled_loan, sample_threshold
+from validation import is_validation_loan
+
+
+@pytest.fixture(scope="module")
+def loans():
+    rng = random.Random(0)
+    return [rng.randrange(100000000000, 999999999999) for _ in range(200000)]
+
+
+@pytest.mark.parametrize("percent", [1, 10, 50])
+def test_kept_share(loans, percent):
+    kept = sum(1 for loan in loans if is_sampled_loan(loan, percent))
+    assert kept == pytest.approx(len(loans) * percent / 100.0, rel=0.05)
+
+
+def test_validation_share_of_the_sample(loans):
+    sampled = [loan for loan in loans if is_sampled_loan(loan, 10)]
+    held_out = sum(1 for loan in sampled if is_validation_loan(loan, 5))
+    assert held_out == pytest.approx(len(sampled) * 0.05, rel=0.1)
+
+
+def test_samples_are_nested(loans):
+    small = set(loan for loan in loans if is_sampled_loan(loan, 1))
+    assert small <= set(loan for loan in loans if is_sampled_loan(loan, 10))
+    assert all(is_sampled_loan(loan, 100) for loan in loans[:1000])
+
+
+@pytest.mark.parametrize("percent", [0, -1, 100.5])
+def test_percent_out_of_range(percent):
+    with pytest.raises(ValueError):
+        sample_threshold(percent)
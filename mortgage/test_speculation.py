@@ -0,0 +1,123 @@
+import time
+
+import pytest
+
+from speculation import SpeculativeExecutor
+
+
+class FakeFuture(object):
+    def __init__(self, finish_at):
+        self.finish_at = finish_at
+        self.cancelled = False
+
+    def done(self):
+        return self.cancelled or time.time() >= self.finish_at
+
+    @property
+    def status(self):
+        if self.cancelled:
+            return "cancelled"
+        return "finished" if self.done() else "pending"
+
+
+class FakeClient(object):
+    """ Workers run their tasks one after the other; `durations` maps (task, worker) to seconds """
+
+    def __init__(self, durations):
+        self.durations = durations
+        self.available = {}
+        self.launched = []
+        self.cancelled = []
+
+    def launch(self, task, worker):
+        start = max(time.time(), self.available.get(worker, 0.0))
+        future = FakeFuture(start + self.durations(task, worker))
+        self.available[worker] = future.finish_at
+        self.launched.append((task, worker, future))
+        return future
+
+    def cancel(self, futures):
+        for future in futures:
+            future.cancelled = True
+            self.cancelled.append(future)
+
+
+ASSIGNMENT = {"fast": [0, 2, 4], "slow": [1, 3]}
+COSTS = [1.0] * 5
+
+
+def run(durations, cancel_losers=True, costs=COSTS):
+    client = FakeClient(durations)
+    executor = SpeculativeExecutor(client, client.launch, slowdown=2.0, min_elapsed=0.05, min_samples=2,
+                                   poll_interval=0.005, cancel_losers=cancel_losers)
+    results = executor.run(ASSIGNMENT, costs)
+    return client, executor, results
+
+
+def straggler(task, worker):
+    # the slow worker keeps a steady 3x pace, and then its last partition hangs
+    if worker == "slow":
+        return 1.0 if task == 3 else 0.06
+    return 0.02
+
+
+def test_copy_wins_and_cancels_the_original():
+    client, executor, results = run(straggler)
+    stats = executor.stats()
+    assert stats["speculated"] == 1 and stats["copy_wins"] == 1
+    copy = [future for task, worker, future in client.launched if task == 3 and worker == "fast"][0]
+    assert results[3] is copy
+    original = [future for task, worker, future in client.launched if task == 3 and worker == "slow"][0]
+    assert original in client.cancelled
+    record = stats["per_task"][0]
+    # projected at the worker's pace on partition 1, never below what it already ran
+    assert record["original_projected"] == pytest.approx(max(0.06, record["original_elapsed"]))
+    assert stats["saved_projected"] and stats["saved"] == pytest.approx(sum(
+        r["original_projected"] - r["original_elapsed"] for r in stats["per_task"]))
+
+
+def test_saving_is_projected_at_the_worker_pace():
+    # partition 1 is small and too short to speculate on, but shows the slow worker's pace
+    costs = [1.0, 0.2, 1.0, 1.0, 1.0]
+
+    def durations(task, worker):
+        if worker == "slow":
+            return 0.045 if task == 1 else 5.0 * costs[task]
+        return 0.005
+
+    client, executor, results = run(durations, costs=costs)
+    record = executor.stats()["per_task"][0]
+    assert record["task"] == 3 and record["winner"] == "copy"
+    assert record["original_projected"] == pytest.approx(0.045 / 0.2, rel=0.2)
+    assert record["saved"] == pytest.approx(record["original_projected"] - record["original_elapsed"])
+    assert record["saved"] > 0.1
+
+
+def test_original_wins_and_cancels_the_copy():
+    def durations(task, worker):
+        if task == 3 and worker == "fast":
+            return 5.0
+        return 0.3 if (task, worker) == (3, "slow") else 0.02
+    client, executor, results = run(durations)
+    stats = executor.stats()
+    assert stats["speculated"] == 1 and stats["copy_wins"] == 0 and stats["saved"] == 0
+    assert results[3] is [future for task, worker, future in client.launched if (task, worker) == (3, "slow")][0]
+    assert len(client.cancelled) == 1 and client.cancelled[0] is [
+        future for task, worker, future in client.launched if (task, worker) == (3, "fast")][0]
+
+
+def test_saving_is_measured_when_losers_run_to_completion():
+    client, executor, results = run(straggler, cancel_losers=False)
+    stats = executor.stats()
+    assert client.cancelled == []
+    assert stats["copy_wins"] == 1 and not stats["saved_projected"]
+    record = stats["per_task"][0]
+    original = [future for task, worker, future in client.launched if (task, worker) == (3, "slow")][0]
+    assert record["saved"] == pytest.approx(original.finish_at - record["won_at"], abs=0.05)
+    assert record["saved"] > 0.5
+
+
+def test_no_speculation_without_stragglers():
+    client, executor, results = run(lambda task, worker: 0.02)
+    assert executor.stats()["speculated"] == 0
+    assert len(results) == len(COSTS) and client.cancelled == []
@@ -0,0 +1,25 @@
+from validation import EarlyStopping, is_validation_loan, train_with_early_stopping
+
+
+def test_best_booster_is_returned_not_the_last():
+    # the booster is the list of rounds trained; the score is lowest after 10 rounds
+    scores = {5: 0.5, 10: 0.3, 15: 0.4, 20: 0.45}
+
+    def train_chunk(booster, rounds):
+        booster = booster if booster is not None else []
+        # trains in place, like a booster continued by the next chunk
+        booster.extend(range(len(booster), len(booster) + rounds))
+        return booster
+
+    booster, report = train_with_early_stopping(train_chunk, lambda booster: scores[len(booster)], 100,
+                                                eval_every=5, stopper=EarlyStopping(patience=10), log=None)
+    assert len(booster) == 10
+    assert report["rounds"] == 20
+    assert report["best_round"] == 10
+    assert report["best_score"] == 0.3
+    assert report["rounds_saved"] == 80
+
+
+def test_validation_share():
+    held_out = sum(is_validation_loan(loan_id, 5) for loan_id in range(100000000000, 100000100000))
+    assert 4000 < held_out < 6000
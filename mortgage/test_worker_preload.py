@@ -0,0 +1,14 @@
+import sys
+
+import worker_preload
+
+
+def test_cpu_worker_skips_the_cudf_steps(monkeypatch):
+    monkeypatch.setattr(worker_preload, "_timings", worker_preload.OrderedDict())
+    monkeypatch.setitem(sys.modules, "cudf", None)
+    timings = worker_preload.warm_up()
+    assert "import cudf (missing)" in timings
+    assert "import numpy" in timings
+    assert "rmm pool" not in timings and "csv parser" not in timings
+    assert timings["total"] >= 0
+    assert worker_preload.startup_report() == timings
@@ -1,76 +1,20 @@
-import subprocess
+import os
+import sys
 
-dask_conf_path = "../utils/dask.conf"
-with open(dask_conf_path, "r") as file:
-    dask_conf = file.read()
-
-_dask_conf = dask_conf.split("\n")
-dask_conf = list()
-for i, line in enumerate(_dask_conf):
-    line = line.split()
-    if 0 < len(line):
-        dask_conf.append(line)
-
-cmd = "bash ../utils/dask-setup.sh 0"
-
-print(cmd)
-
-process = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE)
-output, error = process.communicate()
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from dask_launcher import ClusterLauncher, read_config
 
-cmd = "hostname --all-ip-addresses"
-process = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE)
-output, error = process.communicate()
-IPADDR = str(output.decode()).split()[0]
-
-ENVNAME = None
-ARCH = None
-NWORKERS = None
-DASK_SCHED_PORT = None
-DASK_SCHED_BOKEH_PORT = None
-DASK_WORKER_BOKEH_PORT = None
-MASTER_IPADDR = None
-WHOAMI = None
-LOG = None
-
-for line in dask_conf:
-    if line[0] == "ENVNAME":
-        ENVNAME = line[1]
-    if line[0] == "ARCH":
-        ARCH = line[1]
-    if line[0] == "NWORKERS":
-        NWORKERS = line[1]
-    if line[0] == "DASK_SCHED_PORT":
-        DASK_SCHED_PORT = line[1]
-    if line[0] == "DASK_SCHED_BOKEH_PORT":
-        DASK_SCHED_BOKEH_PORT = line[1]
-    if line[0] == "DASK_WORKER_BOKEH_PORT":
-        DASK_WORKER_BOKEH_PORT = line[1]
-    if line[1] == "MASTER":
-        MASTER_IPADDR = line[0]
-    if line[0] == IPADDR:
-        WHOAMI = line[1]
-    if line[0] == "LOG":
-        LOG = line[1]
-
-cmd = "bash ../utils/dask-setup.sh " + str(ENVNAME)
-cmd = cmd + " " + str(ARCH)
-cmd = cmd + " " + str(NWORKERS)
-cmd = cmd + " " + str(DASK_SCHED_PORT)
-cmd = cmd + " " + str(DASK_SCHED_BOKEH_PORT)
-cmd = cmd + " " + str(DASK_WORKER_BOKEH_PORT)
-cmd = cmd + " " + str(MASTER_IPADDR)
-cmd = cmd + " " + str(WHOAMI)
-if LOG != None:
-    cmd = cmd + " " + str(LOG)
+dask_conf_path = "../utils/dask.conf"
 
-print(cmd)
+launcher = ClusterLauncher(read_config(dask_conf_path))
 
-process = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE)
-output, error = process.communicate()
+# shut down whatever this node started last time
+stopped = launcher.stop()
+if stopped:
+    print("shut down %d process(es) of the previous cluster" % stopped)
 
-cmd = "screen -list"
+elapsed = launcher.start()
 
-process = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE)
-output, error = process.communicate()
-print(output.decode())
\ No newline at end of file
+print("%s: %d %s worker(s) connected to %s, ready in %.1fs"
+      % (launcher.role, launcher.nworkers, launcher.arch, launcher.scheduler_address, elapsed))
+print("logs and pid file in " + os.path.abspath(launcher.local_dir))
@@ -0,0 +1,315 @@
+"""Python launcher for a Dask cluster described by dask.conf.
+
+Replaces the screen-based `dask-setup.sh` flow: the scheduler and all of
+this node's workers are started concurrently as child processes, the
+launcher polls the scheduler until it reports the workers instead of
+sleeping, and teardown signals the recorded process groups instead of
+scraping `screen -list`.
+
+    python dask_launcher.py start [--conf dask.conf]
+    python dask_launcher.py stop  [--conf dask.conf]
+"""
+import argparse
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from numa_topology import numa_nodes, plan_workers, thread_environment
+
+
+ENVIRONMENT = {
+    "NCCL_P2P_DISABLE": "1",
+    "DASK_DISTRIBUTED__SCHEDULER__WORK_STEALING": "False",
+    "DASK_DISTRIBUTED__SCHEDULER__BANDWIDTH": "1",
+}
+
+
+def read_config(path):
+    """ Parses dask.conf
+
+    Returns
+    -------
+    dict with the keyword entries, plus "MASTER_IPADDR" and "ROLES"
+    (ip address -> MASTER/WORKER)
+    """
+    config = {"ROLES": {}}
+    with open(path, "r") as f:
+        for line in f:
+            line = line.split()
+            if len(line) < 2:
+                continue
+            if line[1] in ("MASTER", "WORKER"):
+                config["ROLES"][line[0]] = line[1]
+                if line[1] == "MASTER":
+                    config["MASTER_IPADDR"] = line[0]
+            else:
+                config[line[0]] = line[1]
+    return config
+
+
+def local_ip_addresses():
+    output = subprocess.check_output(["hostname", "--all-ip-addresses"])
+    return output.decode().split()
+
+
+def gpu_count():
+    """ GPUs on this node, as listed by nvidia-smi (0 without it) """
+    try:
+        output = subprocess.check_output(["nvidia-smi", "--list-gpus"])
+    except (OSError, subprocess.CalledProcessError):
+        return 0
+    return len(output.decode().splitlines())
+
+
+def gpu_rotation(worker_id, nworkers):
+    """ CUDA_VISIBLE_DEVICES of a worker: its own GPU first, then the others """
+    start = worker_id - 1
+    devices = list(range(start, nworkers)) + list(range(0, start))
+    return ",".join(str(device) for device in devices)
+
+
+class ClusterLauncher(object):
+    """ Starts and stops this node's share of the cluster
+
+    Parameters
+    ----------
+    config : dict
+        as returned by `read_config`
+    ipaddr : str
+        address of this node; the first local address by default
+    local_dir : str
+        worker spill directory, logs and the pid file
+    """
+
+    def __init__(self, config, ipaddr=None, local_dir=None):
+        self.config = config
+        self.ipaddr = ipaddr or self._my_address()
+        self.local_dir = local_dir or os.environ.get("DASK_LOCAL_DIR", "./.dask")
+        self.arch = config.get("ARCH", "GPU")
+        self.nworkers = int(config.get("NWORKERS", 0))
+        self.role = config["ROLES"].get(self.ipaddr, "WORKER")
+        self.scheduler_address = "%s:%s" % (config["MASTER_IPADDR"], config.get("DASK_SCHED_PORT", 8786))
+        self.pin = config.get("PIN", "NUMA") == "NUMA"
+        self.processes = []
+        self.extra_worker_args = []
+        self._placement = None
+
+    @property
+    def pid_file(self):
+        return os.path.join(self.local_dir, "cluster-%s.pids" % self.ipaddr)
+
+    def start(self, timeout=120):
+        """ Starts the scheduler (on the master) and all workers at once
+
+        Returns
+        -------
+        float
+            seconds until the scheduler reported every worker of this node
+        """
+        if self.arch == "GPU":
+            gpus = gpu_count()
+            if self.nworkers > gpus:
+                raise ValueError("NWORKERS=%d in the configuration, but this node has %d GPUs; "
+                                 "the number of workers must be less than or equal to the number of GPUs"
+                                 % (self.nworkers, gpus))
+        os.makedirs(self.local_dir, exist_ok=True)
+        start = time.time()
+        if self.role == "MASTER":
+            self._spawn("scheduler", ["dask-scheduler",
+                                      "--port", str(self.config.get("DASK_SCHED_PORT", 8786)),
+                                      "--dashboard-address", ":%s" % self.config.get("DASK_SCHED_BOKEH_PORT", 8787)])
+        # workers retry their connection, so they need not wait for the scheduler to bind
+        for worker_id in range(1, self.nworkers + 1):
+            name, command, env, cpus = self.worker_command(worker_id)
+            self._spawn(name, command, env, cpus)
+        self._write_pids()
+        self.wait_until_ready(timeout=timeout)
+        return time.time() - start
+
+    def worker_command(self, worker_id):
+        """ Returns (name, argv, extra environment, cpus to pin to or None) of one worker
+
+        CPU workers get one NUMA node's share of cores each (unless `PIN`
+        is `NONE` in dask.conf). Their thread count, and that of their
+        BLAS/OpenMP pools, follows from the size of that share unless
+        `NTHREADS` overrides it.
+        """
+        kind = "gpu" if self.arch == "GPU" else "cpu"
+        name = "%s_%s_%d" % (self.ipaddr, kind, worker_id)
+        nthreads = int(self.config.get("NTHREADS", 1))
+        cpus = None
+        env = {}
+        command = []
+        if self.arch == "CPU":
+            node, share = self.placement()[worker_id - 1]
+            nthreads = int(self.config.get("NTHREADS", len(share)))
+            env.update(thread_environment(nthreads))
+            if self.pin:
+                cpus = share
+                if shutil.which("numactl"):
+                    command = ["numactl", "--membind=%d" % node]
+        command += ["dask-worker", self.scheduler_address,
+                    "--host", self.ipaddr, "--no-nanny",
+                    "--nprocs", "1", "--nthreads", str(nthreads),
+                    "--memory-limit", "0", "--name", name,
+                    "--local-directory", os.path.join(self.local_dir, name)]
+        preload = self.config.get("PRELOAD")
+        if preload:
+            # relative to this directory, like dask.conf itself
+            command += ["--preload", os.path.join(os.path.dirname(os.path.abspath(__file__)), preload)]
+        command += self.extra_worker_args
+        if self.arch == "GPU":
+            env["CUDA_VISIBLE_DEVICES"] = gpu_rotation(worker_id, self.nworkers)
+            log = self.config.get("LOG")
+            if log == "DEBUG":
+                env["NCCL_DEBUG"] = "WARN"
+                command = ["cuda-memcheck"] + command
+            elif log == "INFO":
+                env["NCCL_DEBUG"] = "INFO"
+        return name, command, env, cpus
+
+    def placement(self):
+        """ (NUMA node, cpu ids) of every CPU worker of this node """
+        if self._placement is None:
+            self._placement = plan_workers(self.nworkers, numa_nodes())
+        return self._placement
+
+    def wait_until_ready(self, timeout=120, poll_interval=0.2):
+        """ Polls the scheduler until it reports all of this node's workers """
+        from distributed import Client
+
+        deadline = time.time() + timeout
+        host, port = self.scheduler_address.rsplit(":", 1)
+        while not _port_open(host, int(port)):
+            self._check_alive()
+            if time.time() > deadline:
+                raise TimeoutError("scheduler %s did not come up" % self.scheduler_address)
+            time.sleep(poll_interval)
+        client = Client(self.scheduler_address, timeout=max(1, deadline - time.time()))
+        try:
+            while True:
+                workers = client.scheduler_info()["workers"].values()
+                mine = [w for w in workers if str(w.get("name", "")).startswith(self.ipaddr + "_")]
+                if len(mine) >= self.nworkers:
+                    return len(mine)
+                self._check_alive()
+                if time.time() > deadline:
+                    raise TimeoutError("%d of %d workers registered after %ds"
+                                       % (len(mine), self.nworkers, timeout))
+                time.sleep(poll_interval)
+        finally:
+            client.close()
+
+    def stop(self, timeout=10):
+        """ Terminates the process groups recorded by `start` """
+        pids = [process.pid for process in self.processes]
+        if not pids and os.path.exists(self.pid_file):
+            with open(self.pid_file, "r") as f:
+                pids = [int(pid) for pid in f.read().split()]
+        _signal_groups(pids, signal.SIGTERM)
+        deadline = time.time() + timeout
+        while time.time() < deadline and any(self._alive(pid) for pid in pids):
+            time.sleep(0.1)
+        _signal_groups(pids, signal.SIGKILL)
+        if os.path.exists(self.pid_file):
+            os.remove(self.pid_file)
+        self.processes = []
+        return len(pids)
+
+    def _spawn(self, name, command, env=None, cpus=None):
+        environment = dict(os.environ)
+        environment.update(ENVIRONMENT)
+        environment.update(env or {})
+        envname = self.config.get("ENVNAME")
+        if envname and environment.get("CONDA_DEFAULT_ENV") != envname:
+            command = ["bash", "-c", "source activate %s && exec %s"
+                       % (envname, " ".join(_quote(arg) for arg in command))]
+        log = open(os.path.join(self.local_dir, "%s_log.txt" % name), "ab")
+        def setup():
+            os.setsid()
+            if cpus:
+                # inherited by every thread the worker and its libraries start
+                os.sched_setaffinity(0, cpus)
+
+        process = subprocess.Popen(command, env=environment, stdout=log, stderr=subprocess.STDOUT,
+                                   preexec_fn=setup)
+        log.close()
+        self.processes.append(process)
+        return process
+
+    def _write_pids(self):
+        with open(self.pid_file, "w") as f:
+            f.write("\n".join(str(process.pid) for process in self.processes))
+
+    def _check_alive(self):
+        for process in self.processes:
+            if process.poll() is not None:
+                raise RuntimeError("%s exited with status %d, see the logs in %s"
+                                   % (" ".join(process.args), process.returncode, self.local_dir))
+
+    def _alive(self, pid):
+        # our own children must be reaped, or they linger as zombies
+        for process in self.processes:
+            if process.pid == pid and process.poll() is not None:
+                return False
+        return _group_alive(pid)
+
+    def _my_address(self):
+        addresses = local_ip_addresses()
+        for address in addresses:
+            if address in self.config["ROLES"]:
+                return address
+        return addresses[0]
+
+
+def _port_open(host, port):
+    try:
+        socket.create_connection((host, port), timeout=0.5).close()
+        return True
+    except OSError:
+        return False
+
+
+def _signal_groups(pids, sig):
+    for pid in pids:
+        try:
+            os.killpg(pid, sig)
+        except OSError:
+            pass
+
+
+def _group_alive(pid):
+    try:
+        os.killpg(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+def _quote(arg):
+    return "'" + arg.replace("'", "'\\''") + "'"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Start or stop this node's Dask processes")
+    parser.add_argument("action", choices=["start", "stop"])
+    parser.add_argument("--conf", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "dask.conf"))
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for readiness")
+    args = parser.parse_args(argv)
+
+    launcher = ClusterLauncher(read_config(args.conf))
+    stopped = launcher.stop()
+    if stopped:
+        print("stopped %d previously started process(es)" % stopped)
+    if args.action == "start":
+        elapsed = launcher.start(timeout=args.timeout)
+        print("%s: %d %s worker(s) ready on %s in %.1fs"
+              % (launcher.role, launcher.nworkers, launcher.arch, launcher.scheduler_address, elapsed))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
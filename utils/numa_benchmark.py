@@ -0,0 +1,81 @@
+"""ETL throughput of CPU workers with and without NUMA pinning.
+
+Starts a local CPU cluster through `ClusterLauncher` twice, once with
+`PIN NONE` and once with `PIN NUMA`, runs the same pandas version of the
+mortgage delinquency features on synthetic loan histories, and reports
+rows/s for both.
+
+    python numa_benchmark.py [NWORKERS] [TASKS] [LOANS_PER_TASK]
+"""
+import sys
+import tempfile
+import time
+
+from dask_launcher import ClusterLauncher
+from numa_topology import numa_nodes
+
+
+def synthetic_etl(seed, nloans, months=60):
+    """ Ever/first-delinquency features of synthetic loans, mortgage style
+
+    Returns
+    -------
+    int
+        performance rows processed
+    """
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.RandomState(seed)
+    loan_id = np.repeat(np.arange(nloans, dtype=np.int64), months)
+    period = np.tile(np.arange(months, dtype=np.int32), nloans)
+    status = rng.poisson(0.3, size=len(loan_id)).astype(np.int32)
+    upb = rng.uniform(0, 500000, size=len(loan_id))
+    perf = pd.DataFrame({"loan_id": loan_id, "period": period, "status": status, "upb": upb})
+
+    ever = perf.groupby("loan_id")["status"].max().to_frame("max_status")
+    for months_late in (1, 3, 6):
+        ever["ever_%d" % (30 * months_late)] = (ever["max_status"] >= months_late).astype(np.int8)
+        first = perf[perf["status"] >= months_late].groupby("loan_id")["period"].min()
+        ever["delinquency_%d" % (30 * months_late)] = first
+    joined = perf.merge(ever.fillna(-1), how="left", left_on="loan_id", right_index=True)
+    joined["year_bucket"] = joined["period"] // 12
+    joined.groupby(["loan_id", "year_bucket"]).agg({"status": "max", "upb": "min"})
+    return len(perf)
+
+
+def run(pin, nworkers, ntasks, nloans, port):
+    from distributed import Client
+
+    config = {
+        "ROLES": {"127.0.0.1": "MASTER"}, "MASTER_IPADDR": "127.0.0.1",
+        "ARCH": "CPU", "NWORKERS": str(nworkers), "PIN": "NUMA" if pin else "NONE",
+        "DASK_SCHED_PORT": str(port), "DASK_SCHED_BOKEH_PORT": str(port + 1),
+    }
+    launcher = ClusterLauncher(config, ipaddr="127.0.0.1", local_dir=tempfile.mkdtemp(prefix="numa-bench-"))
+    try:
+        launcher.start()
+        client = Client(launcher.scheduler_address)
+        # warm up imports on every worker before timing
+        client.gather(client.map(synthetic_etl, range(nworkers), [1000] * nworkers, pure=False))
+        start = time.time()
+        rows = sum(client.gather(client.map(synthetic_etl, range(ntasks), [nloans] * ntasks, pure=False)))
+        elapsed = time.time() - start
+        client.close()
+    finally:
+        launcher.stop()
+    return rows / elapsed
+
+
+if __name__ == '__main__':
+    nodes = numa_nodes()
+    ncores = sum(len(cpus) for cpus in nodes.values())
+    nworkers = int(sys.argv[1]) if len(sys.argv) > 1 else max(1, ncores // 4)
+    ntasks = int(sys.argv[2]) if len(sys.argv) > 2 else 4 * nworkers
+    nloans = int(sys.argv[3]) if len(sys.argv) > 3 else 50000
+    print("%d NUMA node(s), %d cores, %d workers, %d tasks of %d loans"
+          % (len(nodes), ncores, nworkers, ntasks, nloans))
+    unpinned = run(False, nworkers, ntasks, nloans, port=8796)
+    pinned = run(True, nworkers, ntasks, nloans, port=8798)
+    print("unpinned: %12.0f rows/s" % unpinned)
+    print("pinned:   %12.0f rows/s  (%.2fx)" % (pinned, pinned / unpinned))
@@ -0,0 +1,100 @@
+"""NUMA topology discovery and CPU worker placement.
+
+On multi-socket machines unpinned CPU workers migrate across sockets and
+their pandas/NumPy kernels end up reading remote memory. `plan_workers`
+splits the cores of every NUMA node between the workers placed on it, so
+each worker (and its BLAS/OpenMP pools) stays on one node.
+"""
+import os
+import subprocess
+
+
+def parse_cpulist(text):
+    """ Parses a kernel cpulist such as "0-3,8-11" """
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def numa_nodes(sysfs="/sys/devices/system/node"):
+    """ Returns the CPUs of each NUMA node
+
+    Reads sysfs, falls back to `lscpu -p`, and finally treats the machine
+    as a single node.
+
+    Returns
+    -------
+    dict of node id -> sorted list of cpu ids
+    """
+    nodes = {}
+    if os.path.isdir(sysfs):
+        for name in os.listdir(sysfs):
+            if name.startswith("node") and name[4:].isdigit():
+                with open(os.path.join(sysfs, name, "cpulist")) as f:
+                    cpus = parse_cpulist(f.read())
+                if cpus:
+                    nodes[int(name[4:])] = cpus
+    if not nodes:
+        try:
+            output = subprocess.check_output(["lscpu", "-p=CPU,NODE"]).decode()
+            for line in output.splitlines():
+                if line.startswith("#"):
+                    continue
+                cpu, node = line.split(",")
+                nodes.setdefault(int(node or 0), []).append(int(cpu))
+        except (OSError, subprocess.CalledProcessError, ValueError):
+            nodes = {}
+    if not nodes:
+        nodes = {0: list(range(os.cpu_count() or 1))}
+    available = set(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None
+    if available is not None:
+        nodes = dict((node, [cpu for cpu in cpus if cpu in available]) for node, cpus in nodes.items())
+        nodes = dict((node, cpus) for node, cpus in nodes.items() if cpus)
+    return dict((node, sorted(cpus)) for node, cpus in nodes.items())
+
+
+def plan_workers(nworkers, nodes=None):
+    """ Spreads workers over the NUMA nodes and gives each a disjoint core set
+
+    Workers are distributed over nodes in proportion to their core count;
+    each node's cores are split evenly between its workers. With more
+    workers than cores, workers share single cores.
+
+    Returns
+    -------
+    list of (node id, list of cpu ids), one per worker
+    """
+    nodes = nodes if nodes is not None else numa_nodes()
+    total = sum(len(cpus) for cpus in nodes.values())
+    order = sorted(nodes, key=lambda node: -len(nodes[node]))
+    counts = dict((node, nworkers * len(nodes[node]) // total) for node in order)
+    leftover = nworkers - sum(counts.values())
+    for node in sorted(order, key=lambda node: -(nworkers * len(nodes[node]) % total))[:leftover]:
+        counts[node] += 1
+    plan = []
+    for node in sorted(nodes):
+        cpus = nodes[node]
+        n = counts[node]
+        for i in range(n):
+            share = cpus[i * len(cpus) // n:(i + 1) * len(cpus) // n] or [cpus[i % len(cpus)]]
+            plan.append((node, share))
+    return plan
+
+
+def thread_environment(nthreads):
+    """ Environment capping the BLAS/OpenMP pools of a worker to its cores """
+    value = str(nthreads)
+    return {
+        "OMP_NUM_THREADS": value,
+        "OPENBLAS_NUM_THREADS": value,
+        "MKL_NUM_THREADS": value,
+        "NUMEXPR_NUM_THREADS": value,
+        "NUMBA_NUM_THREADS": value,
+    }
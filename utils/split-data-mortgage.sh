@@ -5,13 +5,15 @@ SRC="/path/to/mortgage/perf"
 DST="/path/to/mortgage/perf_split"
 WORK="/path/to/mortgage/"
 
-if [ $# -ne 1 ]; then
+# SIZE defaults to SPLIT_SIZE in dask.conf, as calibrated by the E2E.py autotune mode
+CONF="$(dirname "$0")/dask.conf"
+SIZE=${1:-$(awk '$1 == "SPLIT_SIZE" { print $2 }' "$CONF" 2>/dev/null)}
+
+if [ -z "$SIZE" ]; then
     echo "Must supply size"
     exit 1
 fi
 
-SIZE=$1
-
 function logger() {
   TS=`date`
   echo "[$TS] $@"
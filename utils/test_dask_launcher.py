@@ -0,0 +1,39 @@
+import pytest
+
+import dask_launcher
+from dask_launcher import ClusterLauncher, gpu_rotation, read_config
+
+
+@pytest.fixture
+def config(tmp_path):
+    path = tmp_path / "dask.conf"
+    path.write_text("10.0.0.1 MASTER\n10.0.0.2 WORKER\nARCH GPU\nNWORKERS 4\nDASK_SCHED_PORT 8786\n")
+    return read_config(str(path))
+
+
+def test_read_config(config):
+    assert config["MASTER_IPADDR"] == "10.0.0.1"
+    assert config["ROLES"] == {"10.0.0.1": "MASTER", "10.0.0.2": "WORKER"}
+    assert config["NWORKERS"] == "4"
+
+
+def test_gpu_rotation_starts_with_the_worker_gpu():
+    assert gpu_rotation(1, 4) == "0,1,2,3"
+    assert gpu_rotation(3, 4) == "2,3,0,1"
+
+
+def test_more_workers_than_gpus_is_refused(config, tmp_path, monkeypatch):
+    monkeypatch.setattr(dask_launcher, "gpu_count", lambda: 2)
+    launcher = ClusterLauncher(config, ipaddr="10.0.0.2", local_dir=str(tmp_path))
+    monkeypatch.setattr(launcher, "_spawn", lambda *args: pytest.fail("nothing may start"))
+    with pytest.raises(ValueError, match="NWORKERS=4.*2 GPUs"):
+        launcher.start()
+
+
+def test_gpu_worker_command(config, tmp_path):
+    launcher = ClusterLauncher(config, ipaddr="10.0.0.2", local_dir=str(tmp_path))
+    name, command, env, cpus = launcher.worker_command(2)
+    assert name == "10.0.0.2_gpu_2"
+    assert command[:2] == ["dask-worker", "10.0.0.1:8786"]
+    assert env["CUDA_VISIBLE_DEVICES"] == "1,2,3,0"
+    assert cpus is None